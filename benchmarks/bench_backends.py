@@ -0,0 +1,93 @@
+"""Compare lookups/sec and registrations/sec of the identity backends.
+
+Backends are seeded with USERS users, then queried by CONCURRENCY
+coroutines at once, like a busy server would. Passwords are hashed
+with the cheapest bcrypt cost, to measure the storage, not bcrypt.
+
+The DemoBackend, LocalBackend and SQLiteBackend are measured in a
+temporary directory. Give a settings file to also measure its
+identity backend, like a PostgreSQL DataStore, preferably on a
+throwaway database as benchmark users are left in it.
+
+Run with: python benchmarks/bench_backends.py [settings.toml]
+"""
+
+import asyncio
+import sys
+import tempfile
+import time
+import uuid
+
+from kisee.hashing import BcryptHasher, HashingExecutor
+from kisee.identity_provider import load_idp
+from kisee.kisee import load_conf
+from kisee.providers.demo import DemoBackend
+from kisee.providers.local import LocalBackend
+from kisee.providers.sqlite import SQLiteBackend
+
+USERS = 10_000
+LOOKUPS = 20_000
+CONCURRENCY = 100
+
+
+async def per_second(calls, count) -> float:
+    """Await calls(i) for i in range(count), CONCURRENCY at a time,
+    return the number of calls per second.
+    """
+    queue = iter(range(count))
+
+    async def worker():
+        for i in queue:
+            await calls(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return count / (time.perf_counter() - start)
+
+
+async def bench(name, backend):
+    """Print registrations and lookups per second of a backend."""
+    backend.hashing = HashingExecutor(hasher=BcryptHasher(4))
+    prefix = uuid.uuid4().hex[:8]
+
+    def username(i):
+        return f"{prefix}-{i % USERS}"
+
+    def email(i):
+        return f"{prefix}-{i % USERS}@example.com"
+
+    async with backend:
+        registrations = await per_second(
+            lambda i: backend.register_user(username(i), "secret", email(i)), USERS
+        )
+        by_username = await per_second(
+            lambda i: backend.get_user_by_username(username(i)), LOOKUPS
+        )
+        by_email = await per_second(
+            lambda i: backend.get_user_by_email(email(i)),
+            # The DemoBackend scans all users for each email.
+            LOOKUPS if not isinstance(backend, DemoBackend) else LOOKUPS // 100,
+        )
+    backend.hashing.shutdown()
+    print(
+        f"{name:>14}: {registrations:8.0f} registrations/s "
+        f"{by_username:8.0f} lookups by username/s "
+        f"{by_email:8.0f} lookups by email/s"
+    )
+
+
+async def main():
+    """Measure each backend."""
+    with tempfile.TemporaryDirectory() as directory:
+        await bench("DemoBackend", DemoBackend({}))
+        await bench("LocalBackend", LocalBackend({"path": directory}))
+        await bench(
+            "SQLiteBackend", SQLiteBackend({"path": f"{directory}/users.sqlite3"})
+        )
+    if len(sys.argv) > 1:
+        section = load_conf(sys.argv[1])["identity_backend"]
+        await bench(section["class"].rsplit(".", 1)[-1], load_idp(section))
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main())
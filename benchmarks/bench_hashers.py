@@ -0,0 +1,48 @@
+"""Time and memory of a password hash, per algorithm and cost, to pick
+the [hashing] settings fitting the CPU to memory ratio of your hosts.
+
+Memory is per concurrent hash, so multiply it by the hashing workers.
+
+Run with: python benchmarks/bench_hashers.py
+"""
+
+import time
+
+from kisee.hashing import BcryptHasher, ScryptHasher
+
+MEASURES = 3  # hashes per cost, the best one is kept
+
+HASHERS = (
+    [(BcryptHasher(rounds), 4 * 1024) for rounds in (10, 11, 12, 13)]
+    + [(ScryptHasher(n=n, r=8, p=1), 128 * n * 8) for n in (2**14, 2**15, 2**16, 2**17)]
+    + [(ScryptHasher(n=2**14, r=8, p=p), 128 * 2**14 * 8) for p in (2, 4)]
+)
+
+
+def best_time(hasher) -> float:
+    """Best time of a few hashes, in seconds."""
+    times = []
+    for _ in range(MEASURES):
+        start = time.perf_counter()
+        hasher.hash(b"correct horse battery staple")
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    """Print a table of hash times and memory."""
+    print(
+        f"{'algorithm':>9}  {'parameters':<20} "
+        f"{'ms/hash':>8} {'hashes/s':>9} {'memory':>10}"
+    )
+    for hasher, memory in HASHERS:
+        elapsed = best_time(hasher)
+        params = ",".join(f"{key}={value}" for key, value in hasher.params().items())
+        print(
+            f"{hasher.name:>9}  {params:<20} {1000 * elapsed:8.1f} "
+            f"{1 / elapsed:9.1f} {memory / 1024:7.0f} KiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Compare cold and warm content negotiation in Serializers.__getitem__.
+
+Run with: python benchmarks/bench_negotiation.py
+"""
+
+import timeit
+
+from kisee.serializers import serializers
+
+ACCEPTS = (
+    "application/json",
+    "application/coreapi+json, application/json;q=0.9",
+    "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "*/*",
+)
+NUMBER = 20_000
+
+
+def cold():
+    """Negotiate with an empty cache, like before memoization."""
+    for accept in ACCEPTS:
+        serializers._negotiated.clear()  # pylint: disable=protected-access
+        serializers[accept]  # pylint: disable=pointless-statement
+
+
+def warm():
+    """Negotiate known Accept headers."""
+    for accept in ACCEPTS:
+        serializers[accept]  # pylint: disable=pointless-statement
+
+
+def main():
+    """Print the time per negotiation in both modes."""
+    for name, func in (("cold", cold), ("warm", warm)):
+        seconds = min(timeit.repeat(func, number=NUMBER, repeat=5))
+        per_call = seconds / (NUMBER * len(ACCEPTS)) * 1e9
+        print(f"{name}: {per_call:8.0f} ns per negotiation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Compare tokens/sec between PyJWT with PEM keys and the TokenCodec.
+
+Run with: python benchmarks/bench_tokens.py [settings.toml]
+"""
+
+import sys
+import time
+from datetime import datetime, timedelta
+
+import jwt
+
+from kisee.kisee import load_conf
+from kisee.tokens import TokenCodec
+
+DURATION = 2  # seconds per measure
+
+
+def per_second(func) -> float:
+    """Call func for DURATION seconds, return the number of calls per second."""
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        func()
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+def main():
+    """Print issued and verified tokens per second, before and after."""
+    settings = load_conf(sys.argv[1] if len(sys.argv) > 1 else "settings.toml")
+    private_key = settings["jwt"]["private_key"]
+    public_key = settings["jwt"]["public_key"]
+    codec = TokenCodec.from_settings(settings)
+
+    def claims():
+        return {
+            "iss": "example.com",
+            "sub": "john",
+            "exp": datetime.utcnow() + timedelta(hours=1),
+            "jti": "42",
+        }
+
+    token = codec.issue(claims())
+    measures = (
+        ("issue, PyJWT + PEM", lambda: jwt.encode(claims(), private_key, "ES256")),
+        ("issue, TokenCodec", lambda: codec.issue(claims())),
+        (
+            "verify, PyJWT + PEM",
+            lambda: jwt.decode(token, public_key, algorithms=["ES256"]),
+        ),
+        ("verify, TokenCodec", lambda: codec.verify(token)),
+    )
+    for name, func in measures:
+        print(f"{name:>20}: {per_second(func):8.0f} tokens/s")
+
+
+if __name__ == "__main__":
+    main()
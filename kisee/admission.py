@@ -0,0 +1,99 @@
+"""Admission control for CPU-bound credential verification.
+
+Without a limit, a burst of logins queues an unbounded amount of
+bcrypt work and latency grows for everybody, so verifications go
+through an AdmissionController: a few run, a few wait, the others are
+rejected right away with a 503.
+"""
+
+import asyncio
+import contextlib
+from collections import deque
+from typing import Any, Deque, Dict, Mapping, Optional
+
+from aiohttp import web
+
+
+class AdmissionController:
+    """Asynchronous context manager limiting concurrent verifications.
+
+    At most `concurrency` verifications run at once, and at most
+    `queue` others wait for a slot. When the queue is full,
+    HTTPServiceUnavailable is raised with a Retry-After header.
+
+    A `concurrency` of None means no limit.
+    """
+
+    def __init__(
+        self, concurrency: Optional[int] = None, queue: int = 0, retry_after: int = 1
+    ) -> None:
+        self.concurrency = concurrency
+        self.queue = queue
+        self.retry_after = retry_after
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @classmethod
+    def from_settings(
+        cls, settings: Mapping[str, Any], default_concurrency: int
+    ) -> "AdmissionController":
+        """Build a controller from the [admission] section of the settings."""
+        section = settings.get("admission", {})
+        concurrency = section.get("concurrency", default_concurrency)
+        return cls(
+            concurrency=concurrency,
+            queue=section.get("queue", 4 * concurrency),
+            retry_after=section.get("retry_after", 1),
+        )
+
+    async def __aenter__(self) -> "AdmissionController":
+        if self.concurrency is None or self.active < self.concurrency:
+            self.active += 1
+        elif len(self._waiters) >= self.queue:
+            self.rejected += 1
+            raise web.HTTPServiceUnavailable(
+                reason="Too many concurrent identifications, retry later.",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        else:
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.cancelled():
+                    with contextlib.suppress(ValueError):  # May be popped already.
+                        self._waiters.remove(waiter)
+                else:  # We were given a slot right before being cancelled.
+                    self._release()
+                raise
+        self.admitted += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        self._release()
+
+    def _release(self) -> None:
+        """Hand our slot to the next waiter, if any."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Current load and counters."""
+        return {
+            "concurrency": self.concurrency,
+            "queue": self.queue,
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+UNLIMITED = AdmissionController()
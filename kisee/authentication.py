@@ -7,13 +7,15 @@ from typing import Mapping, Tuple, Union
 import jwt
 from aiohttp import web
 
+from kisee.admission import UNLIMITED, AdmissionController
 from kisee.identity_provider import IdentityProvider, User
+from kisee.tokens import TokenPool
 
 Claims = Mapping[str, Union[str, bool, int]]
 
 
 async def _basic_authentication(
-    encoded: str, idp: IdentityProvider
+    encoded: str, idp: IdentityProvider, admission: AdmissionController = UNLIMITED
 ) -> Tuple[User, Claims]:
     """Authentication using Basic scheme."""
     try:
@@ -24,7 +26,8 @@ async def _basic_authentication(
         username, password = decoded.decode("utf-8").split(":", 1)
     except ValueError as err:
         raise web.HTTPUnauthorized(reason="Bad authorization") from err
-    user = await idp.identify(username, password)
+    async with admission:
+        user = await idp.identify(username, password)
     if user is None:
         raise web.HTTPUnauthorized(reason="Bad authorization")
     # Using basic auth means user knows its password so he's authorized to change it.
@@ -34,13 +37,13 @@ async def _basic_authentication(
 async def _jwt_authentication(
     token: str,
     idp: IdentityProvider,
-    public_key: str,
+    tokens: TokenPool,
     for_password_modification=False,
 ) -> Tuple[User, Claims]:
     """Authentication using JWT."""
     try:
-        claims = jwt.decode(token, public_key, algorithms=["ES256"])
-    except jwt.DecodeError as err:
+        claims = await tokens.verify(token)
+    except jwt.InvalidTokenError as err:
         raise web.HTTPUnauthorized(reason="Bad authorization") from err
     else:
         if for_password_modification:
@@ -66,12 +69,14 @@ async def authenticate_user(
         raise web.HTTPUnauthorized(reason="Missing authorization header")
     scheme, value = request.headers["Authorization"].strip().split(" ", 1)
     if scheme == "Basic":
-        return await _basic_authentication(value, request.app["identity_backend"])
+        return await _basic_authentication(
+            value, request.app["identity_backend"], request.app["admission"]
+        )
     if scheme == "Bearer":
         return await _jwt_authentication(
             value,
             request.app["identity_backend"],
-            request.app["settings"]["jwt"]["public_key"],
+            request.app["tokens"],
             for_password_modification=for_password_modification,
         )
     raise web.HTTPUnauthorized(reason="Bad authorization")
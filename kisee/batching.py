@@ -0,0 +1,120 @@
+"""Micro-batching: items submitted at about the same time are handled
+together, paying a per-call cost (sending them to another process or
+thread, committing a transaction) once per batch instead of once per
+item.
+"""
+
+import asyncio
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+# A (success, result or exception) pair per item of a batch.
+BatchResult = List[Tuple[bool, Any]]
+
+
+class Batching(NamedTuple):
+    """How items are grouped: each waits at most `window` seconds for
+    others, and at most `max_batch` are handled together.
+    """
+
+    window: float = 0.002
+    max_batch: int = 64
+
+    @classmethod
+    def from_section(cls, section: Mapping[str, Any]) -> "Batching":
+        """Read `batch_window` (in milliseconds) and `max_batch` from a
+        section of the settings.
+        """
+        return cls(
+            window=section.get("batch_window", 2) / 1000,
+            max_batch=section.get("max_batch", 64),
+        )
+
+
+class MicroBatcher:
+    """Groups items submitted within `batching.window` seconds into a
+    single call to `run`, a coroutine function receiving the items and
+    returning a BatchResult, so one bad item does not fail the others.
+    """
+
+    def __init__(
+        self, run: Callable[[List[Any]], Awaitable[BatchResult]], batching: Batching
+    ) -> None:
+        self.run = run
+        self.batching = batching
+        self.batches = 0
+        self.items = 0
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running: Set[asyncio.Future] = set()
+
+    def submit(self, item: Any) -> asyncio.Future:
+        """Queue an item, the returned future gets its result."""
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.batching.max_batch:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.batching.window, self.flush)
+        return future
+
+    def flush(self) -> None:
+        """Send pending items to `run` right away."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        futures = [future for _, future in batch]
+        job = asyncio.ensure_future(self.run([item for item, _ in batch]))
+        self._running.add(job)
+        job.add_done_callback(self._running.discard)
+        job.add_done_callback(lambda job: self._dispatch(job, futures))
+        self.batches += 1
+        self.items += len(batch)
+
+    async def drain(self) -> None:
+        """Flush pending items and wait for all batches to be handled."""
+        self.flush()
+        if self._running:
+            await asyncio.wait(self._running)
+
+    @staticmethod
+    def _dispatch(job: asyncio.Future, futures: List[asyncio.Future]) -> None:
+        """Hand each result of a finished batch to its future."""
+        if job.cancelled():
+            for future in futures:
+                future.cancel()
+            return
+        if job.exception() is not None:
+            results: BatchResult = [(False, job.exception())] * len(futures)
+        else:
+            results = job.result()
+        for future, (success, result) in zip(futures, results):
+            if future.done():  # Cancelled while we were working.
+                continue
+            if success:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    def stats(self) -> Dict[str, Any]:
+        """Batching counters."""
+        return {
+            "batches": self.batches,
+            "avg_batch_size": (
+                round(self.items / self.batches, 2) if self.batches else None
+            ),
+        }
@@ -0,0 +1,94 @@
+"""JSON encoding of all responses.
+
+Every response body goes through a single encoder, built once from
+the settings by get_encoder, so the pretty-printing can be disabled
+and a faster encoder used when one is installed.
+"""
+
+import functools
+import json
+from importlib import import_module
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Mapping
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+Encoder = Callable[[Any], bytes]
+
+JSON_STYLES = ("compact", "pretty")
+
+JSONL_CHUNK_SIZE = 100  # Documents per chunk.
+
+
+def _stdlib_dumps(json_encoder: json.JSONEncoder, obj: Any) -> bytes:
+    return json_encoder.encode(obj).encode("UTF-8")
+
+
+def stdlib_encoder(pretty: bool) -> Encoder:
+    """Encoder using the json module from the standard library.
+
+    Its output is the same as orjson_encoder's, so responses don't
+    change whether orjson is installed or not.
+    """
+    if pretty:
+        encoder = json.JSONEncoder(indent=2, ensure_ascii=False)
+    else:
+        encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+    return functools.partial(_stdlib_dumps, encoder)
+
+
+def orjson_encoder(pretty: bool) -> Encoder:
+    """Encoder using orjson, which directly writes bytes."""
+    return functools.partial(orjson.dumps, option=orjson.OPT_INDENT_2 if pretty else 0)
+
+
+def get_encoder(settings: Mapping[str, Any]) -> Encoder:
+    """Build the encoder described in the [server] section of the settings.
+
+    `json` is either "pretty" (the default) or "compact", and
+    `json_encoder` optionally gives the dotted path of a factory
+    receiving a `pretty` boolean and returning an Encoder.
+
+    Without `json_encoder`, orjson is used if installed, else the
+    standard library.
+    """
+    server = settings.get("server", {})
+    style = server.get("json", "pretty")
+    if style not in JSON_STYLES:
+        raise ValueError(
+            f"Unknown JSON style {style!r}, expected one of: {', '.join(JSON_STYLES)}."
+        )
+    pretty = style == "pretty"
+    if "json_encoder" in server:
+        module_path, factory_name = server["json_encoder"].rsplit(".", 1)
+        return getattr(import_module(module_path), factory_name)(pretty)
+    if orjson is not None:
+        return orjson_encoder(pretty)
+    return stdlib_encoder(pretty)
+
+
+def get_jsonl_encoder(settings: Mapping[str, Any]) -> Encoder:
+    """Like get_encoder, but never pretty-printing, for JSON lines."""
+    return get_encoder(
+        {**settings, "server": {**settings.get("server", {}), "json": "compact"}}
+    )
+
+
+async def jsonl_chunks(
+    documents: AsyncIterable[Any], encoder: Encoder
+) -> AsyncIterator[bytes]:
+    """Encode documents as JSON lines, JSONL_CHUNK_SIZE at a time, so
+    they can be streamed without holding them all in memory.
+
+    encoder must not be pretty-printing.
+    """
+    lines = []
+    async for document in documents:
+        lines.append(encoder(document))
+        if len(lines) >= JSONL_CHUNK_SIZE:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
@@ -0,0 +1,63 @@
+"""Export of all users, as JSON lines.
+
+Users are read from the backend iter_users async iterator and written
+by small chunks, so memory does not grow with the number of users.
+Passwords are never exported.
+
+Usage: kisee-export --settings settings.toml users.jsonl
+
+See also GET /users/?export=jsonl.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import sys
+from typing import IO
+
+from kisee.encoding import get_jsonl_encoder, jsonl_chunks
+from kisee.identity_provider import NotSupported, load_idp
+from kisee.kisee import load_conf
+
+
+def parse_args(args=None) -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Export all users of the configured identity backend as JSONL."
+    )
+    parser.add_argument(
+        "file", nargs="?", default="-", help='Defaults to "-", for stdout.'
+    )
+    parser.add_argument("--settings", default="settings.toml")
+    return parser.parse_args(args)
+
+
+async def export(args: argparse.Namespace, stdout: IO[bytes]) -> int:
+    """Export users to the file given in args, returns how many."""
+    settings = load_conf(args.settings)
+    encoder = get_jsonl_encoder(settings)
+    count = 0
+    async with load_idp(settings["identity_backend"]) as backend:
+        users = (user.as_dict() async for user in backend.iter_users())
+        with contextlib.ExitStack() as stack:
+            # Only close the file we opened, not stdout.
+            file = (
+                stdout
+                if args.file == "-"
+                else stack.enter_context(open(args.file, "wb"))
+            )
+            async for chunk in jsonl_chunks(users, encoder):
+                file.write(chunk)
+                count += chunk.count(b"\n")
+    return count
+
+
+def main() -> None:  # pragma: no cover
+    """Command line entry point."""
+    try:
+        count = asyncio.get_event_loop().run_until_complete(
+            export(parse_args(), sys.stdout.buffer)
+        )
+    except NotSupported:
+        sys.exit("The configured identity backend does not support exports.")
+    print(f"Exported {count} users.", file=sys.stderr)
@@ -0,0 +1,459 @@
+"""Password hashing helpers.
+
+bcrypt is slow on purpose, calling it from a coroutine freezes the
+whole event loop for the duration of the hash, so backends should
+hash and verify passwords through a HashingExecutor.
+
+How slow depends on the host, so the bcrypt cost can be calibrated to
+a target latency, and hashes made with another cost are rehashed on
+the next successful login.
+
+Hashes made by any of the HASHERS can be verified, they are told apart
+by their prefix. New hashes are made by the configured one, bcrypt by
+default, or scrypt which is memory-hard.
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+import bcrypt
+
+T = TypeVar("T")  # pylint: disable=invalid-name
+
+EXECUTOR_KINDS = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+
+DEFAULT_ROUNDS = 12  # Same as bcrypt.gensalt().
+MIN_ROUNDS = 4  # Limits of bcrypt.
+MAX_ROUNDS = 31
+BCRYPT_HASH_SIZE = 60  # "$2b$12$", then 53 chars of salt and key.
+
+SCRYPT_N = 2**14  # 16 MiB per hash with r=8.
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_SALT_SIZE = 16
+SCRYPT_KEY_SIZE = 32
+
+logger = logging.getLogger(__name__)
+
+
+def constant_time_compare(val1: bytes, val2: bytes) -> bool:
+    """Return True if the two strings are equal, False otherwise."""
+    return hmac.compare_digest(val1, val2)
+
+
+def verify(user_input: bytes, database_encoded: bytes) -> bool:
+    """Verity that the given encoded (hashed) password is matching the
+    expected password.
+
+    Works with the hashes of any of the HASHERS, like Python Blowfish
+    cipher ones (prefix is '$2b$') or scrypt ones (prefix is '$scrypt$').
+    """
+    hasher = identify(database_encoded)
+    if hasher is None:
+        raise ValueError("The encoded string is not a known password hash.")
+    return hasher.verify(user_input, database_encoded)
+
+
+def hash_password(password: bytes, rounds: int = DEFAULT_ROUNDS) -> bytes:
+    """Hash the given password using bcrypt with a fresh salt."""
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def bcrypt_rounds(encoded: bytes) -> Optional[int]:
+    """The cost a bcrypt hash was made with, like 12 for b"$2b$12$...",
+    None if it's not a bcrypt hash.
+    """
+    try:
+        prefix, algorithm, rounds, _ = encoded.split(b"$", 3)
+        return int(rounds) if not prefix and algorithm == b"2b" else None
+    except ValueError:
+        return None
+
+
+def calibrate(target_ms: float, clock: Callable[[], float] = time.perf_counter) -> int:
+    """Find the highest bcrypt cost hashing in at most target_ms
+    milliseconds on this host (at least MIN_ROUNDS).
+
+    Each extra round doubles the time, so it's extrapolated from a few
+    cheap hashes, then checked with a hash at the chosen cost.
+    """
+    samples = 5
+    start = clock()
+    for _ in range(samples):
+        bcrypt.hashpw(b"calibration", bcrypt.gensalt(MIN_ROUNDS))
+    elapsed_ms = max(1000 * (clock() - start) / samples, 1e-3)
+    rounds = MIN_ROUNDS + int(math.log2(max(target_ms / elapsed_ms, 1)))
+    rounds = min(rounds, MAX_ROUNDS)
+    while rounds > MIN_ROUNDS:
+        start = clock()
+        bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds))
+        if 1000 * (clock() - start) <= target_ms:
+            break
+        rounds -= 1
+    return rounds
+
+
+class Hasher(ABC):
+    """A password hashing algorithm.
+
+    Hashes start with the algorithm prefix and hold everything needed
+    to verify them (salt and parameters), so verify is a classmethod,
+    while instances hold the parameters of new hashes.
+    """
+
+    name = ""
+    prefix = b""
+
+    @classmethod
+    @abstractmethod
+    def from_settings(cls, section: Mapping[str, Any]) -> "Hasher":
+        """Build a hasher from the [hashing] section of the settings."""
+
+    @abstractmethod
+    def hash(self, password: bytes) -> bytes:
+        """Hash the given password with a fresh salt."""
+
+    @classmethod
+    @abstractmethod
+    def verify(cls, password: bytes, encoded: bytes) -> bool:
+        """Check password against a hash made by this algorithm."""
+
+    @classmethod
+    @abstractmethod
+    def is_valid(cls, encoded: bytes) -> bool:
+        """Tell if encoded is a well formed hash of this algorithm."""
+
+    @abstractmethod
+    def needs_rehash(self, encoded: bytes) -> bool:
+        """Tell if encoded was not made with these parameters."""
+
+    @abstractmethod
+    def params(self) -> Dict[str, Any]:
+        """Parameters of new hashes, for stats."""
+
+
+class BcryptHasher(Hasher):
+    """bcrypt, using 4 KiB of memory whatever the cost, and 2**rounds
+    iterations.
+    """
+
+    name = "bcrypt"
+    prefix = b"$2b$"
+
+    def __init__(self, rounds: int = DEFAULT_ROUNDS) -> None:
+        self.rounds = rounds
+
+    @classmethod
+    def from_settings(cls, section: Mapping[str, Any]) -> "BcryptHasher":
+        """The cost is bcrypt_rounds if given, else calibrated to
+        target_ms if given, else DEFAULT_ROUNDS.
+        """
+        rounds = section.get("bcrypt_rounds")
+        if rounds is None and "target_ms" in section:
+            rounds = calibrate(section["target_ms"])
+            logger.info("Calibrated bcrypt cost to %d rounds.", rounds)
+        return cls(rounds or DEFAULT_ROUNDS)
+
+    def hash(self, password: bytes) -> bytes:
+        return hash_password(password, self.rounds)
+
+    @classmethod
+    def verify(cls, password: bytes, encoded: bytes) -> bool:
+        return constant_time_compare(encoded, bcrypt.hashpw(password, encoded))
+
+    @classmethod
+    def is_valid(cls, encoded: bytes) -> bool:
+        rounds = bcrypt_rounds(encoded)
+        return (
+            rounds is not None
+            and MIN_ROUNDS <= rounds <= MAX_ROUNDS
+            and len(encoded) == BCRYPT_HASH_SIZE
+        )
+
+    def needs_rehash(self, encoded: bytes) -> bool:
+        return bcrypt_rounds(encoded) != self.rounds
+
+    def params(self) -> Dict[str, Any]:
+        return {"rounds": self.rounds}
+
+
+class ScryptHasher(Hasher):
+    """hashlib.scrypt, memory-hard: a hash needs 128 * n * r bytes of
+    memory, and p times that work, done sequentially.
+
+    Hashes look like $scrypt$ln=14,r=8,p=1$<salt>$<key>, ln being the
+    base 2 logarithm of n, salt and key being base64 encoded.
+    """
+
+    name = "scrypt"
+    prefix = b"$scrypt$"
+
+    # pylint: disable=invalid-name
+    def __init__(self, n: int = SCRYPT_N, r: int = SCRYPT_R, p: int = SCRYPT_P) -> None:
+        if n < 2 or n & (n - 1):
+            raise ValueError(f"scrypt n must be a power of 2, not {n}.")
+        self.n = n
+        self.r = r
+        self.p = p
+
+    @classmethod
+    def from_settings(cls, section: Mapping[str, Any]) -> "ScryptHasher":
+        """Parameters are scrypt_n, scrypt_r, and scrypt_p."""
+        return cls(
+            n=section.get("scrypt_n", SCRYPT_N),
+            r=section.get("scrypt_r", SCRYPT_R),
+            p=section.get("scrypt_p", SCRYPT_P),
+        )
+
+    @staticmethod
+    def _derive(  # pylint: disable=too-many-arguments
+        password: bytes, salt: bytes, n: int, r: int, p: int, size: int
+    ) -> bytes:
+        return hashlib.scrypt(
+            password,
+            salt=salt,
+            n=n,
+            r=r,
+            p=p,
+            maxmem=128 * r * (n + p + 2) + 1024 * 1024,
+            dklen=size,
+        )
+
+    @staticmethod
+    def _parse(encoded: bytes) -> Tuple[int, int, int, bytes, bytes]:
+        """Parameters, salt, and key of a scrypt hash."""
+        try:
+            _, _, params, salt, key = encoded.split(b"$")
+            values = dict(param.split(b"=") for param in params.split(b","))
+            return (
+                1 << int(values[b"ln"]),
+                int(values[b"r"]),
+                int(values[b"p"]),
+                base64.b64decode(salt, validate=True),
+                base64.b64decode(key, validate=True),
+            )
+        except (ValueError, KeyError) as err:
+            raise ValueError("Malformed scrypt hash.") from err
+
+    def hash(self, password: bytes) -> bytes:
+        salt = os.urandom(SCRYPT_SALT_SIZE)
+        key = self._derive(password, salt, self.n, self.r, self.p, SCRYPT_KEY_SIZE)
+        return b"%sln=%d,r=%d,p=%d$%s$%s" % (
+            self.prefix,
+            self.n.bit_length() - 1,
+            self.r,
+            self.p,
+            base64.b64encode(salt),
+            base64.b64encode(key),
+        )
+
+    @classmethod
+    def verify(cls, password: bytes, encoded: bytes) -> bool:
+        n, r, p, salt, key = cls._parse(encoded)
+        return constant_time_compare(
+            key, cls._derive(password, salt, n, r, p, len(key))
+        )
+
+    @classmethod
+    def is_valid(cls, encoded: bytes) -> bool:
+        try:
+            cls._parse(encoded)
+        except ValueError:
+            return False
+        return True
+
+    def needs_rehash(self, encoded: bytes) -> bool:
+        try:
+            return self._parse(encoded)[:3] != (self.n, self.r, self.p)
+        except ValueError:
+            return True
+
+    def params(self) -> Dict[str, Any]:
+        return {"n": self.n, "r": self.r, "p": self.p}
+
+
+HASHERS: Dict[str, Type[Hasher]] = {"bcrypt": BcryptHasher, "scrypt": ScryptHasher}
+
+
+def identify(encoded: bytes) -> Optional[Type[Hasher]]:
+    """The hasher which made the given hash, None if it's none of ours."""
+    for hasher in HASHERS.values():
+        if encoded.startswith(hasher.prefix):
+            return hasher
+    return None
+
+
+def _timed(func: Callable[..., T], submitted_at: float, *args: Any) -> Tuple[float, T]:
+    """Run func in a worker, also returning how long the job waited
+    in the queue before starting.
+
+    Uses wall clock time so it is comparable across processes.
+    """
+    waited = time.time() - submitted_at
+    return waited, func(*args)
+
+
+class HashingExecutor:  # pylint: disable=too-many-instance-attributes
+    """Runs CPU-bound password hashing in a bounded pool of workers.
+
+    The pool is only started on first use, so an executor can be
+    created before forking without leaking threads or processes to the
+    children.
+    """
+
+    def __init__(
+        self,
+        kind: str = "thread",
+        workers: Optional[int] = None,
+        hasher: Optional[Hasher] = None,
+    ) -> None:
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(
+                f"Unknown hashing executor {kind!r}, "
+                f"expected one of: {', '.join(EXECUTOR_KINDS)}."
+            )
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.hasher = hasher or BcryptHasher()
+        self.rehashed = 0
+        self._background: Set[asyncio.Future] = set()
+        self._executor: Optional[Executor] = None
+        self.in_flight = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @classmethod
+    def from_settings(cls, settings: Mapping[str, Any]) -> "HashingExecutor":
+        """Build an executor from the [hashing] section of the settings.
+
+        New hashes are made by the one of the HASHERS named by
+        algorithm, bcrypt by default, built from the same section.
+        """
+        section = settings.get("hashing", {})
+        algorithm = section.get("algorithm", "bcrypt")
+        if algorithm not in HASHERS:
+            raise ValueError(
+                f"Unknown hashing algorithm {algorithm!r}, "
+                f"expected one of: {', '.join(HASHERS)}."
+            )
+        return cls(
+            kind=section.get("executor", "thread"),
+            workers=section.get("workers"),
+            hasher=HASHERS[algorithm].from_settings(section),
+        )
+
+    @property
+    def executor(self) -> Executor:
+        """The underlying pool, started on first access."""
+        if self._executor is None:
+            self._executor = EXECUTOR_KINDS[self.kind](max_workers=self.workers)
+        return self._executor
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of jobs submitted but not yet picked by a worker."""
+        return max(0, self.in_flight - self.workers)
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """Run func(*args) in the pool, without blocking the event loop."""
+        loop = asyncio.get_event_loop()
+        self.in_flight += 1
+        try:
+            waited, result = await loop.run_in_executor(
+                self.executor, _timed, func, time.time(), *args
+            )
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return result
+
+    async def hash_password(self, password: str) -> str:
+        """Hash the given password, with the configured hasher."""
+        hashed = await self.run(self.hasher.hash, password.encode("utf-8"))
+        return hashed.decode("utf-8")
+
+    async def check_password(self, password: str, encoded: str) -> bool:
+        """Check the given password against its stored hash, whatever
+        the hasher which made it.
+        """
+        return await self.run(verify, password.encode("utf-8"), encoded.encode("utf-8"))
+
+    def needs_rehash(self, encoded: str) -> bool:
+        """Tell if the given hash was made by another hasher, or with
+        other parameters, than ours.
+        """
+        return self.hasher.needs_rehash(encoded.encode("utf-8"))
+
+    def rehash_in_background(
+        self, password: str, store: Callable[[str], Awaitable[Any]]
+    ) -> None:
+        """Hash password again with the current hasher, then give the new
+        hash to store, without making the caller wait.
+
+        Used on successful logins, when needs_rehash tells so, see
+        join to wait for them.
+        """
+        job = asyncio.ensure_future(self._rehash(password, store))
+        self._background.add(job)
+        job.add_done_callback(self._background.discard)
+
+    async def _rehash(
+        self, password: str, store: Callable[[str], Awaitable[Any]]
+    ) -> None:
+        try:
+            await store(await self.hash_password(password))
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to rehash a password.")
+        else:
+            self.rehashed += 1
+
+    async def join(self) -> None:
+        """Wait for the rehashes started in background, before closing
+        the identity backend they store to.
+        """
+        while self._background:
+            await asyncio.wait(self._background)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and wait times, to help sizing the pool."""
+        return {
+            "executor": self.kind,
+            "workers": self.workers,
+            "algorithm": self.hasher.name,
+            "parameters": self.hasher.params(),
+            "rehashed": self.rehashed,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "completed": self.completed,
+            "avg_wait_ms": round(1000 * self.total_wait / (self.completed or 1), 3),
+            "max_wait_ms": round(1000 * self.max_wait, 3),
+        }
+
+    def shutdown(self) -> None:
+        """Stop the pool, if it was started."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
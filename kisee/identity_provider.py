@@ -1,8 +1,29 @@
 """Abstract class representing an identity provider
 """
+import asyncio
 from abc import ABC, abstractmethod
 from importlib import import_module
-from typing import AsyncContextManager, Optional, Type
+from typing import (
+    Any,
+    AsyncContextManager,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Type,
+    cast,
+)
+
+from kisee.hashing import HashingExecutor
+
+# Called with the username and email of a user changed by another
+# process, or with None, None when any user may have changed.
+ChangeCallback = Callable[[Optional[str], Optional[str]], None]
 
 
 class ProviderError(Exception):
@@ -15,9 +36,17 @@ class UserAlreadyExist(ProviderError):
     """Exception raised by register_user on username/email conflict."""
 
 
+class NotSupported(ProviderError):
+    """Exception raised by the optional methods a backend does not
+    implement, like bulk_insert_users.
+    """
+
+
 class User:
     """Represents a logged-in, correctly identified, person."""
 
+    __slots__ = ("user_id", "username", "email", "is_superuser")
+
     def __init__(
         self, user_id: str, username: str, email: str, is_superuser: bool = False
     ) -> None:
@@ -26,6 +55,29 @@ class User:
         self.email = email
         self.is_superuser = is_superuser
 
+    def as_dict(self) -> Dict[str, Any]:
+        """Public fields of the user, as exported."""
+        return {
+            "user_id": self.user_id,
+            "username": self.username,
+            "email": self.email,
+            "is_superuser": self.is_superuser,
+        }
+
+
+class UserRecord(NamedTuple):
+    """A user to store, as given to bulk_insert_users.
+
+    password is already hashed, by one of kisee.hashing.HASHERS. Without
+    a user_id, backends make a new one.
+    """
+
+    username: str
+    email: str
+    password: str
+    is_superuser: bool = False
+    user_id: Optional[str] = None
+
 
 class IdentityProvider(
     AsyncContextManager, ABC
@@ -37,6 +89,22 @@ class IdentityProvider(
         self.options = options
         super().__init__()  # pylint: disable=no-value-for-parameter
 
+    @property
+    def hashing(self) -> HashingExecutor:
+        """Executor to use to hash and verify passwords.
+
+        Kisee gives the same executor to every backend, standalone
+        backends (like in tests) get their own.
+        """
+        # pylint: disable=attribute-defined-outside-init
+        if getattr(self, "_hashing", None) is None:
+            self._hashing = HashingExecutor()
+        return self._hashing
+
+    @hashing.setter
+    def hashing(self, executor: HashingExecutor) -> None:
+        self._hashing = executor  # pylint: disable=attribute-defined-outside-init
+
     @abstractmethod
     async def identify(self, username: str, password: str) -> Optional[User]:
         """Identifies the given username/password pair, returns a dict if found."""
@@ -57,6 +125,15 @@ class IdentityProvider(
     async def get_user_by_username(self, username) -> Optional[User]:
         """Get user with provided username"""
 
+    async def get_users_by_usernames(self, usernames: Sequence[str]) -> List[User]:
+        """Get the users with the given usernames, unknown ones are skipped.
+
+        Backends able to fetch them at once should override this, by
+        default they're fetched concurrently, one by one.
+        """
+        users = await asyncio.gather(*map(self.get_user_by_username, usernames))
+        return [user for user in users if user is not None]
+
     @abstractmethod
     async def set_password_for_user(self, user: User, password: str) -> None:
         """Set password for user"""
@@ -69,6 +146,194 @@ class IdentityProvider(
     async def is_connection_alive(self) -> bool:
         """Verify that connection with identity provider datastore is alive"""
 
+    async def bulk_insert_users(self, users: Sequence[UserRecord]) -> List[UserRecord]:
+        """Optionally store many users at once, used by kisee-import.
+
+        Users whose username or email is already taken are skipped and
+        returned.
+        """
+        raise NotSupported
+
+    async def list_users(self, after: Optional[str], limit: int) -> List[User]:
+        """Optionally list users, used by GET /users/.
+
+        Returns, sorted by username, at most `limit` users whose
+        username is greater than `after` (if not None), so listing the
+        Nth page costs the same as listing the first.
+        """
+        raise NotSupported
+
+    async def iter_users(self) -> AsyncIterator[User]:
+        """Optionally iterate over all users, used by kisee-export.
+
+        Implementations should not load all users in memory at once.
+        """
+        raise NotSupported
+        yield  # pylint: disable=unreachable  # Makes it an async generator.
+
+    def on_change(self, callback: ChangeCallback) -> None:
+        """Optionally call `callback` when users are changed by other
+        Kisee processes, used to invalidate caches.
+
+        Backends able to tell should override this, by default such
+        changes are not reported.
+        """
+
+    def forget(self, username: Optional[str], email: Optional[str]) -> None:
+        """Drop anything remembered about the user with this username
+        or email, as it changed, or about all users if either is None.
+
+        Overridden by wrappers remembering users (see CachingProvider
+        and CoalescingProvider), backends have nothing to drop.
+        """
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters exposed in /health, to help tuning the backend."""
+        return {}
+
+
+class ProviderWrapper(IdentityProvider):  # pylint: disable=too-many-ancestors
+    """Identity provider delegating everything to another one.
+
+    Base class for providers adding a feature (like caching) on top of
+    any backend: subclasses only override what they change.
+    """
+
+    def __init__(self, backend: IdentityProvider) -> None:
+        super().__init__(backend.options)
+        self.backend = backend
+
+    def __getattr__(self, name: str) -> Any:
+        # Backend specific attributes, like DemoBackend.storage.
+        return getattr(self.backend, name)
+
+    @property
+    def hashing(self) -> HashingExecutor:
+        return self.backend.hashing
+
+    @hashing.setter
+    def hashing(self, executor: HashingExecutor) -> None:
+        self.backend.hashing = executor
+
+    async def __aenter__(self):
+        await self.backend.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return await self.backend.__aexit__(exc_type, exc_value, traceback)
+
+    async def identify(self, username: str, password: str) -> Optional[User]:
+        return await self.backend.identify(username, password)
+
+    async def register_user(
+        self, username: str, password: str, email: str, is_superuser: bool = False
+    ):
+        return await self.backend.register_user(
+            username, password, email, is_superuser=is_superuser
+        )
+
+    async def get_user_by_email(self, email) -> Optional[User]:
+        return await self.backend.get_user_by_email(email)
+
+    async def get_user_by_username(self, username) -> Optional[User]:
+        return await self.backend.get_user_by_username(username)
+
+    async def get_users_by_usernames(self, usernames: Sequence[str]) -> List[User]:
+        return await self.backend.get_users_by_usernames(usernames)
+
+    async def set_password_for_user(self, user: User, password: str) -> None:
+        await self.backend.set_password_for_user(user, password)
+
+    async def send_reset_password_challenge(self, user: User, challenge: str) -> None:
+        await self.backend.send_reset_password_challenge(user, challenge)
+
+    async def is_connection_alive(self) -> bool:
+        return await self.backend.is_connection_alive()
+
+    async def bulk_insert_users(self, users: Sequence[UserRecord]) -> List[UserRecord]:
+        return await self.backend.bulk_insert_users(users)
+
+    async def list_users(self, after: Optional[str], limit: int) -> List[User]:
+        return await self.backend.list_users(after, limit)
+
+    async def iter_users(self) -> AsyncIterator[User]:
+        async for user in self.backend.iter_users():
+            yield user
+
+    def on_change(self, callback: ChangeCallback) -> None:
+        self.backend.on_change(callback)
+
+    def forget(self, username: Optional[str], email: Optional[str]) -> None:
+        self.backend.forget(username, email)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.backend.stats()
+
+
+class CompositeProvider(  # pylint: disable=too-many-ancestors,abstract-method
+    IdentityProvider
+):
+    """Identity provider built on top of several backends.
+
+    Base class for providers combining backends (like shards, or
+    tiers): they're all entered and exited with it, and share its
+    hashing executor.
+    """
+
+    def __init__(self, options: dict, backends: Iterable[IdentityProvider]) -> None:
+        super().__init__(options)
+        self.backends = list(backends)
+
+    @property
+    def hashing(self) -> HashingExecutor:
+        return super().hashing
+
+    @hashing.setter
+    def hashing(self, executor: HashingExecutor) -> None:
+        self._hashing = executor  # pylint: disable=attribute-defined-outside-init
+        for backend in self.backends:
+            backend.hashing = executor
+
+    async def __aenter__(self) -> "CompositeProvider":
+        entered: List[IdentityProvider] = []
+        try:
+            for backend in self.backends:
+                await backend.__aenter__()
+                entered.append(backend)
+        except BaseException:
+            for backend in reversed(entered):
+                await backend.__aexit__(None, None, None)
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        for backend in reversed(self.backends):
+            await backend.__aexit__(exc_type, exc_value, traceback)
+
+    def on_change(self, callback: ChangeCallback) -> None:
+        for backend in self.backends:
+            backend.on_change(callback)
+
+    def forget(self, username: Optional[str], email: Optional[str]) -> None:
+        for backend in self.backends:
+            backend.forget(username, email)
+
+    async def is_connection_alive(self) -> bool:
+        """Tell if all backends are alive."""
+        return all(
+            await asyncio.gather(
+                *(backend.is_connection_alive() for backend in self.backends)
+            )
+        )
+
+
+# Optional sub-tables of [identity_backend] and the wrapper they
+# enable, innermost first.
+WRAPPERS = {
+    "coalesce": "kisee.providers.coalescing.CoalescingProvider",
+    "cache": "kisee.providers.caching.CachingProvider",
+}
+
 
 def import_idp(dotted_path: str) -> Type[IdentityProvider]:
     """Import a dotted module path and return the attribute/class
@@ -89,3 +354,16 @@ def import_idp(dotted_path: str) -> Type[IdentityProvider]:
             'Module "%s" does not define a "%s" attribute/class'
             % (module_path, class_name)
         ) from err
+
+
+def load_idp(section: Mapping[str, Any]) -> IdentityProvider:
+    """Build the identity provider described by the [identity_backend]
+    section of the settings, wrapped as requested by its sub-tables
+    (see WRAPPERS).
+    """
+    backend = import_idp(section["class"])(options=section.get("options", {}))
+    for name, dotted_path in WRAPPERS.items():
+        if name in section:
+            wrapper = cast(Type[ProviderWrapper], import_idp(dotted_path))
+            backend = wrapper(backend, **section[name])
+    return backend
@@ -0,0 +1,270 @@
+"""Bulk import of users, from CSV or JSONL.
+
+Rows are read and imported in batches, so files of any size can be
+imported without loading them in memory. Plaintext passwords are
+hashed in worker processes by the configured hasher, passwords already
+hashed by any known hasher (like "$2b$" prefixed bcrypt ones) are kept
+as is once checked to be well formed, and each batch is stored by the
+backend bulk_insert_users method while the next one is being hashed.
+
+Usage: kisee-import users.csv
+"""
+
+import argparse
+import asyncio
+import contextlib
+import csv
+import itertools
+import json
+import sys
+import time
+from typing import IO, Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+from kisee.hashing import Hasher, HashingExecutor, identify
+from kisee.identity_provider import (
+    IdentityProvider,
+    NotSupported,
+    UserRecord,
+    load_idp,
+)
+from kisee.kisee import load_conf
+
+TRUE_VALUES = {"1", "t", "true", "y", "yes"}
+
+Row = Mapping[str, Any]
+
+
+def read_csv(file: IO[str]) -> Iterator[Row]:
+    """Rows of a CSV file with a header line."""
+    return csv.DictReader(file)
+
+
+def read_jsonl(file: IO[str]) -> Iterator[Row]:
+    """Rows of a file holding one JSON object per line."""
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+READERS = {"csv": read_csv, "jsonl": read_jsonl}
+
+
+def _hash_passwords(passwords: List[str], hasher: Hasher) -> List[str]:
+    """Hash the given passwords, in a worker process."""
+    return [
+        hasher.hash(password.encode("UTF-8")).decode("UTF-8") for password in passwords
+    ]
+
+
+def _is_hashed(password: str) -> bool:
+    return identify(password.encode("UTF-8")) is not None
+
+
+def _is_malformed_hash(password: str) -> bool:
+    """Tell if password looks hashed by a known hasher, but isn't a
+    valid hash of it, so no password would ever match it.
+    """
+    encoded = password.encode("UTF-8")
+    hasher = identify(encoded)
+    return hasher is not None and not hasher.is_valid(encoded)
+
+
+def _as_bool(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in TRUE_VALUES
+    return bool(value)
+
+
+def _chunks(items: List[Any], count: int) -> List[List[Any]]:
+    """Split items in at most count chunks of similar sizes."""
+    size = max(1, -(-len(items) // count))
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+class Importer:  # pylint: disable=too-many-instance-attributes
+    """Imports rows (mappings with username, email, password, and an
+    optional is_superuser) in the given backend.
+
+    Rejected rows (invalid or duplicated) are written, with the
+    reason but without the password, as JSON lines to `rejects` if
+    given.
+    """
+
+    def __init__(
+        self,
+        backend: IdentityProvider,
+        hashing: HashingExecutor,
+        batch_size: int = 1000,
+        rejects: Optional[IO[str]] = None,
+    ) -> None:
+        self.backend = backend
+        self.hashing = hashing
+        self.batch_size = batch_size
+        self.rejects = rejects
+        self.rows = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.started_at = time.perf_counter()
+
+    def reject(self, row: Row, reason: str) -> None:
+        """Report a row which has not been imported."""
+        if self.rejects is not None:
+            if isinstance(row, Mapping):
+                row = {key: value for key, value in row.items() if key != "password"}
+            self.rejects.write(json.dumps({"reason": reason, "row": row}) + "\n")
+
+    def validate(self, row: Row) -> Optional[UserRecord]:
+        """Build a record from row, its password still possibly in
+        plaintext, or reject it.
+        """
+        fields: Tuple[Any, ...]
+        try:
+            fields = (row["username"], row["email"], row["password"])
+        except (KeyError, TypeError):
+            fields = ()
+        if len(fields) != 3 or not all(
+            field and isinstance(field, str) for field in fields
+        ):
+            self.invalid += 1
+            self.reject(row, "username, email, and password are required")
+            return None
+        if _is_malformed_hash(fields[2]):
+            self.invalid += 1
+            self.reject(row, "malformed password hash")
+            return None
+        return UserRecord(*fields, _as_bool(row.get("is_superuser", False)))
+
+    async def prepare(self, rows: List[Row]) -> List[UserRecord]:
+        """Validate rows and hash their plaintext passwords, in parallel."""
+        records = [record for record in map(self.validate, rows) if record]
+        plaintexts = [
+            record.password for record in records if not _is_hashed(record.password)
+        ]
+        hashed = iter(
+            itertools.chain.from_iterable(
+                await asyncio.gather(
+                    *(
+                        self.hashing.run(_hash_passwords, chunk, self.hashing.hasher)
+                        for chunk in _chunks(plaintexts, self.hashing.workers)
+                    )
+                )
+            )
+        )
+        return [
+            (
+                record
+                if _is_hashed(record.password)
+                else record._replace(password=next(hashed))
+            )
+            for record in records
+        ]
+
+    async def insert(self, records: List[UserRecord]) -> None:
+        """Store records, reporting duplicates."""
+        skipped = await self.backend.bulk_insert_users(records)
+        self.inserted += len(records) - len(skipped)
+        self.duplicates += len(skipped)
+        for record in skipped:
+            self.reject(record._asdict(), "duplicate username or email")
+
+    async def run(
+        self, rows: Iterable[Row], progress: Optional[IO[str]] = None
+    ) -> None:
+        """Import all rows, hashing a batch while storing the previous one."""
+        rows = iter(rows)
+        storing: Optional[asyncio.Future] = None
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                break
+            self.rows += len(batch)
+            records = await self.prepare(batch)
+            if storing is not None:
+                await storing
+                if progress is not None:
+                    print(self.report(), file=progress)
+            storing = asyncio.ensure_future(self.insert(records))
+        if storing is not None:
+            await storing
+        if progress is not None:
+            print(self.report(), file=progress)
+
+    def report(self) -> str:
+        """Counters and throughput, as a human readable line."""
+        elapsed = time.perf_counter() - self.started_at
+        return (
+            f"{self.rows} rows read, {self.inserted} inserted, "
+            f"{self.duplicates} duplicates, {self.invalid} invalid, "
+            f"{self.rows / elapsed:.0f} rows/s"
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """Counters."""
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+        }
+
+
+def parse_args(args=None) -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Import users from a CSV or JSONL file in the configured "
+        "identity backend."
+    )
+    parser.add_argument("file", help='CSV or JSONL file, "-" for stdin.')
+    parser.add_argument("--settings", default="settings.toml")
+    parser.add_argument(
+        "--format",
+        choices=READERS,
+        help="Defaults to the file extension, or csv when reading stdin.",
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Processes hashing plaintext passwords, defaults to the number of CPUs.",
+    )
+    parser.add_argument(
+        "--rejects",
+        type=argparse.FileType("w"),
+        help="Write rejected rows (invalid or duplicates) to this file, as JSONL.",
+    )
+    return parser.parse_args(args)
+
+
+async def run(args: argparse.Namespace) -> Importer:
+    """Import the file given in args."""
+    settings = load_conf(args.settings)
+    file_format = args.format or ("jsonl" if args.file.endswith(".jsonl") else "csv")
+    hasher = HashingExecutor.from_settings(settings).hasher
+    hashing = HashingExecutor("process", args.workers, hasher)
+    backend = load_idp(settings["identity_backend"])
+    async with backend:
+        importer = Importer(backend, hashing, args.batch_size, args.rejects)
+        with contextlib.ExitStack() as stack:
+            # Only close the files we opened, not stdin or stdout.
+            if args.rejects not in (None, sys.stdout):
+                stack.enter_context(args.rejects)
+            file = (
+                sys.stdin
+                if args.file == "-"
+                else stack.enter_context(open(args.file, newline="", encoding="UTF-8"))
+            )
+            try:
+                await importer.run(READERS[file_format](file), progress=sys.stderr)
+            finally:
+                hashing.shutdown()
+    return importer
+
+
+def main() -> None:  # pragma: no cover
+    """Command line entry point."""
+    try:
+        importer = asyncio.get_event_loop().run_until_complete(run(parse_args()))
+    except NotSupported:
+        sys.exit("The configured identity backend does not support bulk imports.")
+    print(importer.report())
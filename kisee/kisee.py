@@ -20,8 +20,13 @@ from aiojobs.aiohttp import setup
 
 import kisee
 from kisee import views
-from kisee.identity_provider import import_idp
+from kisee.admission import AdmissionController
+from kisee.encoding import get_encoder, get_jsonl_encoder
+from kisee.hashing import HashingExecutor
+from kisee.identity_provider import load_idp
 from kisee.middlewares import enforce_json, vary_origin
+from kisee.supervisor import Supervisor
+from kisee.tokens import TokenPool
 
 Settings = Mapping[str, Any]
 
@@ -85,6 +90,11 @@ def parse_args(program_args=None) -> argparse.Namespace:
         help="Verbose mode (-vv for more, -vvv, …)",
         action="count",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes, defaults to [server] workers, or 1.",
+    )
     return parser.parse_args(program_args)
 
 
@@ -94,8 +104,15 @@ def create_app(settings: Optional[Settings] = None) -> web.Application:
     app = web.Application(middlewares=[enforce_json, vary_origin])
     setup(app)
     app["settings"] = settings
-    app["identity_backend"] = import_idp(settings["identity_backend"]["class"])(
-        options=settings["identity_backend"].get("options", {})
+    app["json_encoder"] = get_encoder(settings)
+    app["jsonl_encoder"] = get_jsonl_encoder(settings)
+    app["tokens"] = TokenPool.from_settings(settings)
+    app["discovery"] = views.render_discovery(settings)
+    app["identity_backend"] = load_idp(settings["identity_backend"])
+    app["hashing"] = HashingExecutor.from_settings(settings)
+    app["identity_backend"].hashing = app["hashing"]
+    app["admission"] = AdmissionController.from_settings(
+        settings, default_concurrency=app["hashing"].workers
     )
 
     async def on_startup_wrapper(app):
@@ -104,7 +121,10 @@ def create_app(settings: Optional[Settings] = None) -> web.Application:
 
     async def on_cleanup_wrapper(app):
         """Wrapper to call __exit__."""
+        await app["hashing"].join()
         await app["identity_backend"].__aexit__(None, None, None)
+        app["hashing"].shutdown()
+        app["tokens"].shutdown()
 
     app.on_startup.append(on_startup_wrapper)
     app.on_cleanup.append(on_cleanup_wrapper)
@@ -114,6 +134,7 @@ def create_app(settings: Optional[Settings] = None) -> web.Application:
             web.get("/", views.get_root),
             web.get("/users/", views.get_users),
             web.post("/users/", views.post_users),
+            web.post("/users/lookup", views.post_users_lookup),
             web.get("/jwt/", views.get_jwts),
             web.post("/jwt/", views.post_jwt),
             web.get("/jwt/{jid}", views.get_jwt),
@@ -154,6 +175,15 @@ def main() -> None:  # pragma: no cover
             settings.get("SENTRY_DSN"),
             integrations=[AioHttpIntegration()],
         )
+    workers = args.workers or settings["server"].get("workers", 1)
+    if workers > 1:
+        Supervisor(
+            settings,
+            workers,
+            app_factory=create_app,
+            load_settings=lambda: load_conf(args.settings),
+        ).run()
+        return
     app = create_app(settings)
     web.run_app(
         app, host=settings["server"]["host"], port=int(settings["server"]["port"])
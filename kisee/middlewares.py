@@ -4,7 +4,8 @@
 import json
 from typing import Awaitable, Callable
 
-from aiohttp import web
+from aiohttp import hdrs, web
+from multidict import CIMultiDict
 
 Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
 
@@ -16,13 +17,17 @@ async def vary_origin(request: web.Request, handler: Handler) -> web.StreamRespo
     See: https://github.com/aio-libs/aiohttp-cors/issues/351
     """
     response = await handler(request)
-    response.headers["Vary"] = "Origin"
+    if "Vary" in response.headers:
+        response.headers["Vary"] += ", Origin"
+    else:
+        response.headers["Vary"] = "Origin"
     return response
 
 
 @web.middleware
 async def enforce_json(request: web.Request, handler: Handler) -> web.StreamResponse:
     """Middleware enforcing a JSON response."""
+    headers: CIMultiDict = CIMultiDict()
     try:
         return await handler(request)
     except json.JSONDecodeError as err:
@@ -40,8 +45,13 @@ async def enforce_json(request: web.Request, handler: Handler) -> web.StreamResp
             "title": err.reason,
             "status": err.status,
         }
+        # Keep meaningful headers like Retry-After or Allow.
+        headers.update(err.headers)
+        headers.popall(hdrs.CONTENT_TYPE, None)
+        headers.popall(hdrs.CONTENT_LENGTH, None)
     return web.Response(
-        text=json.dumps(document, indent=4),
+        body=request.app["json_encoder"](document),
+        headers=headers,
         status=document["status"],  # type: ignore
         reason=document["title"],  # type: ignore
         content_type="application/problem+json",
@@ -0,0 +1,117 @@
+"""Caching of user lookups, on top of any identity backend.
+
+Bearer authentications and password recoveries look users up by
+username or email on every request, the CachingProvider keeps the
+found users for a while so the backend is not queried each time.
+
+Enabled by an [identity_backend.cache] section in the settings.
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from kisee.cache import LRUCache
+from kisee.identity_provider import IdentityProvider, ProviderWrapper, User
+
+
+class CachingProvider(ProviderWrapper):  # pylint: disable=too-many-ancestors
+    """Keeps up to `size` users found by get_user_by_username,
+    get_users_by_usernames, and get_user_by_email, for at most `ttl`
+    seconds.
+
+    Users are forgotten as soon as their password changes, or when a
+    user is registered with the same username or email, including by
+    other Kisee processes if the backend reports it (see
+    IdentityProvider.on_change). Unknown users are not cached, so they
+    can register right away.
+
+    Lookups running while users are forgotten don't cache what they
+    found, as it may predate the change.
+    """
+
+    def __init__(
+        self, backend: IdentityProvider, size: int = 1024, ttl: float = 60
+    ) -> None:
+        super().__init__(backend)
+        self.cache: LRUCache[Tuple[str, str], User] = LRUCache(size, ttl=ttl)
+        self.remote_invalidations = 0
+        self.generation = 0  # Bumped each time users are forgotten.
+        backend.on_change(self._changed_elsewhere)
+
+    async def get_user_by_username(self, username) -> Optional[User]:
+        user = self.cache.get(("username", username))
+        if user is None:
+            generation = self.generation
+            user = await self.backend.get_user_by_username(username)
+            if user is not None and generation == self.generation:
+                self.cache.set(("username", username), user)
+        return user
+
+    async def get_users_by_usernames(self, usernames: Sequence[str]) -> List[User]:
+        cached = {}
+        for username in usernames:
+            user = self.cache.get(("username", username))
+            if user is not None:
+                cached[username] = user
+        missing = [username for username in usernames if username not in cached]
+        if missing:
+            generation = self.generation
+            for user in await self.backend.get_users_by_usernames(missing):
+                if generation == self.generation:
+                    self.cache.set(("username", user.username), user)
+                cached[user.username] = user
+        return [cached[username] for username in usernames if username in cached]
+
+    async def get_user_by_email(self, email) -> Optional[User]:
+        user = self.cache.get(("email", email))
+        if user is None:
+            generation = self.generation
+            user = await self.backend.get_user_by_email(email)
+            if user is not None and generation == self.generation:
+                self.cache.set(("email", email), user)
+        return user
+
+    def invalidate(self, username: str, email: str) -> None:
+        """Forget the users cached under this username or email, here
+        and in the wrapped providers.
+        """
+        self.generation += 1
+        self.cache.pop(("username", username))
+        self.cache.pop(("email", email))
+        self.backend.forget(username, email)
+
+    def forget(self, username: Optional[str], email: Optional[str]) -> None:
+        if username is None or email is None:
+            self.generation += 1
+            self.cache.clear()
+            self.backend.forget(username, email)
+        else:
+            self.invalidate(username, email)
+
+    def _changed_elsewhere(self, username: Optional[str], email: Optional[str]) -> None:
+        self.remote_invalidations += 1
+        self.forget(username, email)
+
+    async def register_user(
+        self, username: str, password: str, email: str, is_superuser: bool = False
+    ):
+        try:
+            return await super().register_user(
+                username, password, email, is_superuser=is_superuser
+            )
+        finally:
+            self.invalidate(username, email)
+
+    async def set_password_for_user(self, user: User, password: str) -> None:
+        try:
+            await super().set_password_for_user(user, password)
+        finally:
+            self.invalidate(user.username, user.email)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "cache": {
+                **self.cache.stats(),
+                "remote_invalidations": self.remote_invalidations,
+            },
+        }
@@ -0,0 +1,235 @@
+"""Looks users up in a chain of identity backends, fastest first.
+
+Made to migrate off a legacy user store: users are looked up in each
+tier in turn, and new users are registered in the first one. With
+`migrate` enabled, users identified by a later tier are copied to the
+first one in the background, with the password they just gave and
+their user_id, so active users move to the fast tier by themselves.
+The first tier then has to support bulk_insert_users.
+
+Configured with a list of tiers, each described like an
+[identity_backend] section::
+
+    [identity_backend]
+      class = "kisee.providers.chain.ChainProvider"
+      [identity_backend.options]
+        migrate = true
+      [[identity_backend.options.tiers]]
+        class = "postgres_backend.pgsql.DataStore"
+        ...
+      [[identity_backend.options.tiers]]
+        class = "legacy.LegacyBackend"
+        ...
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Set
+
+from kisee.identity_provider import (
+    CompositeProvider,
+    IdentityProvider,
+    User,
+    UserAlreadyExist,
+    UserRecord,
+    load_idp,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ChainProvider(CompositeProvider):  # pylint: disable=too-many-ancestors
+    """Identity provider looking users up in the `tiers` backends, in
+    order.
+
+    Options:
+     - tiers: list of backends, as [identity_backend] sections, the
+       fastest first.
+     - migrate: copy users identified by a later tier to the first
+       one, defaults to false.
+
+    A user is only identified by the first tier knowing it, so once
+    migrated, the password stored by the slow tiers no longer matters.
+    """
+
+    def __init__(self, options: dict) -> None:
+        super().__init__(options, [load_idp(tier) for tier in options["tiers"]])
+        self.migrate = options.get("migrate", False)
+        self.migrated = 0
+        self.migration_failures = 0
+        self._background: Set[asyncio.Future] = set()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Wait for migrations in progress, before closing the tiers."""
+        while self._background:
+            await asyncio.wait(self._background)
+        await super().__aexit__(exc_type, exc_value, traceback)
+
+    @property
+    def first(self) -> IdentityProvider:
+        """The tier receiving new users."""
+        return self.backends[0]
+
+    @staticmethod
+    async def _knows(tier: IdentityProvider, login: str) -> bool:
+        return (
+            await tier.get_user_by_username(login) is not None
+            or await tier.get_user_by_email(login) is not None
+        )
+
+    async def _holder(self, username: str) -> Optional[IdentityProvider]:
+        """The first tier knowing username."""
+        for tier in self.backends:
+            if await tier.get_user_by_username(username) is not None:
+                return tier
+        return None
+
+    async def identify(self, username: str, password: str) -> Optional[User]:
+        """Identifies the given username/password pair, against the
+        first tier knowing the user.
+        """
+        for position, tier in enumerate(self.backends):
+            user = await tier.identify(username, password)
+            if user is not None:
+                if position and self.migrate:
+                    self._migrate_in_background(user, password)
+                return user
+            if await self._knows(tier, username):
+                return None  # Wrong password.
+        return None
+
+    def _migrate_in_background(self, user: User, password: str) -> None:
+        job = asyncio.ensure_future(self._migrate(user, password))
+        self._background.add(job)
+        job.add_done_callback(self._background.discard)
+
+    async def _copy(self, user: User, password: str) -> None:
+        """Copy user to the first tier, keeping its user_id.
+
+        Raises UserAlreadyExist if the first tier already knows it.
+        """
+        record = UserRecord(
+            user.username,
+            user.email,
+            await self.hashing.hash_password(password),
+            user.is_superuser,
+            user.user_id,
+        )
+        if await self.first.bulk_insert_users([record]):
+            raise UserAlreadyExist
+
+    async def _migrate(self, user: User, password: str) -> None:
+        """Copy user to the first tier, logging failures."""
+        try:
+            await self._copy(user, password)
+        except UserAlreadyExist:
+            pass  # Already migrated, by a concurrent login.
+        except Exception:  # pylint: disable=broad-except
+            self.migration_failures += 1
+            logger.exception("Failed to migrate user %s.", user.username)
+        else:
+            self.migrated += 1
+
+    async def register_user(
+        self, username: str, password: str, email: str, is_superuser: bool = False
+    ):
+        """Register the user in the first tier, unless any tier knows
+        its username or email.
+        """
+        for tier in self.backends:
+            if (
+                await tier.get_user_by_username(username) is not None
+                or await tier.get_user_by_email(email) is not None
+            ):
+                raise UserAlreadyExist
+        return await self.first.register_user(
+            username, password, email, is_superuser=is_superuser
+        )
+
+    async def get_user_by_email(self, email) -> Optional[User]:
+        for tier in self.backends:
+            user = await tier.get_user_by_email(email)
+            if user is not None:
+                return user
+        return None
+
+    async def get_user_by_username(self, username) -> Optional[User]:
+        for tier in self.backends:
+            user = await tier.get_user_by_username(username)
+            if user is not None:
+                return user
+        return None
+
+    async def get_users_by_usernames(self, usernames: Sequence[str]) -> List[User]:
+        """Get users from the first tier, then the missing ones from the
+        next tier, and so on.
+        """
+        found: Dict[str, User] = {}
+        for tier in self.backends:
+            missing = [username for username in usernames if username not in found]
+            if not missing:
+                break
+            for user in await tier.get_users_by_usernames(missing):
+                found[user.username] = user
+        return [found[username] for username in usernames if username in found]
+
+    async def set_password_for_user(self, user: User, password: str) -> None:
+        """Change the password in the first tier knowing the user, or
+        migrate the user to the first tier with its new password.
+        """
+        tier = await self._holder(user.username)
+        if tier is None:
+            return
+        if tier is self.first or not self.migrate:
+            await tier.set_password_for_user(user, password)
+            return
+        try:
+            await self._copy(user, password)
+        except UserAlreadyExist:  # Just migrated by a login.
+            await self.first.set_password_for_user(user, password)
+        else:
+            self.migrated += 1
+
+    async def send_reset_password_challenge(self, user: User, challenge: str) -> None:
+        tier = await self._holder(user.username)
+        await (tier or self.first).send_reset_password_challenge(user, challenge)
+
+    async def bulk_insert_users(self, users: Sequence[UserRecord]) -> List[UserRecord]:
+        return await self.first.bulk_insert_users(users)
+
+    async def list_users(self, after: Optional[str], limit: int) -> List[User]:
+        """Merge the pages of all tiers, sorted by username, users known
+        by several tiers being listed once.
+        """
+        pages = await asyncio.gather(
+            *(tier.list_users(after, limit) for tier in self.backends)
+        )
+        merged = heapq.merge(*pages, key=lambda user: user.username)
+        unique = (
+            next(users) for _, users in itertools.groupby(merged, lambda u: u.username)
+        )
+        return list(itertools.islice(unique, limit))
+
+    async def iter_users(self) -> AsyncIterator[User]:
+        """Iterate over the users of each tier in turn, skipping the ones
+        already seen, whose usernames are kept in memory.
+        """
+        seen: Set[str] = set()
+        for position, tier in enumerate(self.backends):
+            last = position == len(self.backends) - 1
+            async for user in tier.iter_users():
+                if user.username in seen:
+                    continue
+                if not last:
+                    seen.add(user.username)
+                yield user
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tiers": [tier.stats() for tier in self.backends],
+            "migrated": self.migrated,
+            "migration_failures": self.migration_failures,
+            "migrating": len(self._background),
+        }
@@ -0,0 +1,74 @@
+"""Coalescing of concurrent user lookups, on top of any identity backend.
+
+When many clients use the token of the same account at once, each of
+their requests looks the same user up. The CoalescingProvider only
+lets one of these lookups reach the backend, the others wait for it
+and get the same result.
+
+Enabled by an [identity_backend.coalesce] section in the settings.
+"""
+
+import asyncio
+import functools
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from kisee.identity_provider import IdentityProvider, ProviderWrapper, User
+
+
+class CoalescingProvider(ProviderWrapper):  # pylint: disable=too-many-ancestors
+    """Shares in-flight get_user_by_username and get_user_by_email
+    calls between concurrent callers asking for the same user.
+
+    Results are not kept once the backend replied, see CachingProvider
+    for this. Lookups started after a user is forgotten don't join the
+    ones in flight, which may predate the change.
+    """
+
+    def __init__(self, backend: IdentityProvider) -> None:
+        super().__init__(backend)
+        self._in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def _coalesce(
+        self, key: Tuple[str, str], lookup: Callable[[str], Awaitable[Optional[User]]]
+    ) -> Optional[User]:
+        if key in self._in_flight:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            future = asyncio.ensure_future(lookup(key[1]))
+            self._in_flight[key] = future
+            future.add_done_callback(functools.partial(self._landed, key))
+        # Shielded, so a cancelled caller does not cancel the others.
+        return await asyncio.shield(self._in_flight[key])
+
+    def _landed(self, key: Tuple[str, str], future: asyncio.Future) -> None:
+        if self._in_flight.get(key) is future:  # Not forgotten meanwhile.
+            del self._in_flight[key]
+
+    def forget(self, username: Optional[str], email: Optional[str]) -> None:
+        if username is None or email is None:
+            self._in_flight.clear()
+        else:
+            self._in_flight.pop(("username", username), None)
+            self._in_flight.pop(("email", email), None)
+        super().forget(username, email)
+
+    async def get_user_by_username(self, username) -> Optional[User]:
+        return await self._coalesce(
+            ("username", username), self.backend.get_user_by_username
+        )
+
+    async def get_user_by_email(self, email) -> Optional[User]:
+        return await self._coalesce(("email", email), self.backend.get_user_by_email)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "coalescing": {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._in_flight),
+            },
+        }
@@ -2,9 +2,10 @@
 anything and accepts almost any username/password pair.
 """
 import curses
+from bisect import bisect_right, insort
 from random import choices
 from string import ascii_letters, digits
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 
 from kisee.identity_provider import (
     IdentityProvider,
@@ -67,6 +68,7 @@ class DemoBackend(IdentityProvider):
                 is_superuser=True,
             )
         }
+        self.usernames = sorted(self.storage)  # For list_users.
 
     async def __aenter__(self):
         return self
@@ -103,6 +105,7 @@ class DemoBackend(IdentityProvider):
             password=password,
         )
         self.storage[username] = user
+        insort(self.usernames, username)
 
     async def send_reset_password_challenge(self, user: User, challenge: str):
         _colored_print(
@@ -124,6 +127,19 @@ class DemoBackend(IdentityProvider):
     async def set_password_for_user(self, user: User, password: str):
         self.storage[user.username].password = password
 
+    async def list_users(self, after: Optional[str], limit: int) -> List[User]:
+        """List users sorted by username, after the given one."""
+        start = 0 if after is None else bisect_right(self.usernames, after)
+        return [
+            self.storage[username]
+            for username in self.usernames[start : start + limit]
+        ]
+
+    async def iter_users(self) -> AsyncIterator[User]:
+        """Iterate over all users."""
+        for user in list(self.storage.values()):
+            yield user
+
     async def is_connection_alive(self) -> bool:
         """Verify that connection is alive, always return True"""
         return True
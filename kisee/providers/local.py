@@ -0,0 +1,367 @@
+"""Persistent identity backend, storing users in local files.
+
+Users are kept in memory, indexed by username and by email, so
+lookups never touch the disk. Changes are appended to a log before
+being visible, and every `snapshot_every` changes all users are
+written to a snapshot and the log is emptied. On startup the
+snapshot is read through mmap, then the log is replayed on top of it.
+
+Both files hold one user per line, as a JSON array:
+[user_id, username, email, password hash, is_superuser]. A line
+replaces the user with the same username, so replaying a log twice is
+harmless.
+
+Enabled with::
+
+    [identity_backend]
+    class = "kisee.providers.local.LocalBackend"
+    [identity_backend.options]
+    path = "/var/lib/kisee"
+"""
+
+import asyncio
+import functools
+import heapq
+import json
+import logging
+import mmap
+import os
+import uuid
+from bisect import bisect_right, insort
+from pathlib import Path
+from typing import IO, Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from kisee.identity_provider import IdentityProvider, User, UserAlreadyExist, UserRecord
+
+LOG = "users.log"
+SNAPSHOT = "users.snapshot"
+SNAPSHOT_EVERY = 100_000  # Changes logged between snapshots.
+
+logger = logging.getLogger(__name__)
+
+
+class LocalUser(User):
+    """A user and its password hash.
+
+    Never modified once stored: changes store a new LocalUser, so
+    snapshots can be written from a plain copy of the users.
+    """
+
+    __slots__ = ("password",)
+
+    def __init__(
+        self,
+        user_id: str,
+        username: str,
+        email: str,
+        password: str,
+        is_superuser: bool = False,
+    ) -> None:
+        super().__init__(user_id, username, email, is_superuser)
+        self.password = password
+
+    def dump(self) -> bytes:
+        """The user as a line of the log or snapshot."""
+        return (
+            json.dumps(
+                [
+                    self.user_id,
+                    self.username,
+                    self.email,
+                    self.password,
+                    self.is_superuser,
+                ],
+                separators=(",", ":"),
+            )
+            + "\n"
+        ).encode("UTF-8")
+
+
+def _read_lines(path: Path) -> Iterator[bytes]:
+    """Lines of the given file, if it exists, read through mmap."""
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with file:
+        if not os.fstat(file.fileno()).st_size:
+            return  # Empty files can't be mapped.
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield from iter(mapped.readline, b"")
+
+
+def _fsync_dir(path: Path) -> None:
+    """Make a rename in the given directory durable."""
+    descriptor = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+class LocalBackend(IdentityProvider):  # pylint: disable=too-many-instance-attributes
+    """Identity backend storing users in the `path` directory.
+
+    Options:
+     - path: directory of the log and snapshot, created if needed.
+     - snapshot_every: changes logged between snapshots, defaults to
+       100 000.
+     - fsync: set to false to not wait for changes to reach the disk,
+       faster, but the last changes may be lost on power failure.
+
+    There's a single writer: changes, and snapshots, are done one at a
+    time, while lookups are served from memory.
+
+    It does not send emails: to support password recoveries, subclass
+    it and implement send_reset_password_challenge.
+    """
+
+    def __init__(self, options: dict) -> None:
+        super().__init__(options)
+        self.path = Path(options["path"])
+        self.snapshot_every = options.get("snapshot_every", SNAPSHOT_EVERY)
+        self.fsync = options.get("fsync", True)
+        self.users: Dict[str, LocalUser] = {}
+        self.emails: Dict[str, LocalUser] = {}
+        self.usernames: List[str] = []  # Sorted, for list_users.
+        self.log: Optional[IO[bytes]] = None
+        self.logged = 0  # Changes in the log, since the last snapshot.
+        self.snapshots = 0
+        self._writing: Optional[asyncio.Lock] = None
+
+    async def __aenter__(self):
+        self._writing = asyncio.Lock()
+        await self._run(self._load)
+        # Kept open for appending until __aexit__.
+        self.log = open(self.path / LOG, "ab")  # pylint: disable=consider-using-with
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    @staticmethod
+    async def _run(func, *args) -> Any:
+        """Run blocking file operations out of the event loop."""
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+    def _load(self) -> None:
+        """Read the snapshot, then replay the log on top of it."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._replay(self.path / SNAPSHOT)
+        self.logged = self._replay(self.path / LOG)
+        self.usernames = sorted(self.users)
+        logger.info(
+            "Loaded %d users from %s, replayed %d changes.",
+            len(self.users),
+            self.path,
+            self.logged,
+        )
+
+    def _replay(self, path: Path) -> int:
+        """Store the users of the given file, returns how many.
+
+        An incomplete last line, left by a crash while appending to the
+        log, is cut off.
+        """
+        count = size = 0
+        complete = True
+        for line in _read_lines(path):
+            if not line.endswith(b"\n"):
+                complete = False
+                break
+            self._store(LocalUser(*json.loads(line)))
+            size += len(line)
+            count += 1
+        if not complete:
+            logger.warning("Dropping an incomplete change at the end of %s.", path)
+            os.truncate(str(path), size)
+        return count
+
+    def _store(self, user: LocalUser) -> None:
+        """Make user visible, replacing the one with the same username."""
+        previous = self.users.get(user.username)
+        if previous is not None and self.emails.get(previous.email) is previous:
+            del self.emails[previous.email]
+        self.users[user.username] = user
+        self.emails[user.email] = user
+
+    def _append(self, data: bytes) -> None:
+        assert self.log is not None, "LocalBackend used before being entered."
+        self.log.write(data)
+        self.log.flush()
+        if self.fsync:
+            os.fsync(self.log.fileno())
+
+    def _write_snapshot(self, users: List[LocalUser]) -> None:
+        """Write users to a new snapshot, then empty the log."""
+        assert self.log is not None, "LocalBackend used before being entered."
+        temporary = self.path / (SNAPSHOT + ".tmp")
+        with open(temporary, "wb") as file:
+            for start in range(0, len(users), 10_000):
+                chunk = users[start : start + 10_000]
+                file.write(b"".join(user.dump() for user in chunk))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(str(temporary), str(self.path / SNAPSHOT))
+        _fsync_dir(self.path)
+        self.log.truncate(0)
+
+    async def _commit(self, users: Sequence[LocalUser]) -> None:
+        """Log users, then make them visible.
+
+        Callers hold the _writing lock, so the log is written in order,
+        and snapshots don't miss concurrent changes.
+        """
+        await self._run(self._append, b"".join(user.dump() for user in users))
+        new = sorted({user.username for user in users} - self.users.keys())
+        if len(new) == 1:
+            insort(self.usernames, new[0])
+        elif new:  # One pass, instead of one insort per user.
+            self.usernames = list(heapq.merge(self.usernames, new))
+        for user in users:
+            self._store(user)
+        self.logged += len(users)
+        if self.logged >= self.snapshot_every:
+            await self._run(self._write_snapshot, list(self.users.values()))
+            self.logged = 0
+            self.snapshots += 1
+
+    def _lookup(self, login: str) -> Optional[LocalUser]:
+        return self.users.get(login) or self.emails.get(login)
+
+    async def identify(self, username: str, password: str) -> Optional[User]:
+        """Identifies the given username (or email) / password pair."""
+        user = self._lookup(username)
+        if user is None:
+            return None
+        if not await self.hashing.check_password(password, user.password):
+            return None
+        if self.hashing.needs_rehash(user.password):
+            self.hashing.rehash_in_background(
+                password,
+                functools.partial(self._replace_hash, user.username, user.password),
+            )
+        return user
+
+    async def register_user(
+        self, username: str, password: str, email: str, is_superuser: bool = False
+    ) -> None:
+        password_hashed = await self.hashing.hash_password(password)
+        assert self._writing is not None, "LocalBackend used before being entered."
+        async with self._writing:
+            if username in self.users or email in self.emails:
+                raise UserAlreadyExist
+            await self._commit(
+                [
+                    LocalUser(
+                        str(uuid.uuid4()),
+                        username,
+                        email,
+                        password_hashed,
+                        is_superuser,
+                    )
+                ]
+            )
+
+    async def bulk_insert_users(self, users: Sequence[UserRecord]) -> List[UserRecord]:
+        """Store users in a single log write, skipping conflicting ones."""
+        skipped = []
+        accepted: Dict[str, LocalUser] = {}
+        emails = set()
+        assert self._writing is not None, "LocalBackend used before being entered."
+        async with self._writing:
+            for record in users:
+                if (
+                    record.username in self.users
+                    or record.email in self.emails
+                    or record.username in accepted
+                    or record.email in emails
+                ):
+                    skipped.append(record)
+                    continue
+                accepted[record.username] = LocalUser(
+                    record.user_id or str(uuid.uuid4()),
+                    record.username,
+                    record.email,
+                    record.password,
+                    record.is_superuser,
+                )
+                emails.add(record.email)
+            if accepted:
+                await self._commit(list(accepted.values()))
+        return skipped
+
+    async def _replace_password(
+        self, username: str, password_hashed: str, old_hash: Optional[str] = None
+    ) -> None:
+        """Store a new password hash, if the user still exists and, if
+        old_hash is given, its hash did not change in the meantime.
+        """
+        assert self._writing is not None, "LocalBackend used before being entered."
+        async with self._writing:
+            user = self.users.get(username)
+            if user is None or old_hash is not None and user.password != old_hash:
+                return
+            await self._commit(
+                [
+                    LocalUser(
+                        user.user_id,
+                        user.username,
+                        user.email,
+                        password_hashed,
+                        user.is_superuser,
+                    )
+                ]
+            )
+
+    async def _replace_hash(self, username: str, old_hash: str, new_hash: str) -> None:
+        await self._replace_password(username, new_hash, old_hash)
+
+    async def set_password_for_user(self, user: User, password: str) -> None:
+        password_hashed = await self.hashing.hash_password(password)
+        await self._replace_password(user.username, password_hashed)
+
+    async def send_reset_password_challenge(self, user: User, challenge: str) -> None:
+        logger.warning(
+            "Can't send a password reset challenge to %s: LocalBackend "
+            "does not send emails.",
+            user.username,
+        )
+
+    async def get_user_by_email(self, email) -> Optional[User]:
+        """Get user with provided email address."""
+        return self.emails.get(email)
+
+    async def get_user_by_username(self, username) -> Optional[User]:
+        """Get user with provided username."""
+        return self.users.get(username)
+
+    async def get_users_by_usernames(self, usernames: Sequence[str]) -> List[User]:
+        """Get users with the provided usernames."""
+        found = (self.users.get(username) for username in usernames)
+        return [user for user in found if user is not None]
+
+    async def list_users(self, after: Optional[str], limit: int) -> List[User]:
+        """List users sorted by username, after the given one."""
+        start = 0 if after is None else bisect_right(self.usernames, after)
+        return [
+            self.users[username] for username in self.usernames[start : start + limit]
+        ]
+
+    async def iter_users(self) -> AsyncIterator[User]:
+        """Iterate over all users."""
+        for user in list(self.users.values()):
+            yield user
+
+    async def is_connection_alive(self) -> bool:
+        """Tell if the log is open."""
+        return self.log is not None and not self.log.closed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "users": len(self.users),
+            "logged": self.logged,
+            "snapshots": self.snapshots,
+        }
@@ -0,0 +1,220 @@
+"""Spreads users across several identity backends.
+
+Each username belongs to one shard, chosen by consistent hashing: the
+shards names are hashed to `replicas` points each on a ring, and a
+username belongs to the shard owning the first point following its
+own hash. Adding a shard only moves the usernames now falling before
+its points, about 1/N of them with N shards.
+
+Emails are not hashed, as the user is stored under its username: the
+shard of an email is remembered in a bounded index once known, else
+all shards are asked at once.
+
+Configured with a list of shards, each described like an
+[identity_backend] section, and named so renaming or reordering them
+does not move users::
+
+    [identity_backend]
+      class = "kisee.providers.sharded.ShardedProvider"
+      [[identity_backend.options.shards]]
+        name = "a"
+        class = "postgres_backend.pgsql.DataStore"
+        [identity_backend.options.shards.options]
+          host = "db-a.example.com"
+          ...
+      [[identity_backend.options.shards]]
+        name = "b"
+        ...
+"""
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+from bisect import bisect
+from collections import defaultdict
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from kisee.cache import LRUCache
+from kisee.identity_provider import (
+    CompositeProvider,
+    IdentityProvider,
+    User,
+    UserAlreadyExist,
+    UserRecord,
+    load_idp,
+)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(key.encode("UTF-8"), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    """Consistent hashing of keys to nodes."""
+
+    def __init__(self, nodes: Iterable[str], replicas: int = 64) -> None:
+        points = sorted(
+            (_hash(f"{node}-{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        if not points:
+            raise ValueError("A hash ring needs at least one node.")
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key: str) -> str:
+        """The node owning key."""
+        return self._nodes[bisect(self._hashes, _hash(key)) % len(self._nodes)]
+
+
+class ShardedProvider(CompositeProvider):  # pylint: disable=too-many-ancestors
+    """Identity provider storing users across the `shards` backends.
+
+    Options:
+     - shards: list of backends, as [identity_backend] sections with a
+       name (defaults to their position).
+     - replicas: points of each shard on the hash ring, defaults to 64.
+     - email_index_size: emails whose shard is remembered, defaults
+       to 100 000.
+
+    Usernames and emails are unique per shard. Registrations also check
+    that the email is not taken by another shard, but two concurrent
+    registrations of the same email on two shards can both succeed, as
+    can imports.
+    """
+
+    def __init__(self, options: dict) -> None:
+        self.shards: Dict[str, IdentityProvider] = {
+            str(shard.get("name", position)): load_idp(shard)
+            for position, shard in enumerate(options["shards"])
+        }
+        super().__init__(options, self.shards.values())
+        self.ring = HashRing(self.shards, options.get("replicas", 64))
+        self.email_index: LRUCache[str, str] = LRUCache(
+            options.get("email_index_size", 100_000)
+        )
+
+    def shard_for(self, username: str) -> IdentityProvider:
+        """The shard storing the given username."""
+        return self.shards[self.ring.node(username)]
+
+    async def _find_email(self, email: str) -> Optional[Tuple[str, User]]:
+        """Find the user with the given email, and its shard name."""
+        name = self.email_index.get(email)
+        if name is not None:
+            user = await self.shards[name].get_user_by_email(email)
+            if user is not None:
+                return name, user
+            self.email_index.pop(email)
+        users = await asyncio.gather(
+            *(shard.get_user_by_email(email) for shard in self.shards.values())
+        )
+        for name, user in zip(self.shards, users):
+            if user is not None:
+                self.email_index.set(email, name)
+                return name, user
+        return None
+
+    async def identify(self, username: str, password: str) -> Optional[User]:
+        """Identifies the given username (or email) / password pair.
+
+        The login is first looked up as a username, then as an email,
+        which can be stored by any shard.
+        """
+        shard = self.shard_for(username)
+        user = await shard.identify(username, password)
+        if user is None and "@" in username:
+            found = await self._find_email(username)
+            if found is not None and self.shards[found[0]] is not shard:
+                user = await self.shards[found[0]].identify(username, password)
+        return user
+
+    async def register_user(
+        self, username: str, password: str, email: str, is_superuser: bool = False
+    ):
+        if await self._find_email(email) is not None:
+            raise UserAlreadyExist
+        name = self.ring.node(username)
+        result = await self.shards[name].register_user(
+            username, password, email, is_superuser=is_superuser
+        )
+        self.email_index.set(email, name)
+        return result
+
+    async def get_user_by_email(self, email) -> Optional[User]:
+        found = await self._find_email(email)
+        return None if found is None else found[1]
+
+    async def get_user_by_username(self, username) -> Optional[User]:
+        return await self.shard_for(username).get_user_by_username(username)
+
+    async def get_users_by_usernames(self, usernames: Sequence[str]) -> List[User]:
+        """Get users from each shard at once, in the given order."""
+        by_shard: Dict[str, List[str]] = defaultdict(list)
+        for username in usernames:
+            by_shard[self.ring.node(username)].append(username)
+        found = {
+            user.username: user
+            for users in await asyncio.gather(
+                *(
+                    self.shards[name].get_users_by_usernames(names)
+                    for name, names in by_shard.items()
+                )
+            )
+            for user in users
+        }
+        return [found[username] for username in usernames if username in found]
+
+    async def set_password_for_user(self, user: User, password: str) -> None:
+        await self.shard_for(user.username).set_password_for_user(user, password)
+
+    async def send_reset_password_challenge(self, user: User, challenge: str) -> None:
+        await self.shard_for(user.username).send_reset_password_challenge(
+            user, challenge
+        )
+
+    async def bulk_insert_users(self, users: Sequence[UserRecord]) -> List[UserRecord]:
+        """Insert users in their shards, all shards at once."""
+        by_shard: Dict[str, List[UserRecord]] = defaultdict(list)
+        for user in users:
+            by_shard[self.ring.node(user.username)].append(user)
+        skipped = await asyncio.gather(
+            *(
+                self.shards[name].bulk_insert_users(records)
+                for name, records in by_shard.items()
+            )
+        )
+        return list(itertools.chain.from_iterable(skipped))
+
+    async def list_users(self, after: Optional[str], limit: int) -> List[User]:
+        """Merge the pages of all shards, sorted by username."""
+        pages = await asyncio.gather(
+            *(shard.list_users(after, limit) for shard in self.shards.values())
+        )
+        merged = heapq.merge(*pages, key=lambda user: user.username)
+        return list(itertools.islice(merged, limit))
+
+    async def iter_users(self) -> AsyncIterator[User]:
+        """Iterate over the users of each shard in turn."""
+        for shard in self.shards.values():
+            async for user in shard.iter_users():
+                yield user
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "shards": {name: shard.stats() for name, shard in self.shards.items()},
+            "email_index": self.email_index.stats(),
+        }
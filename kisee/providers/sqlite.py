@@ -0,0 +1,355 @@
+"""Identity backend storing users in an SQLite database.
+
+For single node deployments, lookups don't need a network hop. The
+database is in WAL mode, so reads don't wait for writes: they're done
+by a pool of reader threads, while a single writer thread commits
+registrations and password changes by batches, in one transaction per
+batch.
+
+Enabled with::
+
+    [identity_backend]
+    class = "kisee.providers.sqlite.SQLiteBackend"
+    [identity_backend.options]
+    path = "/var/lib/kisee/users.sqlite3"
+"""
+
+import asyncio
+import functools
+import logging
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+from kisee.batching import Batching, BatchResult, MicroBatcher
+from kisee.identity_provider import IdentityProvider, User, UserAlreadyExist, UserRecord
+
+T = TypeVar("T")  # pylint: disable=invalid-name
+
+Write = Tuple[str, Sequence[Any]]
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users(
+        user_id TEXT PRIMARY KEY,
+        username TEXT NOT NULL UNIQUE,
+        email TEXT NOT NULL UNIQUE,
+        password TEXT NOT NULL,
+        is_superuser INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+USER_COLUMNS = "user_id, username, email, is_superuser"
+
+IDENTIFY = f"""
+    SELECT {USER_COLUMNS}, password, 0 AS precedence FROM users WHERE username = ?
+    UNION ALL
+    SELECT {USER_COLUMNS}, password, 1 AS precedence FROM users WHERE email = ?
+    ORDER BY precedence
+    LIMIT 1
+"""
+
+GET_USER_BY_EMAIL = f"SELECT {USER_COLUMNS} FROM users WHERE email = ?"
+
+GET_USER_BY_USERNAME = f"SELECT {USER_COLUMNS} FROM users WHERE username = ?"
+
+LIST_USERS = f"""
+    SELECT {USER_COLUMNS} FROM users
+    WHERE username > ? ORDER BY username LIMIT ?
+"""
+
+INSERT_USER = """
+    INSERT INTO users(user_id, username, email, password, is_superuser)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+INSERT_USER_UNLESS_TAKEN = INSERT_USER.replace("INSERT", "INSERT OR IGNORE", 1)
+
+# Stay below SQLITE_MAX_VARIABLE_NUMBER of old SQLite versions.
+MAX_VARIABLES = 500
+
+ITER_USERS_PAGE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def _user(row: sqlite3.Row) -> User:
+    return User(
+        row["user_id"], row["username"], row["email"], bool(row["is_superuser"])
+    )
+
+
+def _create_schema(connection: sqlite3.Connection) -> None:
+    # Fetch the new journal mode, an unfinished statement would make
+    # the next COMMIT of this connection fail.
+    connection.execute("PRAGMA journal_mode = WAL").fetchone()
+    connection.execute(SCHEMA)
+
+
+def _write_batch(connection: sqlite3.Connection, writes: List[Write]) -> BatchResult:
+    """Run writes in a single transaction, in the writer thread.
+
+    A write failing on a constraint only fails itself, like its own
+    transaction would have.
+    """
+    results: BatchResult = []
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        for statement, parameters in writes:
+            try:
+                results.append(
+                    (True, connection.execute(statement, parameters).rowcount)
+                )
+            except sqlite3.IntegrityError as err:
+                results.append((False, err))
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return results
+
+
+def _bulk_insert(
+    connection: sqlite3.Connection, rows: List[Tuple[Any, ...]]
+) -> List[bool]:
+    """Insert rows in a single transaction, tell which ones were."""
+    inserted = []
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        for row in rows:
+            cursor = connection.execute(INSERT_USER_UNLESS_TAKEN, row)
+            inserted.append(cursor.rowcount == 1)
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return inserted
+
+
+class SQLiteBackend(IdentityProvider):  # pylint: disable=too-many-instance-attributes
+    """Identity backend storing users in the SQLite database at `path`.
+
+    Options:
+     - path: the database file, created if needed.
+     - readers: reader threads, defaults to 4.
+     - batch_window: in milliseconds, how long a write waits for
+       others to be committed with, defaults to 2.
+     - max_batch: most writes committed together, defaults to 64.
+     - fsync: set to false to not wait for commits to reach the disk,
+       faster, but the last ones may be lost on power failure.
+
+    It does not send emails: to support password recoveries, subclass
+    it and implement send_reset_password_challenge.
+    """
+
+    def __init__(self, options: dict) -> None:
+        super().__init__(options)
+        self.path = options["path"]
+        self.readers = options.get("readers", 4)
+        self.fsync = options.get("fsync", True)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._reader: Optional[ThreadPoolExecutor] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._batcher = MicroBatcher(
+            functools.partial(self.run_writer, _write_batch),
+            Batching.from_section(options),
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """The connection of the current thread, opened on first use."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, isolation_level=None, check_same_thread=False
+            )
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA busy_timeout = 5000")
+            connection.execute(
+                "PRAGMA synchronous = " + ("FULL" if self.fsync else "NORMAL")
+            )
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def _call(self, func: Callable[..., T], *args: Any) -> T:
+        return func(self._connection(), *args)
+
+    async def run_reader(self, func: Callable[..., T], *args: Any) -> T:
+        """Run func(connection, *args) in a reader thread."""
+        return await asyncio.get_event_loop().run_in_executor(
+            self._reader, self._call, func, *args
+        )
+
+    async def run_writer(self, func: Callable[..., T], *args: Any) -> T:
+        """Run func(connection, *args) in the writer thread."""
+        return await asyncio.get_event_loop().run_in_executor(
+            self._writer, self._call, func, *args
+        )
+
+    async def _fetchone(self, query: str, *parameters: Any) -> Optional[sqlite3.Row]:
+        return await self.run_reader(
+            lambda connection: connection.execute(query, parameters).fetchone()
+        )
+
+    async def _fetchall(self, query: str, *parameters: Any) -> List[sqlite3.Row]:
+        return await self.run_reader(
+            lambda connection: connection.execute(query, parameters).fetchall()
+        )
+
+    async def __aenter__(self):
+        self._reader = ThreadPoolExecutor(
+            max_workers=self.readers, thread_name_prefix="kisee-sqlite-reader"
+        )
+        self._writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="kisee-sqlite-writer"
+        )
+        await self.run_writer(_create_schema)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self._writer is not None:
+            await self._batcher.drain()
+        for executor in (self._reader, self._writer):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        self._reader = self._writer = None
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    async def identify(self, username: str, password: str) -> Optional[User]:
+        """Identifies the given username (or email) / password pair."""
+        row = await self._fetchone(IDENTIFY, username, username)
+        if row is None:
+            return None
+        if not await self.hashing.check_password(password, row["password"]):
+            return None
+        if self.hashing.needs_rehash(row["password"]):
+            self.hashing.rehash_in_background(
+                password,
+                functools.partial(self._replace_hash, row["user_id"], row["password"]),
+            )
+        return _user(row)
+
+    async def register_user(
+        self, username: str, password: str, email: str, is_superuser: bool = False
+    ) -> None:
+        password_hashed = await self.hashing.hash_password(password)
+        try:
+            await self._batcher.submit(
+                (
+                    INSERT_USER,
+                    (str(uuid.uuid4()), username, email, password_hashed, is_superuser),
+                )
+            )
+        except sqlite3.IntegrityError as err:
+            raise UserAlreadyExist from err
+
+    async def bulk_insert_users(self, users: Sequence[UserRecord]) -> List[UserRecord]:
+        """Insert users in a single transaction, skipping conflicting ones."""
+        inserted = await self.run_writer(
+            _bulk_insert,
+            [
+                (
+                    user.user_id or str(uuid.uuid4()),
+                    user.username,
+                    user.email,
+                    user.password,
+                    user.is_superuser,
+                )
+                for user in users
+            ],
+        )
+        return [user for user, ok in zip(users, inserted) if not ok]
+
+    async def _replace_hash(self, user_id: str, old_hash: str, new_hash: str) -> None:
+        """Store a rehashed password, unless it changed in the meantime."""
+        await self._batcher.submit(
+            (
+                "UPDATE users SET password = ? WHERE user_id = ? AND password = ?",
+                (new_hash, user_id, old_hash),
+            )
+        )
+
+    async def set_password_for_user(self, user: User, password: str) -> None:
+        password_hashed = await self.hashing.hash_password(password)
+        await self._batcher.submit(
+            (
+                "UPDATE users SET password = ? WHERE username = ?",
+                (password_hashed, user.username),
+            )
+        )
+
+    async def send_reset_password_challenge(self, user: User, challenge: str) -> None:
+        logger.warning(
+            "Can't send a password reset challenge to %s: SQLiteBackend "
+            "does not send emails.",
+            user.username,
+        )
+
+    async def get_user_by_email(self, email) -> Optional[User]:
+        """Get user with provided email address."""
+        row = await self._fetchone(GET_USER_BY_EMAIL, email)
+        return None if row is None else _user(row)
+
+    async def get_user_by_username(self, username) -> Optional[User]:
+        """Get user with provided username."""
+        row = await self._fetchone(GET_USER_BY_USERNAME, username)
+        return None if row is None else _user(row)
+
+    async def get_users_by_usernames(self, usernames: Sequence[str]) -> List[User]:
+        """Get users with the provided usernames, a few hundreds per query."""
+        users: List[User] = []
+        for start in range(0, len(usernames), MAX_VARIABLES):
+            chunk = usernames[start : start + MAX_VARIABLES]
+            rows = await self._fetchall(
+                f"SELECT {USER_COLUMNS} FROM users "
+                f"WHERE username IN ({', '.join('?' * len(chunk))})",
+                *chunk,
+            )
+            users.extend(map(_user, rows))
+        return users
+
+    async def list_users(self, after: Optional[str], limit: int) -> List[User]:
+        """List users sorted by username, after the given one."""
+        rows = await self._fetchall(LIST_USERS, after or "", limit)
+        return [_user(row) for row in rows]
+
+    async def iter_users(self) -> AsyncIterator[User]:
+        """Iterate over all users, by pages of ITER_USERS_PAGE."""
+        after = None
+        while True:
+            users = await self.list_users(after, ITER_USERS_PAGE)
+            for user in users:
+                yield user
+            if len(users) < ITER_USERS_PAGE:
+                return
+            after = users[-1].username
+
+    async def is_connection_alive(self) -> bool:
+        """Verify that the database can be read."""
+        if self._reader is None:
+            return False
+        try:
+            return await self._fetchone("SELECT 1") is not None
+        except (RuntimeError, sqlite3.Error):
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"readers": self.readers, **self._batcher.stats()}
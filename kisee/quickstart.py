@@ -5,6 +5,8 @@ from typing import Any, Callable, Dict, Optional, Union
 
 import toml
 
+from kisee.hashing import calibrate
+
 ConfigurationValue = Union[str, int, bool]
 Config = Dict[str, Dict[str, ConfigurationValue]]
 
@@ -62,9 +64,25 @@ def questions() -> Dict[str, Any]:
     responses["server"]["debug"] = input_or_default(
         "Debug mode []: ", "No", validator=boolean
     )
+    responses["hashing"] = {
+        "target_ms": input_or_default(
+            "Target password verification time, in milliseconds []: ",
+            "250",
+            validator=int,
+        )
+    }
     return responses
 
 
+def add_bcrypt_rounds(config: Config) -> None:
+    """Replace the hashing target time by the bcrypt cost meeting it on
+    this host, so it's not calibrated again on each start.
+    """
+    target_ms = config["hashing"].pop("target_ms")
+    print(f"Calibrating bcrypt for {target_ms}ms...")
+    config["hashing"]["bcrypt_rounds"] = calibrate(int(target_ms))
+
+
 def add_ec_keys(config: Config) -> None:
     """Invokes openssl to create a new secp256k1 key pair."""
     private_key_process = run(
@@ -88,6 +106,7 @@ def main() -> None:
     """Kisee-quickstart entry point."""
     config = questions()
     add_ec_keys(config)
+    add_bcrypt_rounds(config)
     print("Writing configuration file to settings.toml...")
     with open("settings.toml", "w") as settings_file:
         toml.dump(config, settings_file)
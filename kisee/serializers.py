@@ -3,7 +3,7 @@ various representations of our resources like mason, json-ld, hal, ...
 
 """
 
-import json
+import hashlib
 from collections import OrderedDict
 from typing import Any, Dict, List, Optional, Set, Union
 from urllib.parse import urljoin
@@ -11,14 +11,29 @@ from urllib.parse import urljoin
 from aiohttp import web
 from werkzeug.http import parse_accept_header
 
+from kisee.cache import LRUCache
+from kisee.encoding import Encoder
+
+_NOT_NEGOTIATED = object()
+
 
 class Serializers(dict):
-    """This class only holds available serializers as an easy to use dict."""
+    """This class only holds available serializers as an easy to use dict.
 
-    def __init__(self, **kwargs):
+    Real traffic only sends a handful of distinct Accept headers, so
+    negotiation results are kept in a small LRU cache, keyed by the
+    raw header, and cleared each time a serializer is registered.
+    """
+
+    def __init__(self, negotiation_cache_size: int = 128, **kwargs):
         self.default = None
+        self._negotiated: LRUCache[str, Any] = LRUCache(negotiation_cache_size)
         super().__init__(**kwargs)
 
+    def __setitem__(self, media_type: str, serializer) -> None:
+        super().__setitem__(media_type, serializer)
+        self._negotiated.clear()
+
     def __call__(self, media_types: Set[str], default: bool):
         """Register a new serializer with a set of accepted media types."""
 
@@ -35,7 +50,10 @@ class Serializers(dict):
         """Find the best serializer for the given Accept header."""
         if not accept:
             return self.default
-        media_type = parse_accept_header(accept).best_match(self.keys())
+        media_type = self._negotiated.get(accept, _NOT_NEGOTIATED)
+        if media_type is _NOT_NEGOTIATED:
+            media_type = parse_accept_header(accept).best_match(self.keys())
+            self._negotiated.set(accept, media_type)
         if not media_type:
             return self.default
         return super().__getitem__(media_type)
@@ -116,6 +134,45 @@ class Link:
         )
 
 
+class Rendered:
+    """A response body rendered once, to be served many times."""
+
+    def __init__(self, body: bytes, content_type: str) -> None:
+        self.body = body
+        self.content_type = content_type
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """Tell if the given If-None-Match header matches our ETag.
+
+        If-None-Match uses the weak comparison, see RFC 7232 section 3.2.
+        """
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag in ("*", self.etag):
+                return True
+        return False
+
+    def respond(
+        self, request: web.Request, max_age: int, vary: str = "Accept"
+    ) -> web.Response:
+        """Build a response for this body, honoring If-None-Match."""
+        headers = {
+            "ETag": self.etag,
+            "Cache-Control": f"public, max-age={max_age}",
+            "Vary": vary,
+        }
+        if self.matches(request.headers.get("If-None-Match")):
+            return web.Response(status=304, headers=headers)
+        return web.Response(
+            body=self.body, content_type=self.content_type, headers=headers
+        )
+
+
 def as_absolute(base, url):
     """Ensure an URL is absolute on the given base."""
     if not url.startswith("http://") and not url.startswith("https://"):
@@ -206,15 +263,35 @@ def serialize(
     """Serialize the given document according to the Accept header of the
     given request.
     """
-    content = json.dumps(
+    content = request.app["json_encoder"](
         serializers[request.headers.get("Accept")](
             document, request.app["settings"]["server"]["hostname"]
-        ),
-        indent=4,
-    ).encode("UTF-8")
+        )
+    )
     return web.Response(
         body=content,
         content_type="application/json",
         headers=headers,
         status=status,
     )
+
+
+class Prerendered:
+    """A document rendered once for each available serializer.
+
+    Used for documents only depending on the settings, so they're not
+    serialized again on each request.
+    """
+
+    def __init__(self, document: Document, base_url: str, encoder: Encoder) -> None:
+        self.renderings = {
+            serializer: Rendered(
+                encoder(serializer(document, base_url)),
+                content_type="application/json",
+            )
+            for serializer in set(serializers.values())
+        }
+
+    def __getitem__(self, accept: Optional[str]) -> Rendered:
+        """Find the best rendering for the given Accept header."""
+        return self.renderings[serializers[accept]]
@@ -0,0 +1,189 @@
+"""Pre-fork multi-worker server.
+
+The supervisor loads the settings and builds the application (keys,
+pre-rendered documents, imports) once, freezes the heap so it stays
+shared copy-on-write, then forks workers all serving the same
+listening socket (or each binding their own with SO_REUSEPORT).
+
+Crashed workers are restarted, SIGHUP reloads the settings and
+gracefully replaces all workers, SIGTERM and SIGINT stop everything.
+"""
+
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+from typing import Any, Callable, Dict, Mapping, Optional, cast
+
+from aiohttp import web
+
+Settings = Mapping[str, Any]
+
+logger = logging.getLogger(__name__)
+
+
+class Supervisor:  # pylint: disable=too-many-instance-attributes
+    """Forks and watches `workers` processes, each running the app.
+
+    `app_factory` builds the application from the settings, and
+    `load_settings` reloads them on SIGHUP.
+    """
+
+    restart_delay = 1.0  # Seconds to wait before restarting a crashed worker.
+
+    def __init__(
+        self,
+        settings: Settings,
+        workers: int,
+        app_factory: Callable[[Settings], web.Application],
+        load_settings: Callable[[], Settings],
+    ) -> None:
+        self.settings = settings
+        self.workers = workers
+        self.app_factory = app_factory
+        self.load_settings = load_settings
+        self.sock: Optional[socket.socket] = None
+        self.app: Optional[web.Application] = None
+        self.children: Dict[int, int] = {}  # pid -> generation
+        self.generation = 0
+        self.stopping = False
+        self.reloading = False
+
+    @property
+    def reuse_port(self) -> bool:
+        """Let each worker bind its own socket, the kernel balancing them."""
+        return bool(self.settings["server"].get("reuse_port", False))
+
+    def bind(self) -> socket.socket:
+        """Create the listening socket shared by all workers."""
+        host = self.settings["server"]["host"]
+        port = int(self.settings["server"]["port"])
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(self.settings["server"].get("backlog", 128))
+        sock.setblocking(False)
+        return sock
+
+    def prepare(self) -> None:
+        """Build the application before forking, so its immutable state
+        (settings, keys, pre-rendered documents) is shared by workers.
+        """
+        if hasattr(gc, "unfreeze"):  # pragma: no branch (Python 3.7+)
+            gc.unfreeze()  # So the previous app, on reload, can be collected.
+        self.app = None
+        self.app = self.app_factory(self.settings)
+        gc.collect()
+        if hasattr(gc, "freeze"):  # pragma: no branch (Python 3.7+)
+            gc.freeze()
+
+    def spawn(self) -> int:  # pragma: no cover
+        """Fork a worker of the current generation."""
+        pid = os.fork()
+        if pid:
+            self.children[pid] = self.generation
+            return pid
+        exit_code = 0
+        app = cast(web.Application, self.app)  # Built by prepare().
+        try:
+            for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, signal.SIG_DFL)
+            if self.reuse_port:
+                web.run_app(
+                    app,
+                    host=self.settings["server"]["host"],
+                    port=int(self.settings["server"]["port"]),
+                    reuse_port=True,
+                    print=None,
+                )
+            else:
+                web.run_app(app, sock=self.sock, print=None)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Worker %d crashed", os.getpid())
+            exit_code = 1
+        finally:
+            os._exit(exit_code)  # pylint: disable=protected-access
+        return 0
+
+    def on_exit(self, pid: int, status: int) -> None:
+        """A worker exited: restart it unless it was stopped on purpose."""
+        generation = self.children.pop(pid, None)
+        if generation != self.generation or self.stopping:
+            return
+        logger.warning("Worker %d exited with status %d, restarting it.", pid, status)
+        time.sleep(self.restart_delay)
+        self.spawn()
+
+    def reap(self) -> bool:
+        """Handle the exit of a worker, if any, tell if one exited."""
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:  # No workers left, like if all died on reload.
+            self.children.clear()
+            if not self.stopping:
+                logger.warning("No workers left, starting new ones.")
+                for _ in range(self.workers):
+                    self.spawn()
+            return False
+        if pid:
+            self.on_exit(pid, status)
+        return bool(pid)
+
+    def reload(self) -> None:
+        """Reload the settings, start new workers, then stop the old ones."""
+        logger.info("Reloading.")
+        old_workers = list(self.children)
+        self.settings = self.load_settings()
+        self.generation += 1
+        self.prepare()
+        for _ in range(self.workers):
+            self.spawn()
+        self.kill(old_workers)
+
+    @staticmethod
+    def kill(pids, signum: int = signal.SIGTERM) -> None:
+        """Send signum to the given workers, ignoring already dead ones."""
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _on_signal(self, signum, frame) -> None:  # pylint: disable=unused-argument
+        if signum == signal.SIGHUP:
+            self.reloading = True
+        else:
+            self.stopping = True
+
+    def run(self) -> None:  # pragma: no cover
+        """Start workers and supervise them until asked to stop."""
+        if not self.reuse_port:
+            self.sock = self.bind()
+        self.prepare()
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_signal)
+        for _ in range(self.workers):
+            self.spawn()
+        logger.info(
+            "Kisee supervisor %d running %d workers on %s:%s",
+            os.getpid(),
+            self.workers,
+            self.settings["server"]["host"],
+            self.settings["server"]["port"],
+        )
+        while not self.stopping:
+            if self.reloading:
+                self.reloading = False
+                self.reload()
+            if not self.reap():
+                time.sleep(0.1)
+        self.kill(self.children)
+        while self.children:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            self.children.pop(pid, None)
@@ -0,0 +1,298 @@
+"""JSON Web Tokens issuance and verification.
+
+PyJWT parses the PEM keys and rebuilds the header each time it's
+called, the TokenCodec does it once, at startup.
+
+ECDSA is CPU bound, so a TokenPool can spread signatures and
+verifications over worker processes.
+"""
+
+import asyncio
+import base64
+import binascii
+import calendar
+import functools
+import hashlib
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Union, cast
+
+import jwt
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import (
+    decode_dss_signature,
+    encode_dss_signature,
+)
+
+from kisee.batching import Batching, BatchResult, MicroBatcher
+from kisee.cache import LRUCache
+
+ALGORITHM = "ES256"
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data: bytes) -> bytes:
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+def _json_segment(obj: Mapping[str, Any]) -> bytes:
+    return _b64encode(json.dumps(obj, separators=(",", ":")).encode("UTF-8"))
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _as_timestamps(claims: Mapping[str, Any]) -> Dict[str, Any]:
+    """Convert datetime claims (like exp) to timestamps, like PyJWT does."""
+    return {
+        key: (
+            calendar.timegm(value.utctimetuple())
+            if isinstance(value, datetime)
+            else value
+        )
+        for key, value in claims.items()
+    }
+
+
+class TokenCodec:
+    """Issues and verifies ES256 JWTs.
+
+    Key objects are deserialized, and the header segment encoded, only
+    once. Tokens with a header we don't emit ourselves are handed to
+    PyJWT, still with the preloaded public key.
+    """
+
+    def __init__(self, private_key: str, public_key: str) -> None:
+        self.pem_keys = (private_key, public_key)
+        self.private_key = cast(
+            ec.EllipticCurvePrivateKey,
+            serialization.load_pem_private_key(
+                private_key.encode("ASCII"), password=None
+            ),
+        )
+        self.public_key = cast(
+            ec.EllipticCurvePublicKey,
+            serialization.load_pem_public_key(public_key.encode("ASCII")),
+        )
+        self._coordinate_size = (self.public_key.curve.key_size + 7) // 8
+        self._header = _json_segment({"alg": ALGORITHM, "typ": "JWT"})
+        self._known_headers = {
+            self._header,
+            _json_segment({"typ": "JWT", "alg": ALGORITHM}),  # PyJWT < 2.2 order.
+        }
+
+    @classmethod
+    def from_settings(cls, settings: Mapping[str, Any]) -> "TokenCodec":
+        """Build a codec from the keys in the [jwt] section of the settings."""
+        return cls(settings["jwt"]["private_key"], settings["jwt"]["public_key"])
+
+    def issue(self, claims: Mapping[str, Any]) -> str:
+        """Build a signed token for the given claims."""
+        signing_input = self._header + b"." + _json_segment(_as_timestamps(claims))
+        r, s = decode_dss_signature(  # pylint: disable=invalid-name
+            self.private_key.sign(signing_input, ec.ECDSA(hashes.SHA256()))
+        )
+        signature = r.to_bytes(self._coordinate_size, "big") + s.to_bytes(
+            self._coordinate_size, "big"
+        )
+        return (signing_input + b"." + _b64encode(signature)).decode("ASCII")
+
+    def verify(self, token: Union[str, bytes]) -> Dict[str, Any]:
+        """Verify the given token, returning its claims.
+
+        Raises a jwt.InvalidTokenError subclass on failure.
+        """
+        try:
+            if isinstance(token, str):
+                token = token.encode("ASCII")
+            signing_input, signature = token.rsplit(b".", 1)
+            header, payload = signing_input.split(b".", 1)
+        except (UnicodeEncodeError, ValueError) as err:
+            raise jwt.DecodeError("Not enough segments") from err
+        if header not in self._known_headers:
+            return jwt.decode(
+                token.decode("ASCII"),
+                # PyJWT accepts key objects, its annotations only say str.
+                cast(str, self.public_key),
+                algorithms=[ALGORITHM],
+            )
+        try:
+            raw_signature = _b64decode(signature)
+            claims = json.loads(_b64decode(payload))
+        except (binascii.Error, ValueError) as err:
+            raise jwt.DecodeError("Invalid token padding or payload") from err
+        self._check_signature(signing_input, raw_signature)
+        if not isinstance(claims, dict):
+            raise jwt.DecodeError("Invalid payload string: must be a json object")
+        self._check_times(claims)
+        return claims
+
+    def _check_signature(self, signing_input: bytes, raw_signature: bytes) -> None:
+        size = self._coordinate_size
+        if len(raw_signature) != 2 * size:
+            raise jwt.InvalidSignatureError("Signature verification failed")
+        der_signature = encode_dss_signature(
+            int.from_bytes(raw_signature[:size], "big"),
+            int.from_bytes(raw_signature[size:], "big"),
+        )
+        try:
+            self.public_key.verify(
+                der_signature, signing_input, ec.ECDSA(hashes.SHA256())
+            )
+        except InvalidSignature as err:
+            raise jwt.InvalidSignatureError("Signature verification failed") from err
+
+    @staticmethod
+    def _check_times(claims: Mapping[str, Any]) -> None:
+        """Validate exp and nbf, like PyJWT with no leeway."""
+        now = time.time()
+        exp, nbf = claims.get("exp"), claims.get("nbf")
+        if exp is not None:
+            if not _is_number(exp):
+                raise jwt.DecodeError("Expiration Time claim (exp) must be an integer.")
+            if int(exp) <= now:
+                raise jwt.ExpiredSignatureError("Signature has expired")
+        if nbf is not None:
+            if not _is_number(nbf):
+                raise jwt.DecodeError("Not Before claim (nbf) must be an integer.")
+            if int(nbf) > now:
+                raise jwt.ImmatureSignatureError("The token is not yet valid (nbf)")
+
+
+_WORKER_CODECS: Dict[Tuple[str, str], TokenCodec] = {}
+
+
+def _worker_codec(pem_keys: Tuple[str, str]) -> TokenCodec:
+    """The codec of this worker process, built on its first batch."""
+    if pem_keys not in _WORKER_CODECS:
+        _WORKER_CODECS[pem_keys] = TokenCodec(*pem_keys)
+    return _WORKER_CODECS[pem_keys]
+
+
+def _run_batch(method: str, pem_keys: Tuple[str, str], items: List[Any]) -> BatchResult:
+    """Run codec.<method> on each item, in a worker process.
+
+    Returns a (success, result or exception) pair per item, so one bad
+    token does not fail the whole batch.
+    """
+    func = getattr(_worker_codec(pem_keys), method)
+    results: BatchResult = []
+    for item in items:
+        try:
+            results.append((True, func(item)))
+        except Exception as err:  # pylint: disable=broad-except
+            results.append((False, err))
+    return results
+
+
+class TokenPool:
+    """Issues and verifies tokens using worker processes.
+
+    Each worker holds its own TokenCodec, and requests are sent to a
+    worker by batches (see Batching), so token issuance scales with
+    cores.
+
+    With no workers, tokens are handled by the codec in the event loop.
+
+    Verified claims are kept in a bounded cache, keyed by a hash of the
+    token, for at most `cache_ttl` seconds and never past their exp, so
+    a token used repeatedly is only checked once.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        codec: TokenCodec,
+        *,
+        workers: int = 0,
+        batching: Batching = Batching(),
+        cache_size: int = 1024,
+        cache_ttl: float = 60,
+    ) -> None:
+        self.codec = codec
+        self.verified: LRUCache[bytes, Dict[str, Any]] = LRUCache(
+            cache_size, ttl=cache_ttl, clock=time.time
+        )
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._issuer = MicroBatcher(
+            functools.partial(self._in_worker, "issue"), batching
+        )
+        self._verifier = MicroBatcher(
+            functools.partial(self._in_worker, "verify"), batching
+        )
+
+    @classmethod
+    def from_settings(cls, settings: Mapping[str, Any]) -> "TokenPool":
+        """Build a pool from the [jwt] section of the settings."""
+        section = settings["jwt"]
+        return cls(
+            TokenCodec.from_settings(settings),
+            workers=section.get("workers", 0),
+            batching=Batching.from_section(section),
+            cache_size=section.get("cache_size", 1024),
+            cache_ttl=section.get("cache_ttl", 60),
+        )
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """The worker processes, started on first use."""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def _in_worker(self, method: str, items: List[Any]) -> BatchResult:
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, _run_batch, method, self.codec.pem_keys, items
+        )
+
+    async def issue(self, claims: Mapping[str, Any]) -> str:
+        """Build a signed token for the given claims."""
+        return await self._run(self._issuer, self.codec.issue, claims)
+
+    async def verify(self, token: Union[str, bytes]) -> Dict[str, Any]:
+        """Verify the given token, returning its claims."""
+        key = hashlib.sha256(
+            token.encode("UTF-8") if isinstance(token, str) else token
+        ).digest()
+        claims = self.verified.get(key)
+        if claims is None:
+            claims = await self._run(self._verifier, self.codec.verify, token)
+            exp = claims.get("exp")
+            # Truncated like _check_times does, so a cached token
+            # expires exactly when the codec would reject it.
+            self.verified.set(
+                key, claims, expires_at=None if exp is None else int(exp)
+            )
+        return dict(claims)
+
+    async def _run(
+        self, batcher: MicroBatcher, inline: Callable[[Any], Any], item: Any
+    ) -> Any:
+        if not self.workers:
+            return inline(item)
+        return await batcher.submit(item)
+
+    def stats(self) -> Dict[str, Any]:
+        """Batching counters."""
+        batches = self._issuer.batches + self._verifier.batches
+        items = self._issuer.items + self._verifier.items
+        return {
+            "workers": self.workers,
+            "batches": batches,
+            "avg_batch_size": round(items / batches, 2) if batches else None,
+            "verified_cache": self.verified.stats(),
+        }
+
+    def shutdown(self) -> None:
+        """Stop the worker processes, if started."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
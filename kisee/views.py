@@ -3,15 +3,21 @@
 - GET /
 - GET /jwt/
 - POST /jwt/
+- GET /users/ (and GET /users/?export=jsonl)
+- POST /users/
+- POST /users/lookup
+- PATCH /users/{user_id}/
+- GET /password_recoveries/
+- POST /password_recoveries/
+- GET /health
 """
 
-import json
 import logging
 from datetime import datetime, timedelta
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Mapping, Optional
+from urllib.parse import urlencode
 
 import jsonpatch
-import jwt
 import shortuuid
 from aiohttp import web
 from aiojobs.aiohttp import spawn
@@ -20,19 +26,34 @@ import kisee
 from kisee import serializers
 from kisee.authentication import authenticate_user
 from kisee.emails import is_email
-from kisee.identity_provider import ProviderError, User, UserAlreadyExist
+from kisee.encoding import get_encoder, jsonl_chunks
+from kisee.identity_provider import (
+    NotSupported,
+    ProviderError,
+    User,
+    UserAlreadyExist,
+)
 from kisee.serializers import serialize
 from kisee.utils import get_user_with_email_or_username
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_DISCOVERY_MAX_AGE = 300
 
-async def get_root(
-    request: web.Request,  # pylint: disable=unused-argument
-) -> web.Response:
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def _discovery_max_age(request: web.Request) -> int:
+    """Cache-Control max-age for discovery documents, in seconds."""
+    return request.app["settings"]["server"].get(
+        "discovery_max_age", DEFAULT_DISCOVERY_MAX_AGE
+    )
+
+
+def json_home(hostname: str) -> Dict[str, Any]:
     """https://tools.ietf.org/html/draft-nottingham-json-home-06"""
-    hostname = request.app["settings"]["server"]["hostname"]
-    home = {
+    return {
         "api": {
             "title": "Identification Provider",
             "links": {
@@ -64,8 +85,12 @@ async def get_root(
             },
         },
     }
-    return web.Response(
-        body=json.dumps(home, indent=4), content_type="application/json-home"
+
+
+async def get_root(request: web.Request) -> web.Response:
+    """https://tools.ietf.org/html/draft-nottingham-json-home-06"""
+    return request.app["discovery"]["root"].respond(
+        request, max_age=_discovery_max_age(request)
     )
 
 
@@ -79,54 +104,144 @@ def json_patch_link(url, title, description):
     )
 
 
-async def get_users(request: web.Request) -> web.Response:
-    """View for GET /users/, just describes that a POST is possible."""
+def users_document() -> serializers.Document:
+    """Document for GET /users/, just describes that a POST is possible."""
+    return serializers.Document(
+        url="/users/",
+        title="Users",
+        content={
+            "users": [],
+            "patch": json_patch_link(
+                url="/users/{user_id}",
+                title="Patch a user",
+                description="Typically to change password.",
+            ),
+            "register_user": serializers.Link(
+                url="/users/",
+                action="post",
+                title="Register a new user",
+                description="POSTing to this endpoint creates a new user",
+                fields=[
+                    serializers.Field(
+                        name="username",
+                        required=True,
+                        schema={
+                            "type": "string",
+                        },
+                    ),
+                    serializers.Field(
+                        name="password",
+                        required=True,
+                        schema={
+                            "type": "string",
+                            "minLength": 5,
+                            "format": "password",
+                        },
+                    ),
+                    serializers.Field(
+                        name="email",
+                        required=True,
+                        schema={"type": "string", "format": "email"},
+                    ),
+                ],
+            ),
+        },
+    )
+
+
+async def get_users(request: web.Request) -> web.StreamResponse:
+    """View for GET /users/, just describes that a POST is possible.
+
+    Authenticated superusers get a page of users, with a link to the
+    next one, and can also export all users with ?export=jsonl. Asking
+    for a page (?after or ?limit) requires being a superuser, other
+    clients just get the description.
+    """
+    if "export" in request.query:
+        return await _export_users(request)
+    if "after" in request.query or "limit" in request.query:
+        admin, _ = await authenticate_user(request)
+        if not admin.is_superuser:
+            raise web.HTTPForbidden(reason="Only superusers can list users.")
+        return await _list_users(request)
+    if "Authorization" in request.headers:
+        try:
+            admin, _ = await authenticate_user(request)
+        except web.HTTPUnauthorized:
+            pass
+        else:
+            if admin.is_superuser:
+                return await _list_users(request)
+    return request.app["discovery"]["users"][request.headers.get("Accept")].respond(
+        request, max_age=_discovery_max_age(request), vary="Accept, Authorization"
+    )
+
+
+async def _list_users(request: web.Request) -> web.Response:
+    """A page of users, sorted by username, starting after ?after."""
+    try:
+        limit = int(request.query.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError as err:
+        raise web.HTTPBadRequest(reason="limit should be an integer.") from err
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise web.HTTPBadRequest(reason=f"limit should be in 1..{MAX_PAGE_SIZE}.")
+    after = request.query.get("after")
+    try:
+        # One more than needed, to know if there's a next page.
+        users = await request.app["identity_backend"].list_users(after, limit + 1)
+    except NotSupported as err:
+        raise web.HTTPNotImplemented(
+            reason="The identity backend does not support listing users."
+        ) from err
+    document = users_document()
+    document.url = str(request.rel_url)
+    document.data["users"] = [user.as_dict() for user in users[:limit]]
+    if len(users) > limit:
+        query = urlencode({"after": users[limit - 1].username, "limit": limit})
+        document.data["next"] = serializers.Link(
+            url=f"/users/?{query}", action="get", title="Next page"
+        )
     return serialize(
         request,
-        serializers.Document(
-            url="/users/",
-            title="Users",
-            content={
-                "users": [],
-                "patch": json_patch_link(
-                    url="/users/{user_id}",
-                    title="Patch a user",
-                    description="Typically to change password.",
-                ),
-                "register_user": serializers.Link(
-                    url="/users/",
-                    action="post",
-                    title="Register a new user",
-                    description="POSTing to this endpoint creates a new user",
-                    fields=[
-                        serializers.Field(
-                            name="username",
-                            required=True,
-                            schema={
-                                "type": "string",
-                            },
-                        ),
-                        serializers.Field(
-                            name="password",
-                            required=True,
-                            schema={
-                                "type": "string",
-                                "minLength": 5,
-                                "format": "password",
-                            },
-                        ),
-                        serializers.Field(
-                            name="email",
-                            required=True,
-                            schema={"type": "string", "format": "email"},
-                        ),
-                    ],
-                ),
-            },
-        ),
+        document,
+        headers={"Cache-Control": "no-store", "Vary": "Accept, Authorization"},
     )
 
 
+async def _export_users(request: web.Request) -> web.StreamResponse:
+    """Stream all users as JSON lines, without loading them in memory."""
+    if request.query["export"] != "jsonl":
+        raise web.HTTPBadRequest(reason="Only jsonl exports are supported.")
+    user, _ = await authenticate_user(request)
+    if not user.is_superuser:
+        raise web.HTTPForbidden(reason="Only superusers can export users.")
+    users = request.app["identity_backend"].iter_users()
+    # Get the first user before sending headers, to answer 501 if the
+    # backend can't iterate over users.
+    try:
+        first = [await users.__anext__()]
+    except StopAsyncIteration:
+        first = []
+    except NotSupported as err:
+        raise web.HTTPNotImplemented(
+            reason="The identity backend does not support exports."
+        ) from err
+    response = web.StreamResponse(headers={"Cache-Control": "no-store"})
+    response.content_type = "application/x-ndjson"
+    await response.prepare(request)
+
+    async def documents():
+        for user in first:
+            yield user.as_dict()
+        async for user in users:
+            yield user.as_dict()
+
+    async for chunk in jsonl_chunks(documents(), request.app["jsonl_encoder"]):
+        await response.write(chunk)
+    await response.write_eof()
+    return response
+
+
 async def post_users(request: web.Request) -> web.Response:
     """A client is asking to create a new user."""
     data = await request.json()
@@ -153,6 +268,44 @@ async def post_users(request: web.Request) -> web.Response:
     return web.Response(status=201, headers={"Location": location})
 
 
+async def post_users_lookup(request: web.Request) -> web.Response:
+    """Superusers resolving many usernames at once."""
+    admin, _ = await authenticate_user(request)
+    if not admin.is_superuser:
+        raise web.HTTPForbidden(reason="Only superusers can look users up.")
+    data = await request.json()
+    usernames = data.get("usernames") if isinstance(data, dict) else None
+    if not isinstance(usernames, list) or not all(
+        isinstance(username, str) for username in usernames
+    ):
+        raise web.HTTPBadRequest(reason="usernames should be a list of strings.")
+    if len(usernames) > MAX_PAGE_SIZE:
+        raise web.HTTPBadRequest(
+            reason=f"Can't look more than {MAX_PAGE_SIZE} users up at once."
+        )
+    usernames = list(dict.fromkeys(usernames))  # Deduplicated, ordered.
+    users = await request.app["identity_backend"].get_users_by_usernames(usernames)
+    found = {user.username: user for user in users}
+    return serialize(
+        request,
+        serializers.Document(
+            url="/users/lookup",
+            title="Users lookup",
+            content={
+                "users": [
+                    found[username].as_dict()
+                    for username in usernames
+                    if username in found
+                ],
+                "not_found": [
+                    username for username in usernames if username not in found
+                ],
+            },
+        ),
+        headers={"Cache-Control": "no-store"},
+    )
+
+
 async def patch_user(request: web.Request) -> web.Response:
     """Patch user password."""
     user, _ = await authenticate_user(request, for_password_modification=True)
@@ -175,33 +328,39 @@ async def patch_user(request: web.Request) -> web.Response:
     return web.Response(status=204)
 
 
+def add_token_link() -> serializers.Link:
+    """Link describing how to create a JWT."""
+    return serializers.Link(
+        url="/jwt/",
+        action="post",
+        title="Create a new JWT",
+        description="POSTing to this endpoint create JWT tokens.",
+        fields=[
+            serializers.Field(
+                name="username", required=True, schema={"type": "string"}
+            ),
+            serializers.Field(
+                name="password",
+                required=True,
+                schema={"type": "string", "format": "password"},
+            ),
+        ],
+    )
+
+
+def jwts_document() -> serializers.Document:
+    """Document for GET /jwt/, just describes that a POST is possible."""
+    return serializers.Document(
+        url="/jwt/",
+        title="JSON Web Tokens",
+        content={"tokens": [], "add_token": add_token_link()},
+    )
+
+
 async def get_jwts(request: web.Request) -> web.Response:
     """Handlers for GET /jwt/, just describes that a POST is possible."""
-    return serialize(
-        request,
-        serializers.Document(
-            url="/jwt/",
-            title="JSON Web Tokens",
-            content={
-                "tokens": [],
-                "add_token": serializers.Link(
-                    url="/jwt/",
-                    action="post",
-                    title="Create a new JWT",
-                    description="POSTing to this endpoint create JWT tokens.",
-                    fields=[
-                        serializers.Field(
-                            name="username", required=True, schema={"type": "string"}
-                        ),
-                        serializers.Field(
-                            name="password",
-                            required=True,
-                            schema={"type": "string", "format": "password"},
-                        ),
-                    ],
-                ),
-            },
-        ),
+    return request.app["discovery"]["jwts"][request.headers.get("Accept")].respond(
+        request, max_age=_discovery_max_age(request)
     )
 
 
@@ -218,51 +377,56 @@ async def post_jwt(request: web.Request) -> web.Response:
         raise web.HTTPUnprocessableEntity(reason="Missing username or password.")
     username = data.get("username", data.get("login", ""))
     logger.debug("Trying to identify user %s", username)
-    user = await request.app["identity_backend"].identify(username, data["password"])
+    async with request.app["admission"]:
+        user = await request.app["identity_backend"].identify(
+            username, data["password"]
+        )
     if user is None:
         raise web.HTTPForbidden(reason="Failed identification for kisee.")
     jti = shortuuid.uuid()
+    token = await request.app["tokens"].issue(
+        {
+            "iss": request.app["settings"]["jwt"]["iss"],
+            "sub": user.user_id,
+            "exp": datetime.utcnow() + timedelta(hours=1),
+            "jti": jti,
+        }
+    )
     return serialize(
         request,
         serializers.Document(
             url="/jwt/",
             title="JSON Web Tokens",
-            content={
-                "tokens": [
-                    jwt.encode(
-                        {
-                            "iss": request.app["settings"]["jwt"]["iss"],
-                            "sub": user.user_id,
-                            "exp": datetime.utcnow() + timedelta(hours=1),
-                            "jti": jti,
-                        },
-                        request.app["settings"]["jwt"]["private_key"],
-                        algorithm="ES256",
-                    )
-                ],
-                "add_token": serializers.Link(
-                    url="/jwt/",
-                    action="post",
-                    title="Create a new JWT",
-                    description="POSTing to this endpoint create JWT tokens.",
-                    fields=[
-                        serializers.Field(
-                            name="username", required=True, schema={"type": "string"}
-                        ),
-                        serializers.Field(
-                            name="password",
-                            required=True,
-                            schema={"type": "string", "format": "password"},
-                        ),
-                    ],
-                ),
-            },
+            content={"tokens": [token], "add_token": add_token_link()},
         ),
         status=201,
         headers={"Location": "/jwt/" + jti},
     )
 
 
+def password_recoveries_document() -> serializers.Document:
+    """Document for anonymous GET /password_recoveries/."""
+    return serializers.Document(
+        url="/password_recoveries/",
+        title="Forgotten password management",
+        content={
+            "reset_password": serializers.Link(
+                url="/password_recoveries/",
+                action="post",
+                title="",
+                description="POSTing to this endpoint starts a new Password Reset"
+                " procedure.",
+                fields=[
+                    serializers.Field(name="username", schema={"type": "string"}),
+                    serializers.Field(
+                        name="email", schema={"type": "string", "format": "email"}
+                    ),
+                ],
+            )
+        },
+    )
+
+
 async def get_password_recoveries(request: web.Request) -> web.Response:
     """Password recovery entry point."""
     user: Optional[User] = None
@@ -270,40 +434,35 @@ async def get_password_recoveries(request: web.Request) -> web.Response:
         user, _ = await authenticate_user(request, for_password_modification=True)
     except (web.HTTPForbidden, web.HTTPUnauthorized):
         pass
-    content = {}
-    if user:
-        content["recover"] = serializers.Link(
-            url=f"/users/{user.user_id}/",
-            action="patch",
-            title="Change password",
-            description="Use a Json Patch document to change your password here.",
-            fields=[
-                serializers.Field(
-                    name="password",
-                    schema={"type": "string", "minLength": 5, "format": "password"},
-                )
-            ],
-        )
-    else:
-        content["reset_password"] = serializers.Link(
-            url="/password_recoveries/",
-            action="post",
-            title="",
-            description="POSTing to this endpoint starts a new Password Reset"
-            " procedure.",
-            fields=[
-                serializers.Field(name="username", schema={"type": "string"}),
-                serializers.Field(
-                    name="email", schema={"type": "string", "format": "email"}
-                ),
-            ],
+    if not user:
+        rendered = request.app["discovery"]["password_recoveries"]
+        return rendered[request.headers.get("Accept")].respond(
+            request, max_age=_discovery_max_age(request), vary="Accept, Authorization"
         )
     return serialize(
         request,
         serializers.Document(
             url="/password_recoveries/",
             title="Forgotten password management",
-            content=content,
+            content={
+                "recover": serializers.Link(
+                    url=f"/users/{user.user_id}/",
+                    action="patch",
+                    title="Change password",
+                    description="Use a Json Patch document to change your password"
+                    " here.",
+                    fields=[
+                        serializers.Field(
+                            name="password",
+                            schema={
+                                "type": "string",
+                                "minLength": 5,
+                                "format": "password",
+                            },
+                        )
+                    ],
+                )
+            },
         ),
     )
 
@@ -315,15 +474,13 @@ async def _post_password_recoveries(request: web.Request) -> None:
     if not user:
         logger.info("Password recovery asked for a non-existing user: %s", data)
         return
-    jwt_token = jwt.encode(
+    jwt_token = await request.app["tokens"].issue(
         {
             "iss": request.app["settings"]["jwt"]["iss"],
             "exp": datetime.utcnow() + timedelta(hours=12),
             "jti": shortuuid.uuid(),
             "password_reset_for": user.username,
-        },
-        request.app["settings"]["jwt"]["private_key"],
-        algorithm="ES256",
+        }
     )
     await request.app["identity_backend"].send_reset_password_challenge(user, jwt_token)
 
@@ -354,9 +511,33 @@ async def get_health(request: web.Request) -> web.Response:
         "status": status,
         "database": "OK" if is_database_ok else "KO",
         "version": kisee.__version__,
+        "hashing": request.app["hashing"].stats(),
+        "admission": request.app["admission"].stats(),
+        "tokens": request.app["tokens"].stats(),
+        "identity_backend": request.app["identity_backend"].stats(),
     }
     if error:
         health["error"] = error
     return web.Response(
-        body=json.dumps(health, indent=4), content_type="application/json"
+        body=request.app["json_encoder"](health), content_type="application/json"
     )
+
+
+def render_discovery(settings: Mapping[str, Any]) -> Dict[str, Any]:
+    """Render, once, the documents only depending on the settings.
+
+    They're served as precomputed bytes with strong ETags by get_root,
+    get_users, get_jwts, and the anonymous get_password_recoveries.
+    """
+    hostname = settings["server"]["hostname"]
+    encoder = get_encoder(settings)
+    return {
+        "root": serializers.Rendered(
+            encoder(json_home(hostname)), content_type="application/json-home"
+        ),
+        "users": serializers.Prerendered(users_document(), hostname, encoder),
+        "jwts": serializers.Prerendered(jwts_document(), hostname, encoder),
+        "password_recoveries": serializers.Prerendered(
+            password_recoveries_document(), hostname, encoder
+        ),
+    }
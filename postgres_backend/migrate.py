@@ -0,0 +1,154 @@
+"""Versioned schema migrations for the PostgreSQL backend.
+
+Migrations are the numbered SQL files of the migrations directory
+(like 0002_index_username_and_email.sql), applied in order, each in
+its own transaction. Applied versions are recorded in the
+schema_migrations table, so running kisee-migrate again only applies
+the new ones.
+"""
+
+import argparse
+import asyncio
+import re
+from pathlib import Path
+from typing import Any, List, Mapping, NamedTuple, Optional, Set
+
+import asyncpg
+
+from kisee.kisee import load_conf
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+
+# Arbitrary key of the advisory lock preventing concurrent migrations.
+LOCK_KEY = 0x4B15EE
+
+MIGRATION_NAME = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+
+class Migration(NamedTuple):
+    """A numbered SQL script."""
+
+    version: int
+    name: str
+    path: Path
+
+    def __str__(self) -> str:
+        return f"{self.version:04d} {self.name}"
+
+
+def list_migrations(directory: Path = MIGRATIONS_DIR) -> List[Migration]:
+    """Find the migrations of the given directory, sorted by version."""
+    migrations = []
+    for path in directory.iterdir():
+        match = MIGRATION_NAME.match(path.name)
+        if match:
+            migrations.append(Migration(int(match[1]), match[2], path))
+    migrations.sort()
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicated migration versions in {directory}.")
+    return migrations
+
+
+async def applied_versions(connection: asyncpg.Connection) -> Set[int]:
+    """Versions already applied to the database."""
+    await connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations(
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+    rows = await connection.fetch("SELECT version FROM schema_migrations")
+    return {row["version"] for row in rows}
+
+
+async def migrate(
+    connection: asyncpg.Connection,
+    migrations: List[Migration],
+    target: Optional[int] = None,
+) -> List[Migration]:
+    """Apply the pending migrations, up to target if given.
+
+    Returns the applied migrations.
+    """
+    applied = []
+    await connection.execute("SELECT pg_advisory_lock($1)", LOCK_KEY)
+    try:
+        done = await applied_versions(connection)
+        for migration in migrations:
+            if migration.version in done:
+                continue
+            if target is not None and migration.version > target:
+                break
+            async with connection.transaction():
+                await connection.execute(migration.path.read_text())
+                await connection.execute(
+                    "INSERT INTO schema_migrations(version, name) VALUES ($1, $2)",
+                    migration.version,
+                    migration.name,
+                )
+            applied.append(migration)
+    finally:
+        await connection.execute("SELECT pg_advisory_unlock($1)", LOCK_KEY)
+    return applied
+
+
+async def connect(options: Mapping[str, Any]) -> asyncpg.Connection:
+    """Connect using the [identity_backend.options] of the DataStore."""
+    return await asyncpg.connect(
+        database=options["database"],
+        user=options["user"],
+        password=options["password"],
+        host=options["host"],
+        port=options["port"],
+    )
+
+
+def parse_args(args=None) -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Apply the schema migrations of the PostgreSQL backend."
+    )
+    parser.add_argument("--settings", default="settings.toml")
+    parser.add_argument(
+        "--list",
+        action="store_true",
+        help="Only list migrations and whether they are applied.",
+    )
+    parser.add_argument(
+        "--target", type=int, help="Don't apply migrations past this version."
+    )
+    return parser.parse_args(args)
+
+
+async def run(args: argparse.Namespace) -> None:
+    """Migrate, or list migrations, as requested by args."""
+    settings = load_conf(args.settings)
+    migrations = list_migrations()
+    connection = await connect(settings["identity_backend"]["options"])
+    try:
+        if args.list:
+            done = await applied_versions(connection)
+            for migration in migrations:
+                status = "applied" if migration.version in done else "pending"
+                print(f"{migration} ({status})")
+            return
+        applied = await migrate(connection, migrations, target=args.target)
+    finally:
+        await connection.close()
+    for migration in applied:
+        print(f"Applied {migration}")
+    if not applied:
+        print("Nothing to migrate.")
+
+
+def main() -> None:
+    """Command line entry point."""
+    asyncio.get_event_loop().run_until_complete(run(parse_args()))
+
+
+if __name__ == "__main__":
+    main()
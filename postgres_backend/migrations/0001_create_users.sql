@@ -1,4 +1,5 @@
-CREATE DATABASE kisee;
+-- Same table as the former schema_01.sql, so existing databases are
+-- adopted as is.
 CREATE TABLE IF NOT EXISTS users(
     user_id TEXT PRIMARY KEY,
     username TEXT,
@@ -0,0 +1,8 @@
+-- Lookups by username and by email each use their own index, and
+-- usernames and emails are unique. Like lookups, both are
+-- case-sensitive.
+--
+-- Fails if the table already contains duplicates: they have to be
+-- fixed by hand before migrating.
+CREATE UNIQUE INDEX IF NOT EXISTS users_username_key ON users (username);
+CREATE UNIQUE INDEX IF NOT EXISTS users_email_key ON users (email);
@@ -1,39 +1,135 @@
 """Postgresql backend for Kisee
 """
+import asyncio
+import functools
+import itertools
+import json
+import logging
 import uuid
-from typing import Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
 
-import hmac
-import bcrypt
 import asyncpg
 
-from kisee.identity_provider import IdentityProvider, User, UserAlreadyExist
+from kisee.cache import LRUCache
 
+# constant_time_compare and verify used to live here, keep them importable.
+from kisee.hashing import (  # noqa: F401  # pylint: disable=unused-import
+    constant_time_compare,
+    verify,
+)
+from kisee.identity_provider import (
+    ChangeCallback,
+    IdentityProvider,
+    User,
+    UserAlreadyExist,
+    UserRecord,
+)
 
-def constant_time_compare(val1: bytes, val2: bytes) -> bool:
-    """Return True if the two strings are equal, False otherwise."""
-    return hmac.compare_digest(val1, val2)
+# Queries are written so each one can use a single index, see the
+# migrations directory: an OR between two columns can't, so identify
+# looks the username and the email up separately, a username match
+# winning over an email match.
+USER_COLUMNS = "user_id, username, email, is_superuser"
 
+IDENTIFY = f"""
+    SELECT {USER_COLUMNS}, password, 0 AS precedence FROM users WHERE username = $1
+    UNION ALL
+    SELECT {USER_COLUMNS}, password, 1 AS precedence FROM users WHERE email = $1
+    ORDER BY precedence
+    LIMIT 1
+"""
 
-def verify(user_input: bytes, database_encoded: bytes) -> bool:
-    """Verity that the given encoded (hashed) password is matching the
-    expected password.
+GET_USER_BY_EMAIL = f"SELECT {USER_COLUMNS} FROM users WHERE email = $1"
 
-    Needs the bcrypt library.  Please be warned that this library
-    depends on native C code and might cause portability issues.
+GET_USER_BY_USERNAME = f"SELECT {USER_COLUMNS} FROM users WHERE username = $1"
+
+GET_USERS_BY_USERNAMES = (
+    f"SELECT {USER_COLUMNS} FROM users WHERE username = ANY($1::text[])"
+)
+
+ITER_USERS = f"SELECT {USER_COLUMNS} FROM users"
+
+# Keyset pagination on the username index: pages deep in the table
+# cost the same as the first one, unlike with an OFFSET.
+LIST_USERS = f"""
+    SELECT {USER_COLUMNS} FROM users
+    WHERE username > $1
+    ORDER BY username
+    LIMIT $2
+"""
+
+# Rows fetched at once by the server-side cursor of iter_users.
+ITER_USERS_PREFETCH = 1000
+
+# Hot queries, prepared on each connection as soon as it is opened.
+STATEMENTS = {
+    "identify": IDENTIFY,
+    "get_user_by_email": GET_USER_BY_EMAIL,
+    "get_user_by_username": GET_USER_BY_USERNAME,
+}
+
+# Pool settings, overridable in [identity_backend.options].
+POOL_DEFAULTS = {
+    "min_size": 10,
+    "max_size": 10,
+    "max_queries": 50000,  # Connections are replaced after this many queries.
+    "max_inactive_connection_lifetime": 300.0,  # Seconds.
+    "statement_cache_size": 100,
+    "command_timeout": None,  # Seconds.
+}
+
+# Seconds during which reads about a user go to the primary after a
+# write about it, so they don't miss it because of replication lag.
+READ_AFTER_WRITE_WINDOW = 5.0
+
+# Users whose reads are pinned to the primary at once.
+MAX_PINNED = 100_000
+
+# Changes to users are notified to other Kisee processes on this
+# channel, to invalidate their caches.
+NOTIFY_CHANNEL = "kisee_users"
+
+# Seconds between attempts to listen again after losing the connection.
+RELISTEN_DELAY = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class Connection(asyncpg.Connection):  # pylint: disable=too-many-ancestors
+    """A connection holding the prepared hot statements."""
+
+    __slots__ = ("statements",)
+
+    async def prepare_statements(self) -> None:
+        """Prepare STATEMENTS, so requests don't pay for parsing them."""
+        self.statements = {  # pylint: disable=attribute-defined-outside-init
+            name: await self.prepare(query) for name, query in STATEMENTS.items()
+        }
 
-    This is compatible with Python Blowfish cipher (prefix is '$2b$').
-    """
-    if not database_encoded.startswith(b"$2b$"):
-        raise ValueError(
-            "The encoded string must be Python Blowfish cipher compatible."
-        )
-    encoded_user_input = bcrypt.hashpw(user_input, database_encoded)
-    return constant_time_compare(database_encoded, encoded_user_input)
 
+def _pool_stats(pool: asyncpg.pool.Pool) -> Dict[str, int]:
+    return {
+        "size": pool.get_size(),
+        "idle": pool.get_idle_size(),
+        "min_size": pool.get_min_size(),
+        "max_size": pool.get_max_size(),
+    }
 
-class DataStore(IdentityProvider):
-    """Postgresql backend for kisee"""
+
+class DataStore(IdentityProvider):  # pylint: disable=too-many-instance-attributes
+    """Postgresql backend for kisee
+
+    Reads can be spread over read replicas, given as "host" or
+    "host:port" in the replicas option, each having its own pool. They
+    are picked in turn, except for reads about a user written by this
+    process less than read_after_write_window seconds ago, which stay
+    on the primary.
+
+    Changes to users are notified on the notify_channel, "kisee_users"
+    by default or none if empty. When caches subscribed to them (see
+    on_change), a dedicated connection listens to the changes made by
+    other processes.
+    """
 
     def __init__(self, options: dict, **kwargs) -> None:
         super().__init__(options, **kwargs)
@@ -42,38 +138,202 @@ class DataStore(IdentityProvider):
         self.database = options["database"]
         self.host = options["host"]
         self.port = options["port"]
+        self.replica_hosts: List[Tuple[str, int]] = [
+            (host, int(port or self.port))
+            for host, _, port in (
+                replica.partition(":") for replica in options.get("replicas", [])
+            )
+        ]
+        self.pinned: LRUCache[str, bool] = LRUCache(
+            MAX_PINNED,
+            ttl=options.get("read_after_write_window", READ_AFTER_WRITE_WINDOW),
+        )
+        self.notify_channel = options.get("notify_channel", NOTIFY_CHANNEL)
+        # Tells our notifications apart from the ones of other processes.
+        self.node_id = uuid.uuid4().hex
+        self.notified = 0
+        self._subscribers: List[ChangeCallback] = []
+        self._listener: Optional[asyncpg.Connection] = None
+        self._relisten: Optional[asyncio.Future] = None
+
+    async def _create_pool(self, host: str, port: int) -> asyncpg.pool.Pool:
+        # Opens min_size connections, preparing the statements on each,
+        # before Kisee starts serving requests.
+        pool_options = {
+            key: self.options.get(key, default)
+            for key, default in POOL_DEFAULTS.items()
+        }
+        return await asyncpg.create_pool(
+            database=self.database,
+            user=self.user,
+            password=self.password,
+            host=host,
+            port=port,
+            connection_class=Connection,
+            init=Connection.prepare_statements,
+            **pool_options,
+        )
 
     async def __aenter__(self):
-        self.pool = await asyncpg.create_pool(  # pylint: disable=W0201
-            database=self.database,  # W0201 is attribute-defined-outside-init
-            user=self.user,  # we define it outside of init on purpose
+        # Pools are opened on enter, not in __init__, on purpose.
+        # pylint: disable=attribute-defined-outside-init
+        self.pool = await self._create_pool(self.host, self.port)
+        self.replicas = []
+        try:
+            for host, port in self.replica_hosts:
+                self.replicas.append(await self._create_pool(host, port))
+            if self._subscribers and self.notify_channel:
+                await self._listen()
+        except BaseException:
+            await self.__aexit__(None, None, None)
+            raise
+        self._next_replica = itertools.cycle(self.replicas)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self._relisten is not None:
+            self._relisten.cancel()
+            self._relisten = None
+        if self._listener is not None:
+            listener, self._listener = self._listener, None
+            listener.remove_termination_listener(self._listener_lost)
+            listener.terminate()
+        try:
+            pools = [self.pool, *self.replicas]
+        except AttributeError:
+            return
+        for pool in pools:
+            pool.terminate()
+
+    def on_change(self, callback: ChangeCallback) -> None:
+        self._subscribers.append(callback)
+
+    async def _listen(self) -> None:
+        """Open the connection listening to changes from other processes."""
+        listener = await asyncpg.connect(
+            database=self.database,
+            user=self.user,
             password=self.password,
             host=self.host,
             port=self.port,
         )
+        await listener.add_listener(self.notify_channel, self._on_notification)
+        listener.add_termination_listener(self._listener_lost)
+        self._listener = listener
 
-    async def __aexit__(self, exc_type, exc_value, traceback):
+    def _on_notification(self, connection, pid, channel, payload) -> None:
+        # pylint: disable=unused-argument
         try:
-            self.pool.terminate()
-        except AttributeError:
-            pass
+            change = json.loads(payload)
+            if change["node"] == self.node_id:
+                return
+            username, email = change["username"], change["email"]
+        except (ValueError, KeyError, TypeError):
+            username = email = None
+        if not isinstance(username, str) or not isinstance(email, str):
+            logger.warning("Ignoring malformed notification %r.", payload)
+            return
+        # Replicas may not have seen the change yet either.
+        self._pin(username, email)
+        self._changed(username, email)
+
+    def _changed(self, username: Optional[str], email: Optional[str]) -> None:
+        for callback in self._subscribers:
+            callback(username, email)
+
+    def _listener_lost(self, connection) -> None:
+        # pylint: disable=unused-argument
+        logger.warning("Lost the connection listening to changes to users.")
+        self._listener = None
+        self._changed(None, None)  # Notifications may be missed meanwhile.
+        self._relisten = asyncio.ensure_future(self._listen_again())
+
+    async def _listen_again(self) -> None:
+        while True:
+            await asyncio.sleep(RELISTEN_DELAY)
+            try:
+                await self._listen()
+            except Exception as err:  # pylint: disable=broad-except
+                logger.warning("Failed to listen to changes to users: %s", err)
+                continue
+            # Changes made before listening again were missed.
+            self._changed(None, None)
+            self._relisten = None
+            return
+
+    async def _notify(
+        self, connection: asyncpg.Connection, username: str, email: str
+    ) -> None:
+        """Tell other processes a user changed, to be called by every
+        method changing a user.
+        """
+        await self._notify_many(connection, [(username, email)])
+
+    async def _notify_many(
+        self, connection: asyncpg.Connection, changes: Sequence[Tuple[str, str]]
+    ) -> None:
+        """Tell other processes users changed, given as (username,
+        email) pairs, in a single round trip.
+        """
+        if self.notify_channel and changes:
+            await connection.executemany(
+                "SELECT pg_notify($1, $2)",
+                [
+                    (
+                        self.notify_channel,
+                        json.dumps(
+                            {"node": self.node_id, "username": username, "email": email}
+                        ),
+                    )
+                    for username, email in changes
+                ],
+            )
+            self.notified += len(changes)
+
+    def _pin(self, *keys: str) -> None:
+        """Send reads about these usernames or emails to the primary
+        for a while, as replicas may not have seen the write yet.
+
+        Keys are lowercased, so logins differing only by their case
+        are pinned too.
+        """
+        for key in keys:
+            self.pinned.set(key.lower(), True)
+
+    def _reader(self, *keys: str) -> asyncpg.pool.Pool:
+        """The pool to read about the given usernames or emails from."""
+        if not self.replicas or any(self.pinned.get(key.lower()) for key in keys):
+            return self.pool
+        return next(self._next_replica)
 
     async def identify(self, username: str, password: str) -> Optional[User]:
         """Identifies the given username/password pair, returns a dict if found."""
-        async with self.pool.acquire() as connection:
-            result = await connection.fetchrow(
-                "SELECT * FROM users WHERE (username = $1 OR email = $1) ", username
-            )
-            if verify(password.encode("utf-8"), result["password"].encode("utf-8")):
-                return User(
-                    result["user_id"], result["username"], result["is_superuser"]
+        async with self._reader(username).acquire() as connection:
+            result = await connection.statements["identify"].fetchrow(username)
+        if result is None:
+            return None
+        # Hashing is done in the hashing executor, out of the event loop,
+        # and after releasing the connection back to the pool.
+        if await self.hashing.check_password(password, result["password"]):
+            if self.hashing.needs_rehash(result["password"]):
+                self.hashing.rehash_in_background(
+                    password,
+                    functools.partial(
+                        self._replace_hash, result["user_id"], result["password"]
+                    ),
                 )
+            return User(
+                result["user_id"],
+                result["username"],
+                result["email"],
+                result["is_superuser"],
+            )
         return None
 
     async def register_user(
         self, username: str, password: str, email: str, is_superuser: bool = False
     ):
-        password_hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+        password_hashed = await self.hashing.hash_password(password)
         user_id = str(uuid.uuid4())
         async with self.pool.acquire() as connection:
             try:
@@ -87,34 +347,56 @@ class DataStore(IdentityProvider):
                 """,
                     user_id,
                     username,
-                    password_hashed.decode("utf-8"),
+                    password_hashed,
                     email,
                     is_superuser,
                 )
             except asyncpg.exceptions.UniqueViolationError:
                 raise UserAlreadyExist
+            await self._notify(connection, username, email)
+        self._pin(username, email)
 
-    async def get_user_by_email(self, email):
+    async def get_user_by_email(self, email) -> Optional[User]:
         """Get user with provided email address"""
-        async with self.pool.acquire() as connection:
-            result = await connection.fetchrow(
-                """SELECT * FROM users WHERE email = $1""", email
-            )
-        user_data = dict(result)
-        del user_data["password"]
-        return User(**user_data)
+        async with self._reader(email).acquire() as connection:
+            result = await connection.statements["get_user_by_email"].fetchrow(email)
+        return None if result is None else User(**dict(result))
 
-    async def get_user_by_username(self, username):
+    async def get_user_by_username(self, username) -> Optional[User]:
         """Get user with provided username"""
+        async with self._reader(username).acquire() as connection:
+            statement = connection.statements["get_user_by_username"]
+            result = await statement.fetchrow(username)
+        return None if result is None else User(**dict(result))
+
+    async def get_users_by_usernames(self, usernames: Sequence[str]) -> List[User]:
+        """Get users with the provided usernames, in a single query."""
+        async with self._reader(*usernames).acquire() as connection:
+            records = await connection.fetch(GET_USERS_BY_USERNAMES, list(usernames))
+        return [User(**dict(record)) for record in records]
+
+    async def _replace_hash(self, user_id: str, old_hash: str, new_hash: str) -> None:
+        """Store a rehashed password, unless it changed in the meantime."""
         async with self.pool.acquire() as connection:
-            result = await connection.fetchrow(
-                """"SELECT * FROM users WHERE username = $1""", username
+            changed = await connection.fetchrow(
+                """
+                    UPDATE users
+                    SET password = $1
+                    WHERE user_id = $2 AND password = $3
+                    RETURNING username, email
+                """,
+                new_hash,
+                user_id,
+                old_hash,
             )
-        user_data = dict(result)
-        del user_data["password"]
-        return User(**user_data)
+            if changed is None:
+                return
+            await self._notify(connection, changed["username"], changed["email"])
+        # Else the next login, reading the old hash, would rehash it again.
+        self._pin(changed["username"], changed["email"])
 
     async def set_password_for_user(self, user: User, password: str):
+        password_hashed = await self.hashing.hash_password(password)
         async with self.pool.acquire() as connection:
             await connection.execute(
                 """
@@ -122,15 +404,100 @@ class DataStore(IdentityProvider):
                     SET password = $1
                     WHERE username = $2
                 """,
-                password,
+                password_hashed,
                 user.username,
             )
+            await self._notify(connection, user.username, user.email)
+        self._pin(user.username, user.email)
+
+    async def bulk_insert_users(self, users: Sequence[UserRecord]) -> List[UserRecord]:
+        """COPY users to a temporary table, then move them to the users
+        table, skipping the ones conflicting with an existing user.
+
+        Inserted users are notified, as other processes may have cached
+        their absence, and pinned to the primary.
+        """
+        user_ids = [user.user_id or str(uuid.uuid4()) for user in users]
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute(
+                    """
+                    CREATE TEMPORARY TABLE users_import
+                    (LIKE users INCLUDING DEFAULTS) ON COMMIT DROP
+                    """
+                )
+                await connection.copy_records_to_table(
+                    "users_import",
+                    columns=[
+                        "user_id",
+                        "username",
+                        "email",
+                        "password",
+                        "is_superuser",
+                    ],
+                    records=[
+                        (
+                            user_id,
+                            user.username,
+                            user.email,
+                            user.password,
+                            user.is_superuser,
+                        )
+                        for user_id, user in zip(user_ids, users)
+                    ],
+                )
+                inserted = await connection.fetch(
+                    """
+                    INSERT INTO users SELECT * FROM users_import
+                    ON CONFLICT DO NOTHING
+                    RETURNING user_id, username, email
+                    """
+                )
+                await self._notify_many(
+                    connection, [(row["username"], row["email"]) for row in inserted]
+                )
+        self._pin(*(key for row in inserted for key in (row["username"], row["email"])))
+        inserted_ids = {row["user_id"] for row in inserted}
+        return [
+            user
+            for user_id, user in zip(user_ids, users)
+            if user_id not in inserted_ids
+        ]
+
+    async def list_users(self, after: Optional[str], limit: int) -> List[User]:
+        """List users sorted by username, after the given one."""
+        async with self._reader().acquire() as connection:
+            records = await connection.fetch(LIST_USERS, after or "", limit)
+        return [User(**dict(record)) for record in records]
+
+    async def iter_users(self) -> AsyncIterator[User]:
+        """Iterate over all users, through a server-side cursor."""
+        async with self._reader().acquire() as connection:
+            async with connection.transaction():
+                async for record in connection.cursor(
+                    ITER_USERS, prefetch=ITER_USERS_PREFETCH
+                ):
+                    yield User(**dict(record))
 
     async def is_connection_alive(self) -> bool:
-        """Verify that connection is alive, always return True"""
+        """Verify that the primary and all replicas answer."""
         try:
-            async with self.pool.acquire() as connection:
-                connection.execute("SELECT 1")
-                return True
-        except AttributeError:
+            for pool in [self.pool, *self.replicas]:
+                async with pool.acquire() as connection:
+                    await connection.execute("SELECT 1")
+            return True
+        except (AttributeError, OSError, asyncpg.PostgresError):
             return False
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            pool = self.pool
+        except AttributeError:  # Not started.
+            return {}
+        return {
+            "pool": _pool_stats(pool),
+            "replicas": [_pool_stats(replica) for replica in self.replicas],
+            "pinned": len(self.pinned),
+            "notified": self.notified,
+            "listening": self._listener is not None,
+        }
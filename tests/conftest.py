@@ -1,3 +1,4 @@
+import base64
 from datetime import datetime, timedelta
 
 import jwt
@@ -7,11 +8,52 @@ import kisee.kisee as kisee
 from kisee.providers.demo import DemoBackend
 
 
+class CountingBackend(DemoBackend):
+    """Counts the lookups reaching the backend."""
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.lookups = 0
+        self.bulk_lookups = []
+
+    async def get_user_by_username(self, username):
+        self.lookups += 1
+        return await super().get_user_by_username(username)
+
+    async def get_user_by_email(self, email):
+        self.lookups += 1
+        return await super().get_user_by_email(email)
+
+    async def get_users_by_usernames(self, usernames):
+        self.bulk_lookups.append(list(usernames))
+        return await super().get_users_by_usernames(usernames)
+
+
 @pytest.fixture
 def backend():
     return DemoBackend({})
 
 
+@pytest.fixture
+def counting():
+    return CountingBackend({})
+
+
+@pytest.fixture
+def basic():
+    def basic(username, password):
+        credentials = base64.b64encode(f"{username}:{password}".encode()).decode()
+        return "Basic " + credentials
+
+    return basic
+
+
+@pytest.fixture
+def root_auth(client, basic):
+    password = client.app["identity_backend"].storage["root"].password
+    return {"Authorization": basic("root", password), "Accept": "application/json"}
+
+
 @pytest.fixture
 def settings():
     return kisee.load_conf("tests/test_settings.toml")
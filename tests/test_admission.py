@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from kisee.admission import AdmissionController
+
+
+async def test_unlimited():
+    admission = AdmissionController()
+    async with admission:
+        async with admission:
+            assert admission.active == 2
+    assert admission.stats()["admitted"] == 2
+
+
+async def test_queue_then_reject():
+    admission = AdmissionController(concurrency=1, queue=1, retry_after=7)
+    release = asyncio.Event()
+
+    async def verify():
+        async with admission:
+            await release.wait()
+
+    running = asyncio.ensure_future(verify())
+    waiting = asyncio.ensure_future(verify())
+    await asyncio.sleep(0)
+    assert admission.stats()["waiting"] == 1
+    with pytest.raises(web.HTTPServiceUnavailable) as err:
+        await admission.__aenter__()
+    assert err.value.headers["Retry-After"] == "7"
+    release.set()
+    await asyncio.gather(running, waiting)
+    assert admission.stats() == {
+        "concurrency": 1,
+        "queue": 1,
+        "active": 0,
+        "waiting": 0,
+        "admitted": 2,
+        "rejected": 1,
+    }
+
+
+async def test_cancelled_while_waiting():
+    admission = AdmissionController(concurrency=1, queue=2)
+    release = asyncio.Event()
+
+    async def verify():
+        async with admission:
+            await release.wait()
+
+    running = asyncio.ensure_future(verify())
+    waiting = asyncio.ensure_future(verify())
+    await asyncio.sleep(0)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert admission.stats()["waiting"] == 0
+    release.set()
+    await running
+    assert admission.active == 0
+
+
+async def test_cancelled_after_being_admitted():
+    admission = AdmissionController(concurrency=1, queue=2)
+    admission.active = 1
+
+    waiting = asyncio.ensure_future(admission.__aenter__())
+    await asyncio.sleep(0)
+    admission._release()  # Hands the slot to the waiter...
+    waiting.cancel()  # ... which is cancelled before using it.
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert admission.active == 0
+
+
+def test_from_settings():
+    admission = AdmissionController.from_settings({}, default_concurrency=2)
+    assert admission.concurrency == 2
+    assert admission.queue == 8
+    admission = AdmissionController.from_settings(
+        {"admission": {"concurrency": 3, "queue": 1, "retry_after": 5}},
+        default_concurrency=2,
+    )
+    assert (admission.concurrency, admission.queue, admission.retry_after) == (3, 1, 5)
+
+
+async def test_post_jwt_overloaded(client):
+    client.app["admission"].concurrency = 0
+    client.app["admission"].queue = 0
+    response = await client.post("/jwt/", json={"username": "root", "password": "x"})
+    assert response.status == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.content_type == "application/problem+json"
+
+
+async def test_release_skips_cancelled_waiters():
+    admission = AdmissionController(concurrency=1, queue=2)
+    admission.active = 1
+
+    waiting = asyncio.ensure_future(admission.__aenter__())
+    await asyncio.sleep(0)
+    waiting.cancel()  # Cancels the waiter now, the task only on next iteration.
+    admission._release()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert admission.active == 0
+    assert admission.stats()["waiting"] == 0
@@ -9,6 +9,7 @@ import pytest
 from kisee import authentication, kisee
 from kisee.authentication import _basic_authentication, _jwt_authentication
 from kisee.identity_provider import ProviderError
+from kisee.tokens import TokenCodec, TokenPool
 
 
 @pytest.fixture
@@ -16,6 +17,11 @@ def settings():
     return kisee.load_conf("tests/test_settings.toml")
 
 
+@pytest.fixture
+def tokens(settings):
+    return TokenPool(TokenCodec.from_settings(settings))
+
+
 @pytest.fixture
 def valid_token(settings):
     return jwt.encode(
@@ -30,19 +36,17 @@ def valid_token(settings):
     )
 
 
-async def test_jwt_authentication_fails(settings, backend):
+async def test_jwt_authentication_fails(tokens, backend):
     """Assert that a random string is never a valid token.
     """
     s = b"foobar"
     with pytest.raises(aiohttp.web_exceptions.HTTPUnauthorized):
-        await _jwt_authentication(s, backend, settings["jwt"]["public_key"])
+        await _jwt_authentication(s, backend, tokens)
 
 
-async def test_jwt_authentication_succeed(settings, valid_token, backend):
+async def test_jwt_authentication_succeed(tokens, valid_token, backend):
     await backend.register_user("toto", "toto", "toto", "toto@example.com")
-    user, claims = await _jwt_authentication(
-        valid_token, backend, settings["jwt"]["public_key"]
-    )
+    user, claims = await _jwt_authentication(valid_token, backend, tokens)
     assert user.username == "toto"
 
 
@@ -85,10 +89,10 @@ async def test_basic_authentication_no_user(backend):
 
 
 @pytest.fixture
-def fake_request(settings, valid_token):
+def fake_request(settings, tokens, valid_token):
     fake_request = SimpleNamespace()
     fake_request.headers = {"Authorization": "Bearer " + valid_token}
-    fake_request.app = {"settings": settings}
+    fake_request.app = {"settings": settings, "tokens": tokens}
     return fake_request
 
 
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from kisee.batching import Batching, MicroBatcher
+
+
+def test_batching_from_section():
+    assert Batching.from_section({}) == Batching(window=0.002, max_batch=64)
+    assert Batching.from_section({"batch_window": 10, "max_batch": 8}) == (0.01, 8)
+
+
+async def test_micro_batcher():
+    batches = []
+
+    async def run(items):
+        batches.append(items)
+        return [(item >= 0, item if item >= 0 else ValueError(item)) for item in items]
+
+    batcher = MicroBatcher(run, Batching(window=0.01, max_batch=3))
+    futures = [batcher.submit(i) for i in (0, 1, -1, 3)]
+    assert await asyncio.gather(*futures[:2]) == [0, 1]
+    with pytest.raises(ValueError):
+        await futures[2]
+    assert await futures[3] == 3
+    assert batches == [[0, 1, -1], [3]]  # One full batch, one on timer.
+    assert batcher.stats() == {"batches": 2, "avg_batch_size": 2.0}
+
+
+async def test_micro_batcher_drain():
+    async def run(items):
+        await asyncio.sleep(0.01)
+        return [(True, item) for item in items]
+
+    batcher = MicroBatcher(run, Batching(window=60))
+    future = batcher.submit("item")
+    await batcher.drain()
+    assert future.result() == "item"
+    await batcher.drain()  # Nothing pending.
+    assert batcher.stats()["batches"] == 1
+
+
+async def test_micro_batcher_failures():
+    async def run(items):
+        raise RuntimeError("Worker died")
+
+    batcher = MicroBatcher(run, Batching(max_batch=2))
+    cancelled, failed = batcher.submit(1), batcher.submit(2)
+    cancelled.cancel()
+    with pytest.raises(RuntimeError):
+        await failed
+
+    started = asyncio.Event()
+
+    async def stuck(items):
+        started.set()
+        await asyncio.sleep(60)
+
+    batcher = MicroBatcher(stuck, Batching(max_batch=1))
+    future = batcher.submit(1)
+    [job] = batcher._running
+    await started.wait()
+    job.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await future
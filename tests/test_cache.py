@@ -0,0 +1,46 @@
+from kisee.cache import LRUCache
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    assert cache.stats()["hit_ratio"] is None
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # Evicts b, the least recently used.
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    cache.pop("c")
+    cache.pop("c")
+    assert len(cache) == 1
+    assert cache.stats() == {
+        "size": 1,
+        "maxsize": 2,
+        "hits": 2,
+        "misses": 1,
+        "evictions": 1,
+        "expirations": 0,
+        "hit_ratio": 0.667,
+    }
+
+
+def test_lru_cache_expiration():
+    now = [1000.0]
+    cache = LRUCache(maxsize=10, ttl=10, clock=lambda: now[0])
+    cache.set("ttl", 1)
+    cache.set("early", 2, expires_at=1005)
+    cache.set("late", 3, expires_at=2000)  # Capped by the ttl.
+    cache.set("forever", 4)
+    now[0] = 1006
+    assert cache.get("early") is None
+    assert cache.get("ttl") == 1
+    now[0] = 1010
+    assert cache.get("ttl") is None
+    assert cache.get("late") is None
+    assert cache.stats()["expirations"] == 3
+    cache = LRUCache(maxsize=10, clock=lambda: now[0])
+    cache.set("forever", 4)
+    cache.set("until", 5, expires_at=1011)
+    now[0] = 10**6
+    assert cache.get("forever") == 4
+    assert cache.get("until") is None
@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+
+from kisee.identity_provider import ProviderWrapper, UserAlreadyExist
+from kisee.providers.caching import CachingProvider
+from kisee.providers.demo import DemoBackend
+
+
+async def test_cached_lookups(counting):
+    idp = CachingProvider(counting, size=10, ttl=60)
+    for _ in range(3):
+        assert (await idp.get_user_by_username("root")).username == "root"
+        assert (await idp.get_user_by_email("root@example.com")).username == "root"
+    assert counting.lookups == 2
+    stats = idp.stats()["cache"]
+    assert stats["hits"] == 4
+    assert stats["misses"] == 2
+
+
+async def test_unknown_users_are_not_cached(counting):
+    idp = CachingProvider(counting)
+    assert await idp.get_user_by_username("toto") is None
+    assert await idp.get_user_by_email("toto@example.com") is None
+    await idp.register_user("toto", "tata", "toto@example.com")
+    assert (await idp.get_user_by_username("toto")).email == "toto@example.com"
+    assert (await idp.get_user_by_email("toto@example.com")).username == "toto"
+
+
+async def test_invalidated_on_set_password(counting):
+    idp = CachingProvider(counting)
+    user = await idp.get_user_by_username("root")
+    await idp.get_user_by_email("root@example.com")
+    await idp.set_password_for_user(user, "new password")
+    assert len(idp.cache) == 0
+    assert await idp.identify("root", "new password")
+    await idp.get_user_by_username("root")
+    assert counting.lookups == 3
+
+
+class SlowBackend(DemoBackend):
+    def __init__(self, options):
+        super().__init__(options)
+        self.release = asyncio.Event()
+
+    async def get_user_by_username(self, username):
+        user = await super().get_user_by_username(username)
+        await self.release.wait()
+        return user
+
+    async def get_users_by_usernames(self, usernames):
+        users = await super().get_users_by_usernames(usernames)
+        await self.release.wait()
+        return users
+
+    async def get_user_by_email(self, email):
+        user = await super().get_user_by_email(email)
+        await self.release.wait()
+        return user
+
+
+async def test_lookup_racing_invalidation():
+    backend = SlowBackend({})
+    idp = CachingProvider(backend)
+    lookups = asyncio.gather(
+        idp.get_user_by_username("root"),
+        idp.get_users_by_usernames(["root"]),
+        idp.get_user_by_email("root@example.com"),
+    )
+    await asyncio.sleep(0)
+    idp.invalidate("root", "root@example.com")  # Like set_password_for_user.
+    backend.release.set()
+    user, [same], _ = await lookups
+    assert user.username == same.username == "root"
+    assert len(idp.cache) == 0  # The lookups may have found the old user.
+    await idp.get_user_by_username("root")
+    assert len(idp.cache) == 1
+
+
+async def test_invalidated_on_failed_register(counting):
+    idp = CachingProvider(counting)
+    await idp.get_user_by_username("root")
+    with pytest.raises(UserAlreadyExist):
+        await idp.register_user("root", "root", "root@example.com")
+    assert len(idp.cache) == 0
+
+
+async def test_invalidated_by_other_processes(counting):
+    callbacks = []
+    counting.on_change = callbacks.append
+    idp = CachingProvider(ProviderWrapper(counting))
+    [changed] = callbacks
+    await idp.get_user_by_username("root")
+    await idp.get_user_by_email("root@example.com")
+    changed("root", "root@example.com")
+    assert len(idp.cache) == 0
+    await idp.get_user_by_username("root")
+    changed("other", "other@example.com")
+    assert len(idp.cache) == 1
+    changed(None, None)  # Changes may have been missed.
+    assert len(idp.cache) == 0
+    assert idp.stats()["cache"]["remote_invalidations"] == 3
+
+
+async def test_ttl_and_size(counting):
+    idp = CachingProvider(counting, size=1, ttl=0)
+    await idp.get_user_by_username("root")
+    await idp.get_user_by_username("root")
+    assert counting.lookups == 2
+    assert idp.stats()["cache"]["expirations"] == 1
+
+
+async def test_wrapper_delegates(counting):
+    idp = ProviderWrapper(counting)
+    async with idp as entered:
+        assert entered is idp
+    assert idp.storage is counting.storage
+    with pytest.raises(AttributeError):
+        idp.nope  # pylint: disable=pointless-statement
+    assert idp.hashing is counting.hashing
+    idp.hashing = None
+    assert counting._hashing is None
+    assert await idp.is_connection_alive()
+    await idp.register_user("toto", "tata", "toto@example.com")
+    user = await idp.get_user_by_email("toto@example.com")
+    await idp.set_password_for_user(user, "titi")
+    assert await idp.identify("toto", "titi") is user
+    assert await idp.get_user_by_username("toto") is user
+    await idp.send_reset_password_challenge(user, "42")
+    assert counting.password_reset_tokens == ["42"]
+    assert idp.stats() == {}
+
+
+async def test_cache_stats_in_health(aiohttp_client, settings):
+    from kisee import kisee
+
+    settings["identity_backend"]["cache"] = {"size": 16, "ttl": 30}
+    client = await aiohttp_client(kisee.create_app(settings))
+    assert isinstance(client.app["identity_backend"], CachingProvider)
+    response = await client.get("/health")
+    body = await response.json()
+    assert body["identity_backend"]["cache"]["maxsize"] == 16
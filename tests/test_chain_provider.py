@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+
+from kisee.hashing import BcryptHasher, HashingExecutor, hash_password
+from kisee.identity_provider import UserAlreadyExist, UserRecord, load_idp
+
+
+def chain(tmp_path, migrate=True):
+    backend = load_idp(
+        {
+            "class": "kisee.providers.chain.ChainProvider",
+            "options": {
+                "migrate": migrate,
+                "tiers": [
+                    {
+                        "class": "kisee.providers.local.LocalBackend",
+                        "options": {"path": str(tmp_path)},
+                    },
+                    {"class": "kisee.providers.demo.DemoBackend"},
+                ],
+            },
+        }
+    )
+    backend.hashing = HashingExecutor(workers=1, hasher=BcryptHasher(4))
+    return backend
+
+
+async def settle(backend):
+    while backend._background:
+        await asyncio.sleep(0.01)
+
+
+async def test_chain_lookups(tmp_path):
+    async with chain(tmp_path, migrate=False) as backend:
+        fast, legacy = backend.backends
+        assert backend.hashing is fast.hashing is legacy.hashing
+        await legacy.register_user("legacy", "old", "legacy@example.com")
+        await backend.register_user("alice", "secret", "alice@example.com")
+        assert "alice" in fast.users
+        assert await backend.is_connection_alive()
+        assert (await backend.identify("alice", "secret")).username == "alice"
+        assert (await backend.identify("legacy", "old")).username == "legacy"
+        assert await backend.identify("legacy", "wrong") is None
+        assert await backend.identify("nobody", "secret") is None
+        assert (await backend.get_user_by_username("legacy")).email == (
+            "legacy@example.com"
+        )
+        assert (await backend.get_user_by_email("alice@example.com")).username == (
+            "alice"
+        )
+        assert await backend.get_user_by_email("nobody@example.com") is None
+        assert await backend.get_user_by_username("nobody") is None
+        users = await backend.get_users_by_usernames(["legacy", "nobody", "alice"])
+        assert [user.username for user in users] == ["legacy", "alice"]
+        assert await backend.get_users_by_usernames([]) == []
+        for username, email in (
+            ("legacy", "other@example.com"),
+            ("other", "legacy@example.com"),
+        ):
+            with pytest.raises(UserAlreadyExist):
+                await backend.register_user(username, "secret", email)
+        legacy_user = await backend.get_user_by_username("legacy")
+        await backend.set_password_for_user(legacy_user, "new")
+        assert legacy.storage["legacy"].password == "new"
+        assert "legacy" not in fast.users
+        await backend.send_reset_password_challenge(legacy_user, "challenge")
+        assert legacy.password_reset_tokens == ["challenge"]
+        assert backend.stats()["migrated"] == 0
+
+
+async def test_chain_migration(tmp_path):
+    async with chain(tmp_path) as backend:
+        fast, legacy = backend.backends
+        await legacy.register_user("legacy", "old", "legacy@example.com")
+        await legacy.register_user("other", "old", "other@example.com")
+        assert (await backend.identify("legacy", "old")).username == "legacy"
+        await settle(backend)
+        assert await fast.identify("legacy", "old")
+        assert fast.users["legacy"].user_id == legacy.storage["legacy"].user_id
+        # Once migrated, only the first tier password counts.
+        legacy.storage["legacy"].password = "changed"
+        assert await backend.identify("legacy", "changed") is None
+        assert await backend.identify("legacy", "old")
+        # Changing the password migrates too.
+        other = await backend.get_user_by_username("other")
+        await backend.set_password_for_user(other, "new")
+        assert await fast.identify("other", "new")
+        assert fast.users["other"].user_id == other.user_id
+        assert backend.stats()["migrated"] == 2
+        await backend.set_password_for_user(other, "newer")
+        assert await fast.identify("other", "newer")
+        # A concurrent login already migrated it.
+        await backend._migrate(other, "new")
+        assert backend.stats()["migrated"] == 2
+        # Or does it while the password is changed.
+        await legacy.register_user("late", "old", "late@example.com")
+        late = await backend.get_user_by_username("late")
+
+        async def holder(username):
+            await backend._migrate(late, "old")
+            return legacy
+
+        backend._holder = holder
+        await backend.set_password_for_user(late, "new")
+        assert await fast.identify("late", "new")
+
+
+async def test_chain_waits_for_migrations(tmp_path):
+    async with chain(tmp_path) as backend:
+        fast, legacy = backend.backends
+        await legacy.register_user("legacy", "old", "legacy@example.com")
+        assert await backend.identify("legacy", "old")
+        assert backend.stats()["migrating"] == 1
+    assert "legacy" in fast.users
+    assert backend.stats()["migrating"] == 0
+
+
+async def test_chain_migration_failure(tmp_path):
+    async with chain(tmp_path) as backend:
+        fast, legacy = backend.backends
+
+        async def broken(*args, **kwargs):
+            raise OSError("Disk full.")
+
+        fast.bulk_insert_users = broken
+        assert await backend.identify("root", legacy.storage["root"].password)
+        await settle(backend)
+        assert backend.stats()["migration_failures"] == 1
+        # Password changes don't hide the failure.
+        root = await backend.get_user_by_username("root")
+        with pytest.raises(OSError):
+            await backend.set_password_for_user(root, "secret")
+        assert backend.stats()["migration_failures"] == 1
+
+
+async def test_chain_listing(tmp_path):
+    async with chain(tmp_path) as backend:
+        fast, legacy = backend.backends
+        await legacy.register_user("legacy", "old", "legacy@example.com")
+        await backend.identify("legacy", "old")
+        await settle(backend)
+        await backend.register_user("alice", "secret", "alice@example.com")
+        page = await backend.list_users(None, 10)
+        assert [user.username for user in page] == ["alice", "legacy", "root"]
+        assert page[1] is fast.users["legacy"]
+        page = await backend.list_users("alice", 1)
+        assert [user.username for user in page] == ["legacy"]
+        usernames = [user.username async for user in backend.iter_users()]
+        assert sorted(usernames) == ["alice", "legacy", "root"]
+
+
+async def test_chain_to_the_first_tier(tmp_path):
+    hashed = hash_password(b"secret", 4).decode()
+    async with chain(tmp_path) as backend:
+        fast, legacy = backend.backends
+        assert (
+            await backend.bulk_insert_users([UserRecord("bob", "b@b.b", hashed)]) == []
+        )
+        assert "bob" in fast.users
+        ghost = await legacy.get_user_by_username("root")
+        del legacy.storage["root"]
+        await backend.set_password_for_user(ghost, "secret")
+        assert "root" not in fast.users
+        await backend.send_reset_password_challenge(ghost, "challenge")
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from kisee.identity_provider import load_idp
+from kisee.providers.caching import CachingProvider
+from kisee.providers.coalescing import CoalescingProvider
+from kisee.providers.demo import DemoBackend
+
+
+class SlowBackend(DemoBackend):
+    def __init__(self, options):
+        super().__init__(options)
+        self.lookups = 0
+        self.release = asyncio.Event()
+
+    async def get_user_by_username(self, username):
+        self.lookups += 1
+        await self.release.wait()
+        if username == "boom":
+            raise ConnectionError("Database looks down.")
+        return await super().get_user_by_username(username)
+
+    async def get_user_by_email(self, email):
+        self.lookups += 1
+        await self.release.wait()
+        return await super().get_user_by_email(email)
+
+
+@pytest.fixture
+def slow(loop):
+    return SlowBackend({})
+
+
+async def test_concurrent_lookups_are_coalesced(slow):
+    idp = CoalescingProvider(slow)
+    lookups = [
+        asyncio.ensure_future(idp.get_user_by_username("root")) for _ in range(10)
+    ] + [asyncio.ensure_future(idp.get_user_by_email("root@example.com"))]
+    await asyncio.sleep(0)
+    assert idp.stats()["coalescing"]["in_flight"] == 2
+    slow.release.set()
+    users = await asyncio.gather(*lookups)
+    assert all(user is users[0] for user in users)
+    assert slow.lookups == 2
+    assert idp.stats()["coalescing"] == {"calls": 2, "coalesced": 9, "in_flight": 0}
+
+    # Once replied, next lookups reach the backend again:
+    await idp.get_user_by_username("root")
+    assert slow.lookups == 3
+
+
+async def test_errors_are_shared(slow):
+    idp = CoalescingProvider(slow)
+    lookups = [
+        asyncio.ensure_future(idp.get_user_by_username("boom")) for _ in range(3)
+    ]
+    await asyncio.sleep(0)
+    slow.release.set()
+    for result in await asyncio.gather(*lookups, return_exceptions=True):
+        assert isinstance(result, ConnectionError)
+    assert slow.lookups == 1
+
+
+async def test_cancelled_caller_does_not_cancel_others(slow):
+    idp = CoalescingProvider(slow)
+    first = asyncio.ensure_future(idp.get_user_by_username("root"))
+    second = asyncio.ensure_future(idp.get_user_by_username("root"))
+    await asyncio.sleep(0)
+    first.cancel()
+    slow.release.set()
+    assert (await second).username == "root"
+    assert first.cancelled()
+
+
+def test_coalescing_below_cache():
+    idp = load_idp(
+        {
+            "class": "kisee.providers.demo.DemoBackend",
+            "coalesce": {},
+            "cache": {"size": 10},
+        }
+    )
+    assert isinstance(idp, CachingProvider)
+    assert isinstance(idp.backend, CoalescingProvider)
+    assert "coalescing" in idp.stats() and "cache" in idp.stats()
+
+
+async def test_lookups_after_invalidation_are_not_coalesced(slow):
+    idp = load_idp(
+        {"class": "kisee.providers.demo.DemoBackend", "coalesce": {}, "cache": {}}
+    )
+    idp.backend.backend = slow
+    before = asyncio.ensure_future(idp.get_user_by_username("root"))
+    await asyncio.sleep(0)
+    idp.invalidate("root", "root@example.com")  # Like set_password_for_user.
+    after = asyncio.ensure_future(idp.get_user_by_username("root"))
+    slow.release.set()
+    assert (await before).username == (await after).username == "root"
+    assert slow.lookups == 2
+    assert idp.cache.get(("username", "root")) is not None  # Found by after.
+    assert idp.stats()["coalescing"] == {"calls": 2, "coalesced": 0, "in_flight": 0}
+
+
+async def test_forget_everything(slow):
+    idp = CoalescingProvider(slow)
+    lookups = [
+        asyncio.ensure_future(idp.get_user_by_username("root")),
+        asyncio.ensure_future(idp.get_user_by_email("root@example.com")),
+    ]
+    await asyncio.sleep(0)
+    idp.forget(None, None)  # Like a lost change notifications connection.
+    assert idp.stats()["coalescing"]["in_flight"] == 0
+    slow.release.set()
+    await asyncio.gather(*lookups)
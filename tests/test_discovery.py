@@ -0,0 +1,42 @@
+import pytest
+
+from kisee.serializers import Rendered
+
+
+@pytest.mark.parametrize("path", ["/", "/users/", "/jwt/", "/password_recoveries/"])
+async def test_discovery_etag(client, path):
+    response = await client.get(path)
+    assert response.status == 200
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "public, max-age=300"
+    assert "Origin" in response.headers["Vary"]
+    response = await client.get(path, headers={"If-None-Match": etag})
+    assert response.status == 304
+    assert response.headers["ETag"] == etag
+    assert await response.read() == b""
+    response = await client.get(path, headers={"If-None-Match": '"other"'})
+    assert response.status == 200
+
+
+async def test_discovery_per_media_type(client):
+    coreapi = await client.get("/jwt/")
+    as_json = await client.get("/jwt/", headers={"Accept": "application/json"})
+    assert coreapi.headers["ETag"] != as_json.headers["ETag"]
+    assert (await coreapi.json())["_type"] == "document"
+    assert (await as_json.json())["add_token"].endswith("/jwt/")
+
+
+async def test_discovery_body(client):
+    response = await client.get("/")
+    assert response.content_type == "application/json-home"
+    body = await response.json()
+    assert body["resources"]["jwt"]["href"].endswith("/jwt/")
+
+
+def test_rendered_matches():
+    rendered = Rendered(b"{}", content_type="application/json")
+    assert not rendered.matches(None)
+    assert not rendered.matches('"foo"')
+    assert rendered.matches("*")
+    assert rendered.matches(rendered.etag)
+    assert rendered.matches(f'"foo", W/{rendered.etag}')
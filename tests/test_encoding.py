@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from kisee import encoding as kisee_encoding
+from kisee import kisee
+from kisee.encoding import (
+    get_encoder,
+    get_jsonl_encoder,
+    jsonl_chunks,
+    orjson_encoder,
+    stdlib_encoder,
+)
+
+
+def test_stdlib_encoder():
+    assert stdlib_encoder(pretty=False)({"a": [1, 2]}) == b'{"a":[1,2]}'
+    assert stdlib_encoder(pretty=True)({"a": 1}) == b'{\n  "a": 1\n}'
+
+
+def test_encoders_agree():
+    document = {"a": [1, {"b": "é", "c": None}], "d": True, "e": 1.5}
+    for pretty in False, True:
+        assert stdlib_encoder(pretty)(document) == orjson_encoder(pretty)(document)
+
+
+def test_get_encoder_without_orjson(monkeypatch):
+    monkeypatch.setattr(kisee_encoding, "orjson", None)
+    assert get_encoder({"server": {"json": "compact"}})({"a": 1}) == b'{"a":1}'
+
+
+def test_get_encoder():
+    document = {"a": [1, {"b": "é"}]}
+    for style in "compact", "pretty":
+        encoder = get_encoder({"server": {"json": style}})
+        assert json.loads(encoder(document)) == document
+    assert get_encoder({})({"a": 1}) != get_encoder({"server": {"json": "compact"}})(
+        {"a": 1}
+    )
+
+
+def test_get_encoder_bad_style():
+    with pytest.raises(ValueError):
+        get_encoder({"server": {"json": "ugly"}})
+
+
+def test_get_custom_encoder():
+    encoder = get_encoder(
+        {"server": {"json": "compact", "json_encoder": "kisee.encoding.stdlib_encoder"}}
+    )
+    assert encoder({"a": 1}) == b'{"a":1}'
+
+
+async def test_compact_responses(aiohttp_client, settings):
+    settings = dict(settings, server=dict(settings["server"], json="compact"))
+    client = await aiohttp_client(kisee.create_app(settings))
+    for path in "/", "/jwt/", "/health", "/nope":
+        response = await client.get(path)
+        assert b"\n" not in await response.read()
+
+
+async def test_jsonl_chunks(monkeypatch):
+    monkeypatch.setattr(kisee_encoding, "JSONL_CHUNK_SIZE", 2)
+
+    async def documents():
+        for i in range(5):
+            yield {"i": i}
+
+    encoder = get_jsonl_encoder({"server": {"json": "pretty"}})
+    chunks = [chunk async for chunk in jsonl_chunks(documents(), encoder)]
+    assert len(chunks) == 3
+    lines = b"".join(chunks).splitlines()
+    assert [json.loads(line) for line in lines] == [{"i": i} for i in range(5)]
+
+
+async def test_jsonl_chunks_empty():
+    async def documents():
+        for document in ():
+            yield document  # pragma: no cover
+
+    encoder = get_jsonl_encoder({})
+    assert [chunk async for chunk in jsonl_chunks(documents(), encoder)] == []
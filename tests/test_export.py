@@ -0,0 +1,100 @@
+import io
+import json
+
+from kisee import exporter
+from kisee.identity_provider import NotSupported, ProviderWrapper
+from kisee.providers.demo import DemoBackend
+
+
+async def test_export_users(client, basic):
+    backend = client.app["identity_backend"]
+    await backend.register_user("toto", "tata", "toto@example.com")
+    root_password = backend.storage["root"].password
+    response = await client.get(
+        "/users/?export=jsonl", headers={"Authorization": basic("root", root_password)}
+    )
+    assert response.status == 200
+    assert response.content_type == "application/x-ndjson"
+    assert response.headers["Cache-Control"] == "no-store"
+    users = [json.loads(line) for line in (await response.read()).splitlines()]
+    assert users == [
+        {
+            "user_id": "root",
+            "username": "root",
+            "email": "root@example.com",
+            "is_superuser": True,
+        },
+        {
+            "user_id": "toto",
+            "username": "toto",
+            "email": "toto@example.com",
+            "is_superuser": False,
+        },
+    ]
+    assert "password" not in users[0]
+
+
+async def test_export_users_needs_superuser(client, basic):
+    backend = client.app["identity_backend"]
+    await backend.register_user("toto", "tata", "toto@example.com")
+    response = await client.get(
+        "/users/?export=jsonl", headers={"Authorization": basic("toto", "tata")}
+    )
+    assert response.status == 403
+    response = await client.get("/users/?export=jsonl")
+    assert response.status == 401
+
+
+async def test_export_users_bad_format(client):
+    response = await client.get("/users/?export=csv")
+    assert response.status == 400
+
+
+async def test_export_users_not_implemented(client, monkeypatch, basic):
+    backend = client.app["identity_backend"]
+
+    async def iter_users():
+        raise NotSupported
+        yield  # pragma: no cover
+
+    monkeypatch.setattr(backend, "iter_users", iter_users)
+    response = await client.get(
+        "/users/?export=jsonl",
+        headers={"Authorization": basic("root", backend.storage["root"].password)},
+    )
+    assert response.status == 501
+
+
+async def test_export_no_users(client, monkeypatch, basic):
+    backend = client.app["identity_backend"]
+    password = backend.storage["root"].password
+
+    async def iter_users():
+        for user in ():
+            yield user  # pragma: no cover
+
+    monkeypatch.setattr(backend, "iter_users", iter_users)
+    response = await client.get(
+        "/users/?export=jsonl", headers={"Authorization": basic("root", password)}
+    )
+    assert response.status == 200
+    assert await response.read() == b""
+
+
+async def test_wrapper_iter_users():
+    backend = DemoBackend({})
+    users = [user async for user in ProviderWrapper(backend).iter_users()]
+    assert [user.username for user in users] == ["root"]
+
+
+async def test_kisee_export(tmp_path):
+    args = exporter.parse_args(["--settings", "tests/test_settings.toml"])
+    stdout = io.BytesIO()
+    assert await exporter.export(args, stdout) == 1
+    assert json.loads(stdout.getvalue())["username"] == "root"
+    assert not stdout.closed
+
+    output = tmp_path / "users.jsonl"
+    args = exporter.parse_args([str(output), "--settings", "tests/test_settings.toml"])
+    assert await exporter.export(args, stdout) == 1
+    assert json.loads(output.read_bytes())["email"] == "root@example.com"
@@ -0,0 +1,175 @@
+import bcrypt
+import pytest
+
+from kisee import hashing
+from kisee.hashing import (
+    BcryptHasher,
+    HashingExecutor,
+    ScryptHasher,
+    bcrypt_rounds,
+    calibrate,
+    hash_password,
+    identify,
+    verify,
+)
+
+
+def test_verify():
+    hashed = hash_password(b"secret")
+    assert verify(b"secret", hashed)
+    assert not verify(b"not secret", hashed)
+
+
+def test_verify_unknown_format():
+    with pytest.raises(ValueError):
+        verify(b"secret", b"$1$foo")
+
+
+def test_unknown_executor_kind():
+    with pytest.raises(ValueError):
+        HashingExecutor(kind="fiber")
+
+
+def test_from_settings():
+    executor = HashingExecutor.from_settings(
+        {"hashing": {"executor": "process", "workers": 3}}
+    )
+    assert executor.kind == "process"
+    assert executor.workers == 3
+    assert HashingExecutor.from_settings({}).kind == "thread"
+
+
+async def test_hash_and_check_password():
+    executor = HashingExecutor(workers=2)
+    hashed = await executor.hash_password("secret")
+    assert hashed.startswith("$2b$")
+    assert await executor.check_password("secret", hashed)
+    assert not await executor.check_password("wrong", hashed)
+    stats = executor.stats()
+    assert stats["completed"] == 3
+    assert stats["in_flight"] == 0
+    assert stats["queue_depth"] == 0
+    executor.shutdown()
+    executor.shutdown()  # Shutting down twice is harmless
+
+
+async def test_process_executor():
+    executor = HashingExecutor(kind="process", workers=1)
+    try:
+        assert await executor.run(bcrypt.gensalt, 4)
+    finally:
+        executor.shutdown()
+
+
+async def test_backend_default_hashing(backend):
+    assert backend.hashing is backend.hashing
+    executor = HashingExecutor()
+    backend.hashing = executor
+    assert backend.hashing is executor
+
+
+def test_bcrypt_rounds():
+    assert bcrypt_rounds(hash_password(b"secret", 5)) == 5
+    assert bcrypt_rounds(b"$2a$10$whatever") is None
+    assert bcrypt_rounds(b"$2b$many$whatever") is None
+    assert bcrypt_rounds(b"plaintext") is None
+
+
+def test_bcrypt_is_valid():
+    assert BcryptHasher.is_valid(hash_password(b"secret", 4))
+    assert not BcryptHasher.is_valid(b"$2b$04$tooshort")
+    assert not BcryptHasher.is_valid(b"$2b$99$" + b"a" * 53)
+    assert not BcryptHasher.is_valid(b"$2b$many$" + b"a" * 51)
+
+
+def test_calibrate():
+    # Cheap hashes take 1ms each, so 10 rounds should take 64ms, but
+    # the check says 100ms, then 9 rounds take 50ms.
+    clock = iter([0, 0.005, 0, 0.1, 0, 0.05]).__next__
+    assert calibrate(target_ms=64, clock=clock) == 9
+    assert calibrate(target_ms=0.001) == hashing.MIN_ROUNDS
+
+
+def test_from_settings_rounds(monkeypatch):
+    executor = HashingExecutor.from_settings({})
+    assert executor.hasher.rounds == hashing.DEFAULT_ROUNDS
+    executor = HashingExecutor.from_settings({"hashing": {"bcrypt_rounds": 8}})
+    assert executor.hasher.rounds == 8
+    monkeypatch.setattr(hashing, "calibrate", lambda target_ms: 7)
+    executor = HashingExecutor.from_settings({"hashing": {"target_ms": 100}})
+    assert executor.hasher.rounds == 7
+    assert executor.stats()["algorithm"] == "bcrypt"
+    assert executor.stats()["parameters"] == {"rounds": 7}
+
+
+async def test_rehash_in_background():
+    executor = HashingExecutor(workers=1, hasher=BcryptHasher(4))
+    old_hash = hash_password(b"secret", 5).decode()
+    assert executor.needs_rehash(old_hash)
+    stored = []
+
+    async def store(new_hash):
+        stored.append(new_hash)
+
+    async def fail(new_hash):
+        raise ConnectionError("Database looks down.")
+
+    executor.rehash_in_background("secret", store)
+    executor.rehash_in_background("secret", fail)
+    await executor.join()
+    assert not executor.needs_rehash(stored[0])
+    assert verify(b"secret", stored[0].encode())
+    assert executor.stats()["rehashed"] == 1
+    executor.shutdown()
+
+
+def test_scrypt():
+    hasher = ScryptHasher(n=2**4, r=2, p=1)
+    hashed = hasher.hash(b"secret")
+    assert hashed.startswith(b"$scrypt$ln=4,r=2,p=1$")
+    assert hashed != hasher.hash(b"secret")  # Salted
+    assert identify(hashed) is ScryptHasher
+    assert ScryptHasher.is_valid(hashed)
+    assert verify(b"secret", hashed)
+    assert not verify(b"not secret", hashed)
+    assert not hasher.needs_rehash(hashed)
+    assert ScryptHasher(n=2**5, r=2, p=1).needs_rehash(hashed)
+    assert hasher.needs_rehash(hash_password(b"secret", 4))
+    assert BcryptHasher(4).needs_rehash(hashed)
+
+
+@pytest.mark.parametrize(
+    "encoded",
+    [b"$scrypt$", b"$scrypt$ln=4,r=2$c2FsdA==$a2V5", b"$scrypt$ln=4,r=2,p=1$!!$a2V5"],
+)
+def test_scrypt_malformed(encoded):
+    with pytest.raises(ValueError):
+        verify(b"secret", encoded)
+    assert ScryptHasher().needs_rehash(encoded)
+    assert not ScryptHasher.is_valid(encoded)
+
+
+def test_scrypt_n_power_of_two():
+    with pytest.raises(ValueError):
+        ScryptHasher(n=1000)
+
+
+def test_from_settings_algorithm():
+    executor = HashingExecutor.from_settings(
+        {"hashing": {"algorithm": "scrypt", "scrypt_n": 2**4, "scrypt_r": 2}}
+    )
+    assert executor.stats()["parameters"] == {"n": 16, "r": 2, "p": 1}
+    with pytest.raises(ValueError):
+        HashingExecutor.from_settings({"hashing": {"algorithm": "md5"}})
+
+
+async def test_check_any_known_hash():
+    executor = HashingExecutor(workers=1, hasher=ScryptHasher(n=2**4, r=2))
+    hashed = await executor.hash_password("secret")
+    assert hashed.startswith("$scrypt$")
+    old_hash = hash_password(b"secret", 4).decode()
+    assert await executor.check_password("secret", old_hash)
+    assert await executor.check_password("secret", hashed)
+    assert executor.needs_rehash(old_hash)
+    assert not executor.needs_rehash(hashed)
+    executor.shutdown()
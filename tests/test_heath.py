@@ -16,3 +16,9 @@ async def test_health_bad_db(client, monkeypatch):
     assert response.status == 200
     body = await response.json()
     assert body["status"] == "red"
+
+
+async def test_health_hashing_stats(client):
+    response = await client.get("/health")
+    body = await response.json()
+    assert body["hashing"]["queue_depth"] == 0
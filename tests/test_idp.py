@@ -18,3 +18,13 @@ def test_import_idp():
         idp.import_idp("kisee.kisee.kisee.UnknownClass")
     with pytest.raises(ImportError):
         idp.import_idp("kisee.providers.demo.UnknownClass")
+
+
+def test_load_idp():
+    """Test building a provider, possibly wrapped, from its settings
+    """
+    section = {"class": "kisee.providers.demo.DemoBackend", "options": {}}
+    backend = idp.load_idp(section)
+    assert not isinstance(backend, idp.ProviderWrapper)
+    backend = idp.load_idp({**section, "cache": {"ttl": 5}})
+    assert backend.cache.ttl == 5
@@ -0,0 +1,164 @@
+import io
+import json
+import sys
+
+import pytest
+
+from kisee import importer
+from kisee.hashing import HashingExecutor, verify
+from kisee.identity_provider import NotSupported, ProviderWrapper, UserRecord
+from kisee.providers.demo import DemoBackend
+
+HASHED = "$2b$04$Ktc5Lh3AYpU0OO97e7pDXuVDrXVBFZ0HeR/oYBM.SLQdbePmVDmh2"  # secret
+
+CSV = f"""username,email,password,is_superuser
+alice,alice@example.com,{HASHED},yes
+bob,bob@example.com,bobpassword,
+root,root2@example.com,{HASHED},
+,,,
+carol,carol@example.com,{HASHED},0
+"""
+
+
+class BulkBackend(DemoBackend):
+    """Stores records as is, like a database would."""
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.records = {}
+        self.batches = 0
+
+    async def bulk_insert_users(self, users):
+        self.batches += 1
+        skipped = []
+        for user in users:
+            if user.username in self.storage or user.username in self.records:
+                skipped.append(user)
+            else:
+                self.records[user.username] = user
+        return skipped
+
+
+async def test_import_csv(monkeypatch):
+    monkeypatch.setattr(
+        importer,
+        "_hash_passwords",
+        lambda passwords, hasher: ["$2b$hashed"] * len(passwords),
+    )
+    backend = BulkBackend({})
+    rejects = io.StringIO()
+    progress = io.StringIO()
+    job = importer.Importer(
+        backend, HashingExecutor("thread", 2), batch_size=2, rejects=rejects
+    )
+    await job.run(importer.read_csv(io.StringIO(CSV)), progress=progress)
+    assert job.stats() == {"rows": 5, "inserted": 3, "duplicates": 1, "invalid": 1}
+    assert backend.batches == 3
+    assert backend.records["alice"] == UserRecord(
+        "alice", "alice@example.com", HASHED, True
+    )
+    assert backend.records["bob"].password == "$2b$hashed"
+    assert not backend.records["carol"].is_superuser
+    reasons = [json.loads(line)["reason"] for line in rejects.getvalue().splitlines()]
+    assert len(reasons) == 2 and "duplicate username or email" in reasons
+    assert "3 inserted, 1 duplicates, 1 invalid" in progress.getvalue()
+
+
+async def test_import_hashes_plaintext_passwords():
+    backend = BulkBackend({})
+    job = importer.Importer(
+        ProviderWrapper(backend), HashingExecutor("thread", 2), batch_size=1
+    )
+    rows = importer.read_jsonl(
+        io.StringIO(
+            '{"username": "alice", "email": "a@example.com", "password": "secret"}\n'
+            "\n"
+            '{"username": "bob", "email": "b@example.com", "password": 42}\n'
+            '["not", "an", "object"]\n'
+        )
+    )
+    await job.run(rows)
+    assert job.stats()["invalid"] == 2
+    assert verify(b"secret", backend.records["alice"].password.encode())
+
+
+async def test_import_rejects_malformed_hashes():
+    backend = BulkBackend({})
+    rejects = io.StringIO()
+    job = importer.Importer(backend, HashingExecutor("thread", 1), rejects=rejects)
+    rows = [
+        {"username": "alice", "email": "a@example.com", "password": "$2b$04$short"},
+        {"username": "bob", "email": "b@example.com", "password": "$scrypt$ln=4"},
+        {"username": "carol", "email": "c@example.com", "password": HASHED},
+        ["not", "an", "object"],
+    ]
+    await job.run(rows)
+    assert job.stats() == {"rows": 4, "inserted": 1, "duplicates": 0, "invalid": 3}
+    assert list(backend.records) == ["carol"]
+    rejected = [json.loads(line) for line in rejects.getvalue().splitlines()]
+    assert [reject["reason"] for reject in rejected[:2]] == [
+        "malformed password hash"
+    ] * 2
+    assert rejected[0]["row"] == {"username": "alice", "email": "a@example.com"}
+    assert rejected[2]["row"] == ["not", "an", "object"]
+
+
+def test_chunks():
+    assert importer._chunks([], 4) == []
+    assert importer._chunks([1, 2, 3], 2) == [[1, 2], [3]]
+    assert importer._chunks([1, 2], 8) == [[1], [2]]
+
+
+async def test_run_needs_bulk_support(tmp_path):
+    users = tmp_path / "users.jsonl"
+    users.write_text(
+        json.dumps({"username": "alice", "email": "a@example.com", "password": HASHED})
+    )
+    args = importer.parse_args([str(users), "--settings", "tests/test_settings.toml"])
+    with pytest.raises(NotSupported):
+        await importer.run(args)
+
+
+async def test_run(tmp_path, monkeypatch):
+    backend = BulkBackend({})
+    monkeypatch.setattr(importer, "load_idp", lambda section: backend)
+    users = tmp_path / "users.csv"
+    users.write_text(CSV)
+    args = importer.parse_args([str(users), "--settings", "tests/test_settings.toml"])
+    job = await importer.run(args)
+    assert job.stats()["inserted"] == 3
+    assert "bob" in backend.records
+
+
+async def test_run_with_rejects(tmp_path, monkeypatch):
+    backend = BulkBackend({})
+    monkeypatch.setattr(importer, "load_idp", lambda section: backend)
+    users = tmp_path / "users.csv"
+    users.write_text(CSV)
+    rejects = tmp_path / "rejects.jsonl"
+    args = importer.parse_args(
+        [str(users), "--settings", "tests/test_settings.toml"]
+        + ["--rejects", str(rejects)]
+    )
+    await importer.run(args)
+    assert args.rejects.closed
+    rejected = [json.loads(line) for line in rejects.read_text().splitlines()]
+    assert len(rejected) == 2
+    assert all("password" not in reject["row"] for reject in rejected)
+
+
+async def test_run_from_stdin(monkeypatch):
+    backend = BulkBackend({})
+    monkeypatch.setattr(importer, "load_idp", lambda section: backend)
+    stdin = io.StringIO(CSV)
+    monkeypatch.setattr(sys, "stdin", stdin)
+    args = importer.parse_args(["-", "--settings", "tests/test_settings.toml"])
+    job = await importer.run(args)
+    assert job.stats()["inserted"] == 3
+    assert not stdin.closed
+
+
+async def test_import_nothing():
+    job = importer.Importer(BulkBackend({}), HashingExecutor("thread", 1))
+    await job.run([])
+    assert job.stats()["rows"] == 0
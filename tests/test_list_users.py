@@ -0,0 +1,103 @@
+from yarl import URL
+
+from kisee.identity_provider import NotSupported, ProviderWrapper
+from kisee.providers.demo import DemoBackend
+
+
+async def test_demo_list_users():
+    backend = DemoBackend({})
+    for username in "dave", "bob", "carol", "alice":
+        await backend.register_user(username, "password", f"{username}@example.com")
+    idp = ProviderWrapper(backend)
+    users = await idp.list_users(None, 2)
+    assert [user.username for user in users] == ["alice", "bob"]
+    users = await idp.list_users("bob", 2)
+    assert [user.username for user in users] == ["carol", "dave"]
+    users = await idp.list_users("box", 10)
+    assert [user.username for user in users] == ["carol", "dave", "root"]
+    assert await idp.list_users("root", 10) == []
+
+
+async def test_list_users_pages(client, root_auth):
+    backend = client.app["identity_backend"]
+    for username in "dave", "bob", "carol", "alice":
+        await backend.register_user(username, "password", f"{username}@example.com")
+    seen = []
+    url = "/users/?limit=2"
+    while url:
+        response = await client.get(url, headers=root_auth)
+        assert response.status == 200
+        assert response.headers["Cache-Control"] == "no-store"
+        body = await response.json()
+        assert len(body["users"]) <= 2
+        seen.extend(user["username"] for user in body["users"])
+        url = body.get("next") and URL(body["next"]).path_qs
+    assert seen == ["alice", "bob", "carol", "dave", "root"]
+
+
+async def test_list_users_coreapi(client, root_auth):
+    headers = root_auth
+    headers["Accept"] = "application/coreapi+json"
+    response = await client.get("/users/?limit=1", headers=headers)
+    body = await response.json()
+    assert body["_meta"]["url"].endswith("/users/?limit=1")
+    assert body["users"] == [
+        {
+            "user_id": "root",
+            "username": "root",
+            "email": "root@example.com",
+            "is_superuser": True,
+        }
+    ]
+    assert "next" not in body
+
+
+async def test_list_users_bad_limit(client, root_auth):
+    for limit in "many", "0", "1001":
+        response = await client.get(f"/users/?limit={limit}", headers=root_auth)
+        assert response.status == 400
+
+
+async def test_list_users_needs_superuser(client, basic):
+    backend = client.app["identity_backend"]
+    await backend.register_user("toto", "tata", "toto@example.com")
+    response = await client.get(
+        "/users/?limit=10", headers={"Authorization": basic("toto", "tata")}
+    )
+    assert response.status == 403
+
+
+async def test_list_users_needs_authentication(client):
+    response = await client.get("/users/?after=alice")
+    assert response.status == 401
+
+
+async def test_get_users_as_user(client, basic):
+    backend = client.app["identity_backend"]
+    await backend.register_user("toto", "tata", "toto@example.com")
+    for password in "tata", "wrong":
+        response = await client.get(
+            "/users/",
+            headers={
+                "Authorization": basic("toto", password),
+                "Accept": "application/json",
+            },
+        )
+        assert response.status == 200
+        assert (await response.json())["users"] == []
+
+
+async def test_list_users_not_implemented(client, monkeypatch, root_auth):
+    async def list_users(after, limit):
+        raise NotSupported
+
+    monkeypatch.setattr(client.app["identity_backend"], "list_users", list_users)
+    response = await client.get("/users/", headers=root_auth)
+    assert response.status == 501
+
+
+async def test_anonymous_get_users(client):
+    response = await client.get("/users/")
+    assert response.status == 200
+    assert response.headers["Vary"].startswith("Accept, Authorization")
+    assert (await response.json())["users"] == []
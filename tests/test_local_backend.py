@@ -0,0 +1,125 @@
+import pytest
+
+from kisee.hashing import BcryptHasher, HashingExecutor, hash_password
+from kisee.identity_provider import UserAlreadyExist, UserRecord
+from kisee.providers.local import LOG, SNAPSHOT, LocalBackend
+
+
+def local_backend(path, **options):
+    backend = LocalBackend({"path": str(path), **options})
+    backend.hashing = HashingExecutor(workers=1, hasher=BcryptHasher(4))
+    return backend
+
+
+async def test_register_and_identify(tmp_path):
+    async with local_backend(tmp_path) as backend:
+        await backend.register_user("alice", "secret", "alice@example.com")
+        assert await backend.is_connection_alive()
+        user = await backend.identify("alice", "secret")
+        assert user.username == "alice"
+        assert user.password != "secret"
+        assert (await backend.identify("alice@example.com", "secret")) is user
+        assert await backend.identify("alice", "wrong") is None
+        assert await backend.identify("bob", "secret") is None
+        assert (await backend.get_user_by_email("alice@example.com")) is user
+        assert (await backend.get_user_by_username("alice")) is user
+        assert await backend.get_users_by_usernames(["bob", "alice"]) == [user]
+        with pytest.raises(UserAlreadyExist):
+            await backend.register_user("alice", "secret", "other@example.com")
+        with pytest.raises(UserAlreadyExist):
+            await backend.register_user("other", "secret", "alice@example.com")
+        await backend.send_reset_password_challenge(user, "challenge")
+    assert not await backend.is_connection_alive()
+
+
+async def test_persistence(tmp_path):
+    async with local_backend(tmp_path) as backend:
+        await backend.register_user("alice", "secret", "alice@example.com")
+        await backend.register_user("bob", "secret", "bob@example.com", True)
+        user = await backend.get_user_by_username("alice")
+        await backend.set_password_for_user(user, "new secret")
+    async with local_backend(tmp_path) as backend:
+        assert backend.stats() == {"users": 2, "logged": 3, "snapshots": 0}
+        assert await backend.identify("alice", "new secret")
+        assert (await backend.identify("bob", "secret")).is_superuser
+        users = await backend.list_users(None, 10)
+        assert [user.username for user in users] == ["alice", "bob"]
+
+
+async def test_snapshot(tmp_path):
+    async with local_backend(tmp_path, snapshot_every=2) as backend:
+        for name in "abc":
+            await backend.register_user(name * 3, "secret", f"{name}@example.com")
+        assert backend.stats() == {"users": 3, "logged": 1, "snapshots": 1}
+        assert len((tmp_path / SNAPSHOT).read_bytes().splitlines()) == 2
+        assert len((tmp_path / LOG).read_bytes().splitlines()) == 1
+    async with local_backend(tmp_path) as backend:
+        assert [user.username async for user in backend.iter_users()] == [
+            "aaa",
+            "bbb",
+            "ccc",
+        ]
+        assert [user.username for user in await backend.list_users("aaa", 1)] == ["bbb"]
+
+
+async def test_incomplete_log(tmp_path):
+    async with local_backend(tmp_path) as backend:
+        await backend.register_user("alice", "secret", "alice@example.com")
+    with open(tmp_path / LOG, "ab") as log:
+        log.write(b'["crashed","while","writing')
+    async with local_backend(tmp_path) as backend:
+        assert backend.stats()["users"] == 1
+        await backend.register_user("bob", "secret", "bob@example.com")
+    async with local_backend(tmp_path) as backend:
+        assert backend.stats()["users"] == 2
+
+
+async def test_bulk_insert_users(tmp_path):
+    hashed = hash_password(b"secret", 4).decode()
+    async with local_backend(tmp_path) as backend:
+        await backend.register_user("alice", "secret", "alice@example.com")
+        skipped = await backend.bulk_insert_users(
+            [
+                UserRecord("alice", "other@example.com", hashed),
+                UserRecord("bob", "bob@example.com", hashed, True),
+                UserRecord("bob", "bob2@example.com", hashed),
+                UserRecord("carol", "bob@example.com", hashed),
+            ]
+        )
+        assert [record.email for record in skipped] == [
+            "other@example.com",
+            "bob2@example.com",
+            "bob@example.com",
+        ]
+        assert await backend.bulk_insert_users(skipped) == skipped
+        await backend.bulk_insert_users(
+            [UserRecord(name, f"{name}@example.com", hashed) for name in ("zeb", "abe")]
+        )
+        assert backend.usernames == ["abe", "alice", "bob", "zeb"]
+        assert [user.username for user in await backend.list_users("alice", 2)] == [
+            "bob",
+            "zeb",
+        ]
+        assert (await backend.identify("bob", "secret")).is_superuser
+
+
+async def test_rehash_on_login(tmp_path):
+    hashed = hash_password(b"secret", 5).decode()
+    async with local_backend(tmp_path) as backend:
+        await backend.bulk_insert_users([UserRecord("bob", "bob@example.com", hashed)])
+        assert await backend.identify("bob", "secret")
+        await backend.hashing.join()
+        assert not backend.hashing.needs_rehash(backend.users["bob"].password)
+        # Stale rehashes, for a changed password, are dropped.
+        await backend._replace_hash("bob", hashed, hashed)
+        await backend._replace_hash("nobody", hashed, hashed)
+        assert backend.users["bob"].password != hashed
+
+
+async def test_no_fsync(tmp_path):
+    backend = local_backend(tmp_path, snapshot_every=1, fsync=False)
+    async with backend:
+        await backend.register_user("alice", "secret", "alice@example.com")
+    await backend.__aexit__(None, None, None)  # Exiting twice is harmless.
+    async with local_backend(tmp_path) as backend:  # With an empty log.
+        assert backend.stats() == {"users": 1, "logged": 0, "snapshots": 0}
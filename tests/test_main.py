@@ -29,3 +29,8 @@ def test_parse_args():
         assert args.settings == "settings.toml"
     args = kisee.parse_args(["--settings", "hi.toml"])
     assert args.settings == "hi.toml"
+
+
+def test_parse_args_workers():
+    assert kisee.parse_args([]).workers is None
+    assert kisee.parse_args(["--workers", "4"]).workers == 4
@@ -0,0 +1,163 @@
+import argparse
+
+import pytest
+
+from postgres_backend import migrate as kisee_migrate
+from postgres_backend.migrate import (
+    LOCK_KEY,
+    connect,
+    list_migrations,
+    migrate,
+    parse_args,
+    run,
+)
+
+OPTIONS = {
+    "database": "kisee",
+    "user": "kisee",
+    "password": "secret",
+    "host": "localhost",
+    "port": 5432,
+}
+
+
+class FakeTransaction:
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def __aenter__(self):
+        self.connection.log.append("BEGIN")
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.connection.log.append("ROLLBACK" if exc_type else "COMMIT")
+
+
+class FakeConnection:
+    def __init__(self, applied=()):
+        self.applied = set(applied)
+        self.log = []
+
+    async def execute(self, query, *args):
+        if query.startswith("INSERT INTO schema_migrations"):
+            self.applied.add(args[0])
+        if "broken" in query:
+            raise RuntimeError("Syntax error.")
+        self.log.append((query.strip().split()[0], *args))
+
+    async def fetch(self, query):
+        return [{"version": version} for version in self.applied]
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    async def close(self):
+        self.log.append("CLOSE")
+
+
+def test_list_migrations():
+    migrations = list_migrations()
+    assert [migration.version for migration in migrations] == [1, 2]
+    assert str(migrations[0]) == "0001 create_users"
+    assert all(migration.path.exists() for migration in migrations)
+
+
+def test_list_migrations_of(tmp_path):
+    for name in "0010_b.sql", "0002_a.sql", "README", "3_c.sql.orig":
+        (tmp_path / name).write_text("SELECT 1;")
+    assert [str(migration) for migration in list_migrations(tmp_path)] == [
+        "0002 a",
+        "0010 b",
+    ]
+    (tmp_path / "02_duplicate.sql").write_text("SELECT 1;")
+    with pytest.raises(ValueError):
+        list_migrations(tmp_path)
+
+
+def test_parse_args():
+    args = parse_args([])
+    assert (args.settings, args.list, args.target) == ("settings.toml", False, None)
+    args = parse_args(["--settings", "kisee.toml", "--list", "--target", "2"])
+    assert (args.settings, args.list, args.target) == ("kisee.toml", True, 2)
+
+
+def migrations(tmp_path, *scripts):
+    for version, script in enumerate(scripts, start=1):
+        (tmp_path / f"{version:04d}_step.sql").write_text(script)
+    return list_migrations(tmp_path)
+
+
+async def test_migrate(tmp_path):
+    connection = FakeConnection(applied={1})
+    steps = migrations(tmp_path, "CREATE 1", "CREATE 2", "CREATE 3")
+    applied = await migrate(connection, steps, target=2)
+    assert applied == [steps[1]]
+    assert connection.log[0] == ("SELECT", LOCK_KEY)
+    assert connection.log[-1] == ("SELECT", LOCK_KEY)
+    assert ("CREATE",) in connection.log
+    assert await migrate(connection, steps) == [steps[2]]
+    assert await migrate(connection, steps) == []
+    assert connection.applied == {1, 2, 3}
+
+
+async def test_failed_migration(tmp_path):
+    connection = FakeConnection()
+    steps = migrations(tmp_path, "CREATE 1", "broken")
+    with pytest.raises(RuntimeError):
+        await migrate(connection, steps)
+    assert connection.applied == {1}
+    assert connection.log[-2:] == ["ROLLBACK", ("SELECT", LOCK_KEY)]
+
+
+async def test_connect(monkeypatch):
+    async def fake_connect(**kwargs):
+        return kwargs
+
+    monkeypatch.setattr(kisee_migrate.asyncpg, "connect", fake_connect)
+    assert await connect(OPTIONS) == OPTIONS
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    connection = FakeConnection(applied={1})
+
+    async def fake_connect(options):
+        assert options == OPTIONS
+        return connection
+
+    monkeypatch.setattr(kisee_migrate, "connect", fake_connect)
+    monkeypatch.setattr(
+        kisee_migrate,
+        "load_conf",
+        lambda path: {"identity_backend": {"options": OPTIONS}},
+    )
+    return connection
+
+
+async def test_run_list(connection, capsys):
+    await run(parse_args(["--list"]))
+    assert capsys.readouterr().out.splitlines() == [
+        "0001 create_users (applied)",
+        "0002 index_username_and_email (pending)",
+    ]
+    assert connection.log[-1] == "CLOSE"
+
+
+async def test_run(connection, capsys):
+    await run(parse_args([]))
+    assert capsys.readouterr().out == "Applied 0002 index_username_and_email\n"
+    assert connection.applied == {1, 2}
+    assert connection.log[-1] == "CLOSE"
+    await run(parse_args([]))
+    assert capsys.readouterr().out == "Nothing to migrate.\n"
+
+
+def test_main(monkeypatch, loop):
+    ran = []
+
+    async def fake_run(args):
+        ran.append(args)
+
+    monkeypatch.setattr(kisee_migrate, "run", fake_run)
+    monkeypatch.setattr("sys.argv", ["kisee-migrate", "--target", "1"])
+    kisee_migrate.main()
+    assert ran == [argparse.Namespace(settings="settings.toml", list=False, target=1)]
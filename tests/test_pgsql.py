@@ -0,0 +1,449 @@
+import asyncio
+import json
+
+import pytest
+from asyncpg import InterfaceError
+from asyncpg.exceptions import UniqueViolationError
+
+from kisee.hashing import BcryptHasher, HashingExecutor, hash_password
+from kisee.identity_provider import User, UserAlreadyExist, UserRecord
+from postgres_backend import pgsql
+
+OPTIONS = {
+    "user": "kisee",
+    "password": "secret",
+    "database": "kisee",
+    "host": "primary",
+    "port": 5432,
+    "notify_channel": "",
+}
+
+ALICE = {
+    "user_id": "1",
+    "username": "alice",
+    "email": "alice@example.com",
+    "is_superuser": False,
+}
+
+
+class FakeStatement:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def fetchrow(self, *args):
+        return self.pool.rows[0] if self.pool.rows else None
+
+
+class FakeTransaction:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        self.pool.queries.append("BEGIN")
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.pool.queries.append("COMMIT")
+
+
+class FakeConnection:
+    """Records the first word of its queries, returning the rows of
+    its pool, or raising the error of its pool.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.statements = {name: FakeStatement(pool) for name in pgsql.STATEMENTS}
+
+    async def execute(self, query, *args):
+        self.pool.queries.append(query.split()[0])
+        if self.pool.error is not None:
+            raise self.pool.error
+
+    async def executemany(self, query, args):
+        self.pool.queries.append(query.split()[0])
+
+    async def fetch(self, query, *args):
+        self.pool.queries.append(query.split()[0])
+        return self.pool.rows
+
+    async def fetchrow(self, query, *args):
+        self.pool.queries.append(query.split()[0])
+        return self.pool.rows[0] if self.pool.rows else None
+
+    async def cursor(self, query, prefetch):
+        self.pool.queries.append(query.split()[0])
+        for row in self.pool.rows:
+            yield row
+
+    async def copy_records_to_table(self, table, columns, records):
+        self.pool.queries.append("COPY")
+        self.pool.copied.extend(dict(zip(columns, record)) for record in records)
+
+    async def prepare(self, query):
+        return query
+
+    def transaction(self):
+        return FakeTransaction(self.pool)
+
+
+class FakeAcquire:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        self.pool.acquired += 1
+        return FakeConnection(self.pool)
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class FakePool:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.acquired = 0
+        self.queries = []
+        self.rows = []
+        self.copied = []
+        self.error = None
+        self.terminated = False
+
+    def acquire(self):
+        return FakeAcquire(self)
+
+    def terminate(self):
+        self.terminated = True
+
+    def get_size(self):
+        return 2
+
+    def get_idle_size(self):
+        return 1
+
+    def get_min_size(self):
+        return 1
+
+    def get_max_size(self):
+        return 10
+
+
+class DataStore(pgsql.DataStore):
+    async def send_reset_password_challenge(self, user, challenge):
+        pass  # pragma: no cover
+
+
+def data_store(monkeypatch, failing=(), **options):
+    store = DataStore({**OPTIONS, **options})
+    store.hashing = HashingExecutor(workers=1, hasher=BcryptHasher(4))
+    store.pools = []
+
+    async def create_pool(host, port):
+        if host in failing:
+            raise OSError(f"Can't reach {host}.")
+        pool = FakePool(host, port)
+        store.pools.append(pool)
+        return pool
+
+    monkeypatch.setattr(store, "_create_pool", create_pool)
+    return store
+
+
+async def test_replica_hosts(monkeypatch):
+    store = data_store(monkeypatch, replicas=["replica1", "replica2:5433"])
+    assert store.replica_hosts == [("replica1", 5432), ("replica2", 5433)]
+    async with store:
+        assert [(pool.host, pool.port) for pool in store.replicas] == [
+            ("replica1", 5432),
+            ("replica2", 5433),
+        ]
+        assert await store.is_connection_alive()
+        assert [pool.queries for pool in store.pools] == [["SELECT"]] * 3
+    assert all(pool.terminated for pool in store.pools)
+
+
+async def test_reads_go_to_replicas_in_turn(monkeypatch):
+    store = data_store(monkeypatch, replicas=["replica1", "replica2"])
+    async with store:
+        primary, replica1, replica2 = store.pools
+        readers = [store._reader("alice") for _ in range(4)]
+        assert readers == [replica1, replica2, replica1, replica2]
+        assert await store.get_user_by_username("alice") is None
+        assert await store.get_user_by_email("alice@example.com") is None
+        assert await store.identify("alice", "secret") is None
+        assert await store.list_users(None, 10) == []
+        assert (replica1.acquired, replica2.acquired) == (2, 2)
+        assert primary.acquired == 0
+
+
+async def test_reads_without_replicas(monkeypatch):
+    store = data_store(monkeypatch)
+    async with store:
+        [primary] = store.pools
+        assert store._reader("alice") is store._reader() is primary
+
+
+async def test_written_users_read_from_primary(monkeypatch):
+    store = data_store(monkeypatch, replicas=["replica"])
+    async with store:
+        primary, replica = store.pools
+        user = User("1", "Alice", "Alice@Example.com")
+        await store.set_password_for_user(user, "secret")
+        assert primary.queries == ["UPDATE"]
+        for key in "Alice", "alice", "ALICE@example.com":
+            assert store._reader(key) is primary
+        assert store._reader("bob") is replica
+        assert store._reader("bob", "alice") is primary
+        assert store.stats()["pinned"] == 2
+
+
+async def test_read_after_write_window(monkeypatch):
+    store = data_store(monkeypatch, replicas=["replica"], read_after_write_window=0)
+    async with store:
+        primary, replica = store.pools
+        store._pin("alice")
+        assert store._reader("alice") is replica
+
+
+async def test_create_pool(monkeypatch):
+    created = []
+
+    async def create_pool(**options):
+        created.append(options)
+        return FakePool(options["host"], options["port"])
+
+    monkeypatch.setattr(pgsql.asyncpg, "create_pool", create_pool)
+    async with DataStore({**OPTIONS, "min_size": 2}) as store:
+        assert (store.pool.host, store.pool.port) == ("primary", 5432)
+    [options] = created
+    assert (options["min_size"], options["max_size"]) == (2, 10)
+    assert options["connection_class"] is pgsql.Connection
+    assert options["init"] is pgsql.Connection.prepare_statements
+
+
+async def test_prepare_statements():
+    connection = FakeConnection(FakePool("primary", 5432))
+    await pgsql.Connection.prepare_statements(connection)
+    assert connection.statements == pgsql.STATEMENTS
+
+
+async def test_not_started():
+    store = DataStore(OPTIONS)
+    await store.__aexit__(None, None, None)
+    assert not await store.is_connection_alive()
+
+
+async def test_connection_lost(monkeypatch):
+    async with data_store(monkeypatch) as store:
+        store.pool.error = OSError("Connection refused.")
+        assert not await store.is_connection_alive()
+
+
+async def test_identify(monkeypatch):
+    store = data_store(monkeypatch, notify_channel="kisee_users")
+    async with store:
+        hashed = hash_password(b"secret", 5).decode()
+        store.pool.rows = [{**ALICE, "password": hashed, "precedence": 0}]
+        assert await store.identify("alice", "wrong") is None
+        user = await store.identify("alice", "secret")
+        assert (user.user_id, user.username) == ("1", "alice")
+        await store.hashing.join()
+        # Rehashed with 4 rounds, and notified.
+        assert store.pool.queries == ["UPDATE", "SELECT"]
+        assert store.pinned.get("alice@example.com")
+        store.pool.rows[0]["password"] = hash_password(b"secret", 4).decode()
+        assert await store.identify("alice", "secret")
+        await store.hashing.join()
+        assert store.pool.queries == ["UPDATE", "SELECT"]
+
+
+async def test_rehash_after_password_change(monkeypatch):
+    store = data_store(monkeypatch, notify_channel="kisee_users")
+    async with store:
+        await store._replace_hash("1", "old hash", "new hash")
+        assert store.pool.queries == ["UPDATE"]
+        assert store.stats()["pinned"] == store.stats()["notified"] == 0
+
+
+async def test_register_user(monkeypatch):
+    store = data_store(monkeypatch, replicas=["replica"])
+    async with store:
+        primary, _ = store.pools
+        await store.register_user("Alice", "secret", "alice@example.com")
+        assert primary.queries == ["INSERT"]
+        assert store._reader("alice") is primary
+        primary.error = UniqueViolationError("Duplicate username.")
+        with pytest.raises(UserAlreadyExist):
+            await store.register_user("alice", "secret", "other@example.com")
+
+
+async def test_bulk_reads(monkeypatch):
+    store = data_store(monkeypatch)
+    async with store:
+        store.pool.rows = [ALICE]
+        [user] = await store.get_users_by_usernames(["alice"])
+        assert user.username == "alice"
+        assert [user.username async for user in store.iter_users()] == ["alice"]
+        assert store.pool.queries == ["SELECT", "BEGIN", "SELECT", "COMMIT"]
+
+
+async def test_bulk_insert_users(monkeypatch):
+    store = data_store(monkeypatch, notify_channel="kisee_users", replicas=["replica"])
+    async with store:
+        primary, replica = store.pools
+        primary.rows = [ALICE]
+        alice = UserRecord("alice", "alice@example.com", "$2b$hash", user_id="1")
+        bob = UserRecord("bob", "bob@example.com", "$2b$hash")
+        assert await store.bulk_insert_users([alice, bob]) == [bob]
+        assert primary.queries == [
+            "BEGIN",
+            "CREATE",
+            "COPY",
+            "INSERT",
+            "SELECT",  # Notifications, sent on commit.
+            "COMMIT",
+        ]
+        assert [row["username"] for row in primary.copied] == ["alice", "bob"]
+        assert primary.copied[1]["user_id"]  # A new one.
+        assert store.stats()["notified"] == 1
+        assert store._reader("alice@example.com") is primary
+        assert store._reader("bob") is replica
+
+
+async def test_failing_replica_closes_opened_pools(monkeypatch):
+    store = data_store(
+        monkeypatch, failing=["replica2"], replicas=["replica1", "replica2"]
+    )
+    with pytest.raises(OSError):
+        await store.__aenter__()
+    assert [pool.host for pool in store.pools] == ["primary", "replica1"]
+    assert all(pool.terminated for pool in store.pools)
+
+
+async def test_stats(monkeypatch):
+    store = data_store(monkeypatch, replicas=["replica"])
+    assert store.stats() == {}
+    pool_stats = {"size": 2, "idle": 1, "min_size": 1, "max_size": 10}
+    async with store:
+        assert store.stats() == {
+            "pool": pool_stats,
+            "replicas": [pool_stats],
+            "pinned": 0,
+            "notified": 0,
+            "listening": False,
+        }
+
+
+class FakeListener:
+    def __init__(self):
+        self.listeners = {}
+        self.termination_listeners = []
+        self.terminated = False
+
+    async def add_listener(self, channel, callback):
+        self.listeners[channel] = callback
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+    def remove_termination_listener(self, callback):
+        self.termination_listeners.remove(callback)
+
+    def terminate(self):
+        self.terminated = True
+
+    def lose(self):
+        for callback in list(self.termination_listeners):
+            callback(self)
+
+
+def listening_store(monkeypatch, **options):
+    """A DataStore listening to changes, its next connections failing
+    with the errors of its connect_errors list.
+    """
+    store = data_store(monkeypatch, notify_channel="kisee_users", **options)
+    store.changes = []
+    store.on_change(lambda username, email: store.changes.append((username, email)))
+    store.listeners = []
+    store.connect_errors = []
+
+    async def connect(**kwargs):
+        if store.connect_errors:
+            raise store.connect_errors.pop(0)
+        listener = FakeListener()
+        store.listeners.append(listener)
+        return listener
+
+    monkeypatch.setattr(pgsql.asyncpg, "connect", connect)
+    monkeypatch.setattr(pgsql, "RELISTEN_DELAY", 0)
+    return store
+
+
+def payload(node, username="alice", email="alice@example.com"):
+    return json.dumps({"node": node, "username": username, "email": email})
+
+
+async def test_notifications(monkeypatch):
+    store = listening_store(monkeypatch, replicas=["replica"])
+    async with store:
+        primary, replica = store.pools
+        [listener] = store.listeners
+        notify = listener.listeners["kisee_users"]
+        notify(listener, 42, "kisee_users", payload(store.node_id))
+        assert store.changes == []  # Our own change.
+        assert store._reader("alice") is replica
+        notify(listener, 42, "kisee_users", payload("other"))
+        assert store.changes == [("alice", "alice@example.com")]
+        assert store._reader("Alice") is primary
+        await store.set_password_for_user(User("2", "bob", "bob@example.com"), "pw")
+        assert primary.queries == ["UPDATE", "SELECT"]
+        assert store.stats()["notified"] == 1
+        assert store.stats()["listening"]
+    assert listener.terminated
+    assert listener.termination_listeners == []
+
+
+async def test_malformed_notifications(monkeypatch, caplog):
+    store = listening_store(monkeypatch)
+    async with store:
+        [listener] = store.listeners
+        notify = listener.listeners["kisee_users"]
+        for malformed in (
+            "not json",
+            "[]",
+            json.dumps({"node": "other"}),
+            payload("other", username=42),
+            payload("other", email=None),
+        ):
+            notify(listener, 42, "kisee_users", malformed)
+        assert store.changes == []
+        assert store.stats()["pinned"] == 0
+        assert len(caplog.records) == 5
+
+
+async def test_listen_again(monkeypatch):
+    store = listening_store(monkeypatch)
+    async with store:
+        [lost] = store.listeners
+        store.connect_errors = [asyncio.TimeoutError(), InterfaceError("Closed.")]
+        lost.lose()
+        assert store.changes == [(None, None)]  # Changes may be missed.
+        assert not store.stats()["listening"]
+        relisten = store._relisten
+        await relisten
+        assert store.changes == [(None, None)] * 2
+        assert store.connect_errors == []
+        assert store.stats()["listening"]
+        assert store._relisten is None
+    assert store.listeners[1].terminated
+
+
+async def test_exit_while_listening_again(monkeypatch):
+    store = listening_store(monkeypatch)
+    async with store:
+        monkeypatch.setattr(pgsql, "RELISTEN_DELAY", 60)
+        store.listeners[0].lose()
+        relisten = store._relisten
+    with pytest.raises(asyncio.CancelledError):
+        await relisten
+    assert len(store.listeners) == 1
@@ -67,3 +67,10 @@ def test_default_boolean_input(monkeypatch: MonkeyPatch) -> None:
 def test_bad_boolean_input(monkeypatch: MonkeyPatch) -> None:
     with pytest.raises(ValueError):
         quickstart.boolean("world")
+
+
+def test_add_bcrypt_rounds(monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setattr(quickstart, "calibrate", lambda target_ms: target_ms // 10)
+    config: quickstart.Config = {"hashing": {"target_ms": 120}}
+    quickstart.add_bcrypt_rounds(config)
+    assert config == {"hashing": {"bcrypt_rounds": 12}}
@@ -26,3 +26,15 @@ def test_json_serializer():
         )
         == "username"
     )
+
+
+def test_negotiation_is_cached():
+    negotiating = serializers.Serializers(negotiation_cache_size=2)
+    negotiating(media_types={"application/json"}, default=True)(str)
+    assert negotiating["application/json"] is str
+    assert negotiating["application/json"] is str
+    assert negotiating["text/html"] is str  # Not acceptable, fallback to default.
+    assert negotiating._negotiated.stats()["hits"] == 1
+    negotiating(media_types={"text/html"}, default=False)(repr)
+    assert len(negotiating._negotiated) == 0
+    assert negotiating["text/html"] is repr
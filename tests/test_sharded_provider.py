@@ -0,0 +1,139 @@
+import pytest
+
+from kisee.hashing import BcryptHasher, HashingExecutor, hash_password
+from kisee.identity_provider import UserAlreadyExist, UserRecord, load_idp
+from kisee.providers.sharded import HashRing, ShardedProvider
+
+
+def test_hash_ring():
+    keys = [f"user{i}" for i in range(10_000)]
+    ring = HashRing(["a", "b", "c"])
+    before = {key: ring.node(key) for key in keys}
+    for node in "abc":
+        assert 0.2 < list(before.values()).count(node) / len(keys) < 0.45
+    ring = HashRing(["c", "a", "b", "d"])
+    after = {key: ring.node(key) for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    assert 0.15 < len(moved) / len(keys) < 0.35
+    assert {after[key] for key in moved} == {"d"}
+    with pytest.raises(ValueError):
+        HashRing([])
+
+
+def sharded(tmp_path, names="abc"):
+    backend = load_idp(
+        {
+            "class": "kisee.providers.sharded.ShardedProvider",
+            "options": {
+                "shards": [
+                    {
+                        "name": name,
+                        "class": "kisee.providers.local.LocalBackend",
+                        "options": {"path": str(tmp_path / name)},
+                    }
+                    for name in names
+                ],
+                "replicas": 16,
+            },
+        }
+    )
+    backend.hashing = HashingExecutor(workers=1, hasher=BcryptHasher(4))
+    return backend
+
+
+async def test_sharded_provider(tmp_path):
+    async with sharded(tmp_path) as backend:
+        for i in range(30):
+            await backend.register_user(f"user{i:02}", "secret", f"{i}@example.com")
+        assert await backend.is_connection_alive()
+        assert backend.hashing is backend.shards["a"].hashing
+        counts = [shard["users"] for shard in backend.stats()["shards"].values()]
+        assert sum(counts) == 30 and all(counts)
+        user = await backend.identify("user07", "secret")
+        assert user.email == "7@example.com"
+        assert backend.shard_for("user07").users["user07"] is user
+        assert (await backend.identify("7@example.com", "secret")) is user
+        i = next(
+            i
+            for i in range(30)
+            if backend.ring.node(f"{i}@example.com") != backend.ring.node(f"user{i:02}")
+        )
+        user_i = await backend.identify(f"{i}@example.com", "secret")
+        assert user_i.username == f"user{i:02}"
+        assert await backend.identify("7@example.com", "wrong") is None
+        assert await backend.identify("nobody@example.com", "secret") is None
+        assert (await backend.get_user_by_username("user07")) is user
+        assert (await backend.get_user_by_email("7@example.com")) is user
+        assert await backend.get_user_by_email("nobody@example.com") is None
+        with pytest.raises(UserAlreadyExist):
+            await backend.register_user("other", "secret", "7@example.com")
+        users = await backend.get_users_by_usernames(["user09", "nobody", "user01"])
+        assert [user.username for user in users] == ["user09", "user01"]
+        page = await backend.list_users("user04", 3)
+        assert [user.username for user in page] == ["user05", "user06", "user07"]
+        assert len([user async for user in backend.iter_users()]) == 30
+        await backend.set_password_for_user(user, "new secret")
+        assert await backend.identify("user07", "new secret")
+        await backend.send_reset_password_challenge(user, "challenge")
+
+
+async def test_sharded_email_index(tmp_path):
+    async with sharded(tmp_path) as backend:
+        await backend.register_user("alice", "secret", "alice@example.com")
+        assert backend.stats()["email_index"]["size"] == 1
+        # Stale entries, like after moving users, are looked up again.
+        other = next(name for name in "abc" if name != backend.ring.node("alice"))
+        backend.email_index.set("alice@example.com", other)
+        assert (await backend.get_user_by_email("alice@example.com")).username == (
+            "alice"
+        )
+        assert backend.email_index.get("alice@example.com") == backend.ring.node(
+            "alice"
+        )
+
+
+async def test_sharded_bulk_insert(tmp_path):
+    hashed = hash_password(b"secret", 4).decode()
+    async with sharded(tmp_path) as backend:
+        await backend.register_user("alice", "secret", "alice@example.com")
+        records = [UserRecord(f"user{i}", f"{i}@example.com", hashed) for i in range(9)]
+        skipped = await backend.bulk_insert_users(
+            [*records, UserRecord("alice", "other@example.com", hashed)]
+        )
+        assert [record.username for record in skipped] == ["alice"]
+        assert await backend.identify("user3", "secret")
+
+
+async def test_sharded_enter_failure(tmp_path):
+    (tmp_path / "c").write_text("Not a directory.")
+    backend = sharded(tmp_path)
+    with pytest.raises(OSError):
+        async with backend:
+            pass  # pragma: no cover
+    assert not await backend.shards["a"].is_connection_alive()
+
+
+def test_sharded_on_change(tmp_path):
+    backend = sharded(tmp_path)
+    subscribed = []
+    for shard in backend.backends:
+        shard.on_change = subscribed.append
+    callback = object()
+    backend.on_change(callback)
+    assert subscribed == [callback] * 3
+
+
+def test_sharded_forget(tmp_path):
+    backend = sharded(tmp_path)
+    forgotten = []
+    for shard in backend.backends:
+        shard.forget = lambda username, email: forgotten.append((username, email))
+    backend.forget("alice", "alice@example.com")
+    assert forgotten == [("alice", "alice@example.com")] * 3
+
+
+def test_sharded_default_names():
+    backend = ShardedProvider(
+        {"shards": [{"class": "kisee.providers.demo.DemoBackend"}] * 2}
+    )
+    assert list(backend.shards) == ["0", "1"]
@@ -0,0 +1,143 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from kisee.hashing import BcryptHasher, HashingExecutor, hash_password
+from kisee.identity_provider import UserAlreadyExist, UserRecord
+from kisee.providers import sqlite
+from kisee.providers.sqlite import SQLiteBackend
+
+
+def sqlite_backend(path, **options):
+    backend = SQLiteBackend({"path": str(path / "users.sqlite3"), **options})
+    backend.hashing = HashingExecutor(workers=1, hasher=BcryptHasher(4))
+    return backend
+
+
+async def test_register_and_identify(tmp_path):
+    async with sqlite_backend(tmp_path) as backend:
+        await backend.register_user("alice", "secret", "alice@example.com")
+        assert await backend.is_connection_alive()
+        user = await backend.identify("alice", "secret")
+        assert user.username == "alice"
+        assert not user.is_superuser
+        user = await backend.identify("alice@example.com", "secret")
+        assert user.username == "alice"
+        assert await backend.identify("alice", "wrong") is None
+        assert await backend.identify("bob", "secret") is None
+        assert (await backend.get_user_by_email("alice@example.com")).username == (
+            "alice"
+        )
+        assert (await backend.get_user_by_username("alice")).email == (
+            "alice@example.com"
+        )
+        assert await backend.get_user_by_email("bob@example.com") is None
+        assert await backend.get_user_by_username("bob") is None
+        with pytest.raises(UserAlreadyExist):
+            await backend.register_user("alice", "secret", "other@example.com")
+        with pytest.raises(UserAlreadyExist):
+            await backend.register_user("other", "secret", "alice@example.com")
+        await backend.send_reset_password_challenge(user, "challenge")
+    assert not await backend.is_connection_alive()
+
+
+async def test_identify_prefers_usernames(tmp_path):
+    async with sqlite_backend(tmp_path) as backend:
+        await backend.register_user("alice", "alicepw", "bob")
+        await backend.register_user("bob", "bobpw", "bob@example.com")
+        assert (await backend.identify("bob", "bobpw")).username == "bob"
+        assert await backend.identify("bob", "alicepw") is None
+
+
+async def test_batched_registrations(tmp_path):
+    async with sqlite_backend(
+        tmp_path, max_batch=8, batch_window=200, fsync=False
+    ) as backend:
+        results = await asyncio.gather(
+            *(
+                backend.register_user(f"user{i:02}", "secret", f"{i}@example.com")
+                for i in range(20)
+            ),
+            backend.register_user("user00", "secret", "dup@example.com"),
+            return_exceptions=True,
+        )
+        assert results[:20] == [None] * 20
+        assert isinstance(results[20], UserAlreadyExist)
+        assert backend.stats() == {"readers": 4, "batches": 3, "avg_batch_size": 7}
+        assert len(await backend.get_users_by_usernames(["user01", "nobody"])) == 1
+
+
+async def test_persistence_and_listing(tmp_path, monkeypatch):
+    monkeypatch.setattr(sqlite, "ITER_USERS_PAGE", 2)
+    monkeypatch.setattr(sqlite, "MAX_VARIABLES", 2)
+    async with sqlite_backend(tmp_path) as backend:
+        for name in "abc":
+            await backend.register_user(name * 3, "secret", f"{name}@example.com")
+        user = await backend.get_user_by_username("aaa")
+        await backend.set_password_for_user(user, "new secret")
+    async with sqlite_backend(tmp_path) as backend:
+        assert await backend.identify("aaa", "new secret")
+        assert [user.username async for user in backend.iter_users()] == [
+            "aaa",
+            "bbb",
+            "ccc",
+        ]
+        assert [user.username for user in await backend.list_users("aaa", 1)] == ["bbb"]
+        users = await backend.get_users_by_usernames(["aaa", "bbb", "ccc"])
+        assert len(users) == 3
+
+
+async def test_bulk_insert_users(tmp_path):
+    hashed = hash_password(b"secret", 4).decode()
+    async with sqlite_backend(tmp_path) as backend:
+        await backend.register_user("alice", "secret", "alice@example.com")
+        skipped = await backend.bulk_insert_users(
+            [
+                UserRecord("alice", "other@example.com", hashed),
+                UserRecord("bob", "bob@example.com", hashed, True, user_id="b0b"),
+                UserRecord("carol", "bob@example.com", hashed),
+            ]
+        )
+        assert [record.username for record in skipped] == ["alice", "carol"]
+        bob = await backend.identify("bob", "secret")
+        assert bob.is_superuser
+        assert bob.user_id == "b0b"
+
+
+async def test_rehash_on_login(tmp_path):
+    hashed = hash_password(b"secret", 5).decode()
+    async with sqlite_backend(tmp_path) as backend:
+        await backend.bulk_insert_users([UserRecord("bob", "bob@example.com", hashed)])
+        assert await backend.identify("bob", "secret")
+        await backend.hashing.join()
+        row = await backend._fetchone(sqlite.IDENTIFY, "bob", "bob")
+        assert not backend.hashing.needs_rehash(row["password"])
+
+
+async def test_pending_writes_committed_on_exit(tmp_path):
+    async with sqlite_backend(tmp_path, batch_window=60_000) as backend:
+        pending = backend._batcher.submit(
+            (sqlite.INSERT_USER, ("1", "bob", "bob@example.com", "hash", False))
+        )
+    assert await pending == 1
+    async with sqlite_backend(tmp_path) as backend:
+        assert await backend.get_user_by_username("bob")
+
+
+async def test_failed_batch(tmp_path):
+    async with sqlite_backend(tmp_path, max_batch=1) as backend:
+        cancelled = backend._batcher.submit(("SELECT 1", ()))
+        cancelled.cancel()
+        with pytest.raises(sqlite3.OperationalError):
+            await backend._batcher.submit(("INSERT INTO nowhere VALUES (?)", (1,)))
+        with pytest.raises(sqlite3.ProgrammingError):
+            await backend.run_writer(sqlite._bulk_insert, [("not", "enough")])
+        assert await backend.is_connection_alive()
+
+        async def broken(*args):
+            raise sqlite3.OperationalError("disk I/O error")
+
+        backend._fetchone = broken
+        assert not await backend.is_connection_alive()
+    await backend.__aexit__(None, None, None)  # Exiting twice is harmless.
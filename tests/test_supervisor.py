@@ -0,0 +1,110 @@
+import gc
+import os
+import signal
+import weakref
+
+import pytest
+
+from kisee import kisee
+from kisee.supervisor import Supervisor
+
+
+@pytest.fixture
+def supervisor(settings, monkeypatch):
+    supervisor = Supervisor(
+        dict(settings, server=dict(settings["server"], host="127.0.0.1", port=0)),
+        workers=2,
+        app_factory=kisee.create_app,
+        load_settings=lambda: settings,
+    )
+    supervisor.restart_delay = 0
+    spawned = []
+
+    def spawn():
+        pid = 1000 + len(spawned)
+        spawned.append(pid)
+        supervisor.children[pid] = supervisor.generation
+        return pid
+
+    monkeypatch.setattr(supervisor, "spawn", spawn)
+    killed = []
+    monkeypatch.setattr(supervisor, "kill", killed.extend)
+    supervisor.spawned, supervisor.killed = spawned, killed
+    yield supervisor
+    if hasattr(gc, "unfreeze"):  # pragma: no branch (Python 3.7+)
+        gc.unfreeze()  # prepare() froze the heap of the test process.
+
+
+def test_bind(supervisor):
+    sock = supervisor.bind()
+    try:
+        assert sock.getsockname()[1] != 0
+    finally:
+        sock.close()
+    assert not supervisor.reuse_port
+
+
+def test_prepare(supervisor):
+    supervisor.prepare()
+    assert supervisor.app["settings"] is supervisor.settings
+
+
+def test_restart_crashed_worker(supervisor):
+    supervisor.spawn()
+    supervisor.on_exit(1000, 9)
+    assert supervisor.spawned == [1000, 1001]
+    assert list(supervisor.children) == [1001]
+
+
+def test_no_restart_when_stopping(supervisor):
+    supervisor.spawn()
+    supervisor._on_signal(signal.SIGTERM, None)
+    supervisor.on_exit(1000, 0)
+    assert supervisor.spawned == [1000]
+    assert not supervisor.children
+
+
+def test_reload(supervisor):
+    supervisor.spawn()
+    supervisor.spawn()
+    supervisor._on_signal(signal.SIGHUP, None)
+    assert supervisor.reloading
+    supervisor.reload()
+    assert supervisor.killed == [1000, 1001]
+    assert supervisor.children == {1000: 0, 1001: 0, 1002: 1, 1003: 1}
+    supervisor.on_exit(1000, 0)  # Old generation, not restarted.
+    assert len(supervisor.spawned) == 4
+
+
+def test_prepare_releases_previous_app(supervisor):
+    supervisor.prepare()
+    previous = weakref.ref(supervisor.app)
+    supervisor.prepare()
+    assert previous() is None
+
+
+def test_reap(supervisor, monkeypatch):
+    supervisor.spawn()
+    monkeypatch.setattr(os, "waitpid", lambda pid, options: (0, 0))
+    assert not supervisor.reap()
+    monkeypatch.setattr(os, "waitpid", lambda pid, options: (1000, 9))
+    assert supervisor.reap()
+    assert list(supervisor.children) == [1001]
+
+
+def test_reap_without_workers(supervisor, monkeypatch):
+    supervisor.spawn()
+
+    def waitpid(pid, options):
+        raise ChildProcessError
+
+    monkeypatch.setattr(os, "waitpid", waitpid)
+    assert not supervisor.reap()
+    assert list(supervisor.children) == [1001, 1002]
+    supervisor._on_signal(signal.SIGTERM, None)
+    assert not supervisor.reap()
+    assert not supervisor.children
+
+
+def test_kill_dead_worker():
+    Supervisor.kill([2**22 + 1])  # Above the default pid_max, no such process.
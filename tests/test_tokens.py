@@ -0,0 +1,187 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+
+from kisee.batching import Batching
+from kisee.tokens import TokenCodec, TokenPool, _b64encode, _run_batch
+
+
+@pytest.fixture
+def codec(settings):
+    return TokenCodec.from_settings(settings)
+
+
+def test_issue_and_verify(codec, settings):
+    token = codec.issue({"sub": "toto", "exp": datetime.utcnow() + timedelta(hours=1)})
+    assert codec.verify(token)["sub"] == "toto"
+    # Our tokens are readable by PyJWT, and PyJWT ones by us:
+    claims = jwt.decode(token, settings["jwt"]["public_key"], algorithms=["ES256"])
+    assert claims["sub"] == "toto"
+    token = jwt.encode({"sub": "tata"}, settings["jwt"]["private_key"], "ES256")
+    assert codec.verify(token)["sub"] == "tata"
+
+
+def test_verify_unusual_header(codec, settings):
+    token = jwt.encode(
+        {"sub": "toto"},
+        settings["jwt"]["private_key"],
+        "ES256",
+        headers={"kid": "42"},
+    )
+    assert codec.verify(token)["sub"] == "toto"
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        "foobar",
+        "é.é.é",
+        "a.b",
+        "{header}.!!!.xx",
+        "{header}.e30.AAAA",
+        "{header}.{payload}.{signature}x",
+        "{header}.{payload}.AAAA",
+    ],
+)
+def test_verify_garbage(codec, token):
+    valid = codec.issue({"sub": "toto"})
+    header, payload, signature = valid.split(".")
+    with pytest.raises(jwt.InvalidTokenError):
+        codec.verify(token.format(header=header, payload=payload, signature=signature))
+
+
+def test_verify_bad_signature(codec):
+    header, payload, signature = codec.issue({"sub": "toto"}).split(".")
+    other = codec.issue({"sub": "tata"}).split(".")[1]
+    with pytest.raises(jwt.InvalidSignatureError):
+        codec.verify(".".join((header, other, signature)))
+
+
+def _signed(codec, payload: bytes) -> str:
+    """Sign an arbitrary payload with the codec key."""
+    header = codec.issue({}).split(".")[0]
+    signing_input = (header + "." + _b64encode(payload).decode()).encode()
+    r, s = decode_dss_signature(
+        codec.private_key.sign(signing_input, ec.ECDSA(hashes.SHA256()))
+    )
+    raw = r.to_bytes(32, "big") + s.to_bytes(32, "big")
+    return signing_input.decode() + "." + _b64encode(raw).decode()
+
+
+def test_verify_times(codec):
+    now = int(time.time())
+    with pytest.raises(jwt.ExpiredSignatureError):
+        codec.verify(codec.issue({"exp": now - 10}))
+    with pytest.raises(jwt.ImmatureSignatureError):
+        codec.verify(codec.issue({"nbf": now + 10}))
+    for claims in {"exp": "tomorrow"}, {"exp": str(now + 10)}, {"nbf": True}:
+        with pytest.raises(jwt.DecodeError):
+            codec.verify(codec.issue(claims))
+    assert codec.verify(codec.issue({"exp": now + 10, "nbf": now - 10}))
+
+
+def test_verify_expires_like_pyjwt(codec, monkeypatch):
+    now = int(time.time())
+    monkeypatch.setattr(time, "time", lambda: now)
+    assert codec.verify(codec.issue({"exp": now + 1, "nbf": now}))
+    with pytest.raises(jwt.ExpiredSignatureError):  # PyJWT rejects exp <= now.
+        codec.verify(codec.issue({"exp": now}))
+
+
+def test_verify_non_object_payload(codec):
+    with pytest.raises(jwt.DecodeError):
+        codec.verify(_signed(codec, json.dumps([1, 2]).encode()))
+
+
+async def test_token_pool_inline(codec):
+    pool = TokenPool(codec)
+    token = await pool.issue({"sub": "toto"})
+    assert (await pool.verify(token))["sub"] == "toto"
+    stats = pool.stats()
+    assert (stats["workers"], stats["batches"], stats["avg_batch_size"]) == (0, 0, None)
+    pool.shutdown()
+
+
+async def test_token_pool_workers(codec):
+    pool = TokenPool(codec, workers=1, batching=Batching(0.01, 3))
+    try:
+        tokens = await asyncio.gather(*(pool.issue({"sub": str(i)}) for i in range(4)))
+        assert [codec.verify(token)["sub"] for token in tokens] == list("0123")
+        assert pool.stats()["batches"] == 2  # One full batch, one on timer.
+        claims = await asyncio.gather(*(pool.verify(token) for token in tokens))
+        assert [claim["sub"] for claim in claims] == list("0123")
+        with pytest.raises(jwt.DecodeError):
+            await pool.verify("foobar")
+    finally:
+        pool.shutdown()
+
+
+def test_token_pool_from_settings(settings):
+    settings = dict(settings, jwt=dict(settings["jwt"], workers=2, batch_window=5))
+    pool = TokenPool.from_settings(settings)
+    assert pool.workers == 2
+    assert pool._issuer.batching == Batching(window=0.005, max_batch=64)
+
+
+def test_run_batch(codec):
+    tokens = _run_batch("issue", codec.pem_keys, [{"sub": "a"}, {"sub": "b"}])
+    assert all(success for success, _ in tokens)
+    results = _run_batch("verify", codec.pem_keys, [tokens[0][1], "foobar"])
+    assert results[0] == (True, {"sub": "a"})
+    assert results[1][0] is False
+    assert isinstance(results[1][1], jwt.DecodeError)
+
+
+async def test_token_pool_no_batching(codec):
+    pool = TokenPool(codec, workers=1, batching=Batching(max_batch=1))
+    try:
+        assert codec.verify(await pool.issue({"sub": "toto"}))["sub"] == "toto"
+    finally:
+        pool.shutdown()
+
+
+async def test_token_pool_cache(codec, monkeypatch):
+    pool = TokenPool(codec, cache_size=2)
+    token = codec.issue({"sub": "toto", "exp": int(time.time()) + 60})
+    claims = await pool.verify(token)
+    claims["sub"] = "modified"  # Does not alter the cached claims.
+    assert (await pool.verify(token))["sub"] == "toto"
+    assert (await pool.verify(token.encode()))["sub"] == "toto"
+    assert pool.stats()["verified_cache"]["hits"] == 2
+    # Never cached past exp:
+    later = time.time() + 120
+    monkeypatch.setattr(time, "time", lambda: later)
+    pool.verified.clock = time.time
+    with pytest.raises(jwt.ExpiredSignatureError):
+        await pool.verify(token)
+
+
+async def test_token_pool_cache_fractional_exp(codec, monkeypatch):
+    now = 999.5
+    monkeypatch.setattr(time, "time", lambda: now)
+    pool = TokenPool(codec)
+    pool.verified.clock = time.time
+    token = codec.issue({"sub": "toto", "exp": 1000.7})
+    assert (await pool.verify(token))["sub"] == "toto"
+    now = 1000.3  # The codec compares int(exp), so it's expired.
+    with pytest.raises(jwt.ExpiredSignatureError):
+        codec.verify(token)
+    with pytest.raises(jwt.ExpiredSignatureError):
+        await pool.verify(token)
+
+
+async def test_authentication_uses_verified_cache(client, valid_jwt):
+    await client.app["identity_backend"].register_user("toto", "toto", "t@e.com")
+    for _ in range(2):
+        response = await client.get(
+            "/password_recoveries/", headers={"Authorization": "Bearer " + valid_jwt}
+        )
+        assert response.status == 200
+    assert client.app["tokens"].stats()["verified_cache"]["hits"] == 1
@@ -0,0 +1,61 @@
+import pytest
+
+from kisee.identity_provider import ProviderWrapper
+from kisee.providers.caching import CachingProvider
+from kisee.providers.demo import DemoBackend
+
+
+async def test_default_get_users_by_usernames():
+    backend = DemoBackend({})
+    await backend.register_user("toto", "tata", "toto@example.com")
+    users = await ProviderWrapper(backend).get_users_by_usernames(
+        ["toto", "nobody", "root"]
+    )
+    assert [user.username for user in users] == ["toto", "root"]
+
+
+async def test_cached_get_users_by_usernames(counting):
+    await counting.register_user("toto", "tata", "toto@example.com")
+    idp = CachingProvider(counting)
+    await idp.get_user_by_username("root")
+    users = await idp.get_users_by_usernames(["root", "toto", "nobody"])
+    assert [user.username for user in users] == ["root", "toto"]
+    assert counting.bulk_lookups == [["toto", "nobody"]]
+    users = await idp.get_users_by_usernames(["toto", "root"])
+    assert [user.username for user in users] == ["toto", "root"]
+    assert len(counting.bulk_lookups) == 1
+
+
+async def test_post_users_lookup(client, root_auth):
+    backend = client.app["identity_backend"]
+    await backend.register_user("toto", "tata", "toto@example.com")
+    response = await client.post(
+        "/users/lookup",
+        json={"usernames": ["toto", "nobody", "root", "toto"]},
+        headers=root_auth,
+    )
+    assert response.status == 200
+    body = await response.json()
+    assert [user["username"] for user in body["users"]] == ["toto", "root"]
+    assert body["users"][0]["email"] == "toto@example.com"
+    assert body["not_found"] == ["nobody"]
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [[], {"usernames": "toto"}, {"usernames": [42]}, {"usernames": ["a"] * 1001}],
+)
+async def test_post_users_lookup_bad_request(client, payload, root_auth):
+    response = await client.post("/users/lookup", json=payload, headers=root_auth)
+    assert response.status == 400
+
+
+async def test_post_users_lookup_needs_superuser(client, basic):
+    backend = client.app["identity_backend"]
+    await backend.register_user("toto", "tata", "toto@example.com")
+    response = await client.post(
+        "/users/lookup",
+        json={"usernames": ["root"]},
+        headers={"Authorization": basic("toto", "tata")},
+    )
+    assert response.status == 403